@@ -4,6 +4,7 @@ from task_models.task import (HierarchicalTask, SequentialCombination,
                       AlternativeCombination, LeafCombination,
                       ParallelCombination)
 from task_models.task_to_pomdp import CollaborativeAction, HTMToPOMDP
+from task_models.lib.cache import FileCache
 
 
 # Costs
@@ -61,7 +62,8 @@ h2p = HTMToPOMDP(T_WAIT, T_COMM, C_INTR, end_reward=R_END, loop=LOOP,
 p = h2p.task_to_pomdp(chair_task)
 #p.discount = .99
 
-gp = p.solve(method='grid', n_iterations=500, verbose=True)
+cache = FileCache(os.path.join(os.path.dirname(__file__), '.solver_cache'))
+gp = p.solve(method='grid', n_iterations=500, verbose=True, cache=cache)
 gp.save_as_json(os.path.join(os.path.dirname(__file__),
                              '../visualization/policy/json/test.json'))
 
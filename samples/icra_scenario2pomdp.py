@@ -4,6 +4,7 @@ from task_models.task_to_pomdp import HTMToPOMDP
 from task_models.stool_scenarios import (stool_task_sequential, T_WAIT, T_ASK,
                                          T_TELL, C_INTR)
 from task_models.lib.pomdp import GraphPolicyBeliefRunner
+from task_models.lib.cache import FileCache
 
 
 R_END = 0.1
@@ -15,7 +16,9 @@ PLOT = False
 h2p = HTMToPOMDP(T_WAIT, T_ASK, T_TELL, C_INTR, end_reward=R_END, loop=LOOP)
 p = h2p.task_to_pomdp(stool_task_sequential)
 
-gp = p.solve(method='grid', n_iterations=500, verbose=True)
+# Unchanged models are loaded from the cache instead of solved again
+cache = FileCache(os.path.join(os.path.dirname(__file__), '.solver_cache'))
+gp = p.solve(method='grid', n_iterations=500, verbose=True, cache=cache)
 gp.save_as_json(os.path.join(os.path.dirname(__file__),
                              '../visualization/policy/json/icra.json'))
 
@@ -6,13 +6,15 @@ import json
 import logging
 import argparse
 
+import numpy as np
 import matplotlib
 
 from expjobs.helpers import Launcher
 
 from task_models.lib.utils import NPEncoder
 from task_models.utils.multiprocess import repeat, get_process_elapsed_time
-from task_models.lib.pomcp import NTransitionsHorizon, POMCPPolicyRunner
+from task_models.lib.pomcp import (NTransitionsHorizon, BatchHorizon,
+                                   POMCPPolicyRunner)
 from task_models.supportive import NHTMHorizon
 
 
@@ -33,11 +35,27 @@ class FinishedOrNTransitionsHorizon(NTransitionsHorizon):
     def copy(self):
         return FinishedOrNTransitionsHorizon(self.model, self.n)
 
+    def batch(self, n):
+        return FinishedOrNTransitionsBatchHorizon(self.model,
+                                                  np.full((n,), self.n))
+
     @classmethod
     def generator(cls, model, n=100):
         return cls._Generator(cls, model, n)
 
 
+class FinishedOrNTransitionsBatchHorizon(BatchHorizon):
+
+    def __init__(self, model, n):
+        super(FinishedOrNTransitionsBatchHorizon, self).__init__(n)
+        self.model = model
+
+    def decrement(self, lanes, a, s, new_s, o):
+        self.n[lanes] -= 1
+        shift = self.model._int_to_state()._shift_htm
+        self.n[lanes[(new_s >> shift) == self.model.htm_final]] = 0
+
+
 def transition_summary(model, s, a, o, r, indent=""):
     return "{ind}{}: {} → {} [{}]\n".format(model._int_to_state(s),
                                             model.actions[a],
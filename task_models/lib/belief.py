@@ -1,3 +1,5 @@
+from collections import OrderedDict
+
 import numpy as np
 
 from .utils import assert_normal
@@ -14,25 +16,200 @@ class BaseBelief(object):
     def to_list(self):
         return self.array.tolist()
 
+    def sparse_histogram(self):
+        """Returns arrays of states with non-zero probabilities and their
+        probabilities.
+        """
+        states = np.flatnonzero(self.array)
+        return states, self.array[states]
+
+    @property
+    def nbytes(self):
+        """Approximate memory used by the belief."""
+        return self.array.nbytes
+
+
+class SuccessorCache(object):
+    """Bounded cache for belief successors, least recently used entries are
+    dropped first.
+
+    Successors are indexed by (belief, action, observation) so a cache must
+    only be shared by beliefs on the same model.
+
+    :param max_size: maximum number of stored successors
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0  # Of stored successors that have nbytes
+        self._successors = OrderedDict()
+
+    def __len__(self):
+        return len(self._successors)
+
+    def get(self, key, compute):
+        """Returns successor for key, calling compute() on cache misses."""
+        try:
+            successor = self._pop(key)
+            self.hits += 1
+        except KeyError:
+            successor = compute()
+            self.misses += 1
+        self.put(key, successor)
+        return successor
+
+    def put(self, key, successor):
+        """Stores an already computed successor."""
+        self.discard(key)
+        if len(self._successors) >= self.max_size:
+            self._forget(self._successors.popitem(last=False)[1])
+        self._successors[key] = successor
+        self.nbytes += getattr(successor, 'nbytes', 0)
+
+    def discard(self, key):
+        """Removes key if present."""
+        try:
+            self._pop(key)
+        except KeyError:
+            pass
+
+    def retain(self, keep):
+        """Removes entries which key does not satisfy keep(key)."""
+        for key in [k for k in self._successors if not keep(k)]:
+            self._pop(key)
+
+    def clear(self):
+        self._successors.clear()
+        self.nbytes = 0
+
+    def _pop(self, key):
+        successor = self._successors.pop(key)
+        self._forget(successor)
+        return successor
+
+    def _forget(self, successor):
+        self.nbytes -= getattr(successor, 'nbytes', 0)
+
 
 class ArrayBelief(BaseBelief):
+    """
+    :param probabilities: array of state probabilities (not to be modified)
+    :param successor_cache: optional SuccessorCache, shared with successors
+    """
 
-    def __init__(self, probabilities):
+    def __init__(self, probabilities, successor_cache=None):
         self.array = np.asarray(probabilities)
         assert_normal(self.array, name='probabilities')
+        self.successor_cache = successor_cache
+        self._hash = None
 
     def __hash__(self):
-        return hash(self.array.tostring())
+        if self._hash is None:
+            self._hash = hash(self.array.tobytes())
+        return self._hash
 
     def __eq__(self, other):
-        return (isinstance(other, ArrayBelief) and
+        return (self is other or
+                isinstance(other, ArrayBelief) and
                 (self.array == other.array).all())
 
     def sample(self):
         return np.random.choice(self.array.shape[0], p=self.array)
 
     def successor(self, model, a, o):
-        return ArrayBelief(model.belief_update(a, o, self.array))
+        if self.successor_cache is None:
+            return self._successor(model, a, o)
+        else:
+            return self.successor_cache.get(
+                (self, a, o), lambda: self._successor(model, a, o))
+
+    def _successor(self, model, a, o):
+        return ArrayBelief(model.belief_update(a, o, self.array),
+                           successor_cache=self.successor_cache)
+
+
+class SparseArrayBelief(BaseBelief):
+    """Exact belief stored as its support and the corresponding
+    probabilities.
+
+    Successors are computed by model.sparse_belief_update(a, o, states,
+    probabilities) which must return the same kind of pair.
+
+    :param states: integer array of states with non-zero probability
+    :param probabilities: array of probabilities for these states
+    :param n_states: number of states of the model
+    :param successor_cache: optional SuccessorCache, shared with successors
+    """
+
+    def __init__(self, states, probabilities, n_states, successor_cache=None):
+        self.states = np.asarray(states, dtype=np.int64)
+        self.probabilities = np.asarray(probabilities)
+        assert_normal(self.probabilities, name='probabilities')
+        self.n_states = n_states
+        self.successor_cache = successor_cache
+        self._cumulative = None
+        self._hash = None
+
+    @classmethod
+    def from_array(cls, array, **kwargs):
+        """:param kwargs: passed to the constructor"""
+        array = np.asarray(array)
+        states = np.flatnonzero(array)
+        return cls(states, array[states], array.shape[0], **kwargs)
+
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash((self.states.tobytes(),
+                               self.probabilities.tobytes()))
+        return self._hash
+
+    def __eq__(self, other):
+        return (self is other or
+                isinstance(other, SparseArrayBelief) and
+                np.array_equal(self.states, other.states) and
+                np.array_equal(self.probabilities, other.probabilities))
+
+    @property
+    def nbytes(self):
+        return self.states.nbytes + self.probabilities.nbytes
+
+    def _sample_indices(self, u):
+        if self._cumulative is None:
+            self._cumulative = self.probabilities.cumsum()
+        i = np.searchsorted(self._cumulative, u * self._cumulative[-1],
+                            side='right')
+        return np.minimum(i, self.states.shape[0] - 1)
+
+    def sample(self):
+        return int(self.states[self._sample_indices(np.random.random())])
+
+    def sample_batch(self, k):
+        """Returns an array of k states sampled at once."""
+        return self.states[self._sample_indices(np.random.random(k))]
+
+    def successor(self, model, a, o):
+        if self.successor_cache is None:
+            return self._successor(model, a, o)
+        else:
+            return self.successor_cache.get(
+                (self, a, o), lambda: self._successor(model, a, o))
+
+    def _successor(self, model, a, o):
+        states, probabilities = model.sparse_belief_update(
+            a, o, self.states, self.probabilities)
+        return SparseArrayBelief(states, probabilities, self.n_states,
+                                 successor_cache=self.successor_cache)
+
+    @property
+    def array(self):
+        a = np.zeros((self.n_states,))
+        a[self.states] = self.probabilities
+        return a
+
+    def sparse_histogram(self):
+        return self.states, self.probabilities
 
 
 class MaxSamplesReached(RuntimeError):
@@ -74,12 +251,18 @@ class _SuccessorSampler:
 
 
 class ParticleBelief(BaseBelief):
+    """Particles are stored as an integer array (part_states), histograms
+    are computed on first access.
+    """
 
     def __init__(self, sampler, n_states, n_particles=100):
         self.n_states = n_states
         self.n_particles = n_particles
         self.part_states = []
         self._populate(sampler)
+        self.part_states = np.array(self.part_states, dtype=np.int64)
+        self._array = None
+        self._sparse = None
 
     def _populate(self, sampler):
         try:
@@ -98,10 +281,18 @@ class ParticleBelief(BaseBelief):
                 e.msg = "Impossible to sample any particle."
                 raise e
 
+    @property
+    def nbytes(self):
+        return self.part_states.nbytes
+
     def sample(self, _max_index=None):
         if _max_index is None:
             _max_index = self.n_particles
-        return self.part_states[np.random.choice(_max_index)]
+        return int(self.part_states[np.random.randint(_max_index)])
+
+    def sample_batch(self, k):
+        """Returns an array of k particles sampled at once."""
+        return self.part_states[np.random.randint(self.n_particles, size=k)]
 
     def successor(self, model, a, o):
         sampler = _SuccessorSampler(model, self, a, o,
@@ -110,10 +301,112 @@ class ParticleBelief(BaseBelief):
 
     @property
     def array(self):
-        a = np.zeros((self.n_states))
-        for i in self.part_states:
-            a[i] += 1
-        return a / (a.sum() or 1.)
+        if self._array is None:
+            self._array = np.bincount(self.part_states,
+                                      minlength=self.n_states)
+            self._array = self._array / float(self.n_particles)
+        return self._array
+
+    def sparse_histogram(self):
+        """Same as BaseBelief.sparse_histogram, without a dense array."""
+        if self._sparse is None:
+            states, counts = np.unique(self.part_states, return_counts=True)
+            self._sparse = (states, counts / float(self.n_particles))
+        return self._sparse
+
+
+class WeightedParticleBelief(BaseBelief):
+    """Particle belief with importance weights, stored as arrays.
+
+    Successors are obtained by propagating all particles through the model
+    and weighting them by the likelihood of the observation, given by
+    model.observation_probability(a, states, new_states, o). Particles are
+    resampled (low variance resampling) when the effective sample size falls
+    under resample_threshold * n_particles.
+
+    :param sampler: function returning a state, to draw initial particles
+    :param n_states: number of states of the model
+    :param n_particles: number of particles
+    :param resample_threshold: fraction of n_particles under which the
+        effective sample size triggers resampling
+    """
+
+    def __init__(self, sampler, n_states, n_particles=100,
+                 resample_threshold=.5):
+        self.n_states = n_states
+        self.n_particles = n_particles
+        self.resample_threshold = resample_threshold
+        if sampler is not None:
+            self._set_particles(
+                np.array([sampler() for _ in range(n_particles)]),
+                np.full((n_particles,), 1. / n_particles))
+
+    def _set_particles(self, states, weights):
+        self.states = states
+        self.weights = weights
+        self._cumulative = None
+        self._sparse = None
+
+    @property
+    def effective_sample_size(self):
+        return 1. / (self.weights ** 2).sum()
+
+    @property
+    def nbytes(self):
+        return self.states.nbytes + self.weights.nbytes
+
+    def _sample_indices(self, u):
+        if self._cumulative is None:
+            self._cumulative = self.weights.cumsum()
+        i = np.searchsorted(self._cumulative, u * self._cumulative[-1],
+                            side='right')
+        return np.minimum(i, self.n_particles - 1)
+
+    def sample(self):
+        return int(self.states[self._sample_indices(np.random.random())])
+
+    def sample_batch(self, k):
+        """Returns an array of k particles sampled at once."""
+        return self.states[self._sample_indices(np.random.random(k))]
+
+    def resample(self):
+        """Low variance resampling, particles then have uniform weights."""
+        n = self.n_particles
+        i = self._sample_indices((np.random.random() + np.arange(n)) / n)
+        self._set_particles(self.states[i], np.full((n,), 1. / n))
+
+    def successor(self, model, a, o):
+        if hasattr(model, 'sample_transition_batch'):
+            new_states = model.sample_transition_batch(
+                np.full(self.states.shape, a), self.states)[0]
+        else:
+            new_states = np.array([model.sample_transition(a, s)[0]
+                                   for s in self.states])
+        weights = self.weights * model.observation_probability(
+            a, self.states, new_states, o)
+        total = weights.sum()
+        if total == 0.:
+            raise MaxSamplesReached(
+                a, o, self, msg="No particle is compatible with observation.")
+        b = WeightedParticleBelief(None, self.n_states, self.n_particles,
+                                   resample_threshold=self.resample_threshold)
+        b._set_particles(new_states, weights / total)
+        if (b.effective_sample_size <
+                self.resample_threshold * self.n_particles):
+            b.resample()
+        return b
+
+    @property
+    def array(self):
+        return np.bincount(self.states, weights=self.weights,
+                           minlength=self.n_states)
+
+    def sparse_histogram(self):
+        """Same as BaseBelief.sparse_histogram, without a dense array."""
+        if self._sparse is None:
+            states, i = np.unique(self.states, return_inverse=True)
+            self._sparse = (states, np.bincount(i, weights=self.weights))
+        return self._sparse
 
 
 def _format_p(x):
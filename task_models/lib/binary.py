@@ -0,0 +1,98 @@
+"""Binary storage of models and policies: a directory of .npy files with a
+small JSON header.
+
+The header holds the structure of the saved dictionary where each numpy
+array is replaced by a reference to its .npy file, so that arrays can be
+memory mapped on loading instead of being parsed.
+"""
+
+import os
+import json
+import shutil
+import tempfile
+
+import numpy as np
+
+from .py23 import replace
+
+
+HEADER = 'header.json'
+ARRAY_KEY = '__npy__'
+
+
+def _extract_arrays(x, arrays, name):
+    """Replaces arrays in x by references and stores them in arrays."""
+    if isinstance(x, np.ndarray):
+        if x.dtype.hasobject:
+            raise TypeError("Can't store object array {}.".format(name))
+        file_name = '{}.npy'.format(name)
+        arrays[file_name] = x
+        return {ARRAY_KEY: file_name}
+    elif isinstance(x, dict):
+        return {k: _extract_arrays(v, arrays, '{}.{}'.format(name, k))
+                for k, v in x.items()}
+    elif isinstance(x, (list, tuple)):
+        return [_extract_arrays(v, arrays, '{}.{}'.format(name, i))
+                for i, v in enumerate(x)]
+    else:
+        return x
+
+
+def _insert_arrays(x, path, mmap_mode):
+    if isinstance(x, dict):
+        if set(x) == {ARRAY_KEY}:
+            return np.load(os.path.join(path, x[ARRAY_KEY]),
+                           mmap_mode=mmap_mode)
+        return {k: _insert_arrays(v, path, mmap_mode) for k, v in x.items()}
+    elif isinstance(x, list):
+        return [_insert_arrays(v, path, mmap_mode) for v in x]
+    else:
+        return x
+
+
+def save_arrays(path, d):
+    """Saves a dictionary which values may be numpy arrays, or nested lists
+    and dictionaries of arrays, in directory path.
+
+    Files are written to a temporary sibling directory which then replaces
+    path, so that arrays already memory mapped from path are not modified
+    and a partially written directory is never loaded. An existing path
+    must be empty or previously written by save_arrays.
+    """
+    path = os.path.abspath(path)
+    if os.path.isdir(path) and os.listdir(path) and not os.path.isfile(
+            os.path.join(path, HEADER)):
+        raise ValueError("Won't replace {}, which was not written by "
+                         "save_arrays.".format(path))
+    parent, name = os.path.split(path)
+    tmp_path = tempfile.mkdtemp(dir=parent, prefix='.{}.'.format(name),
+                                suffix='.tmp')
+    try:
+        arrays = {}
+        header = _extract_arrays(d, arrays, 'array')
+        for file_name, a in arrays.items():
+            np.save(os.path.join(tmp_path, file_name), a)
+        with open(os.path.join(tmp_path, HEADER), 'w') as f:
+            json.dump(header, f)
+    except BaseException:
+        shutil.rmtree(tmp_path)
+        raise
+    if os.path.isdir(path):
+        # Directories can't be replaced atomically: move the old one aside
+        old_path = tempfile.mkdtemp(dir=parent, prefix='.{}.'.format(name),
+                                    suffix='.old')
+        replace(path, os.path.join(old_path, name))
+        replace(tmp_path, path)
+        shutil.rmtree(old_path)
+    else:
+        replace(tmp_path, path)
+
+
+def load_arrays(path, mmap_mode=None):
+    """Loads a dictionary saved by save_arrays.
+
+    :param mmap_mode: None | 'r' | 'r+' | 'c' (see numpy.load)
+    """
+    with open(os.path.join(path, HEADER)) as f:
+        header = json.load(f)
+    return _insert_arrays(header, path, mmap_mode)
@@ -0,0 +1,89 @@
+"""Upper bounds of POMDP values computed from T, O, and R.
+
+- MDP: value iteration on the underlying fully observable MDP,
+- QMDP: one alpha vector per action, from the MDP Q-values,
+- FIB: fast informed bound [Hauskrecht2000], tighter than QMDP since it
+  accounts for the next observation.
+
+All iterations are vectorized over states (and observations), and use
+the compact form of a sparse T.
+With a discount of 1 the bounds are computed for a horizon of n_iterations.
+"""
+
+import numpy as np
+
+from .sparse import SparseArray
+from .pbvi import _dense_or_sparse
+
+
+def _iterate(backup, q, n_iterations, tolerance):
+    for _ in range(n_iterations):
+        new_q = backup(q)
+        converged = np.abs(new_q - q).max() < tolerance
+        q = new_q
+        if converged:
+            break
+    return q
+
+
+def mdp_q_values(pomdp, n_iterations=1000, tolerance=1.e-6):
+    """Q-values of the underlying MDP.
+
+    :return: array of shape (n_actions, n_states)
+    """
+    r = pomdp.expected_rewards()
+    T = _dense_or_sparse(pomdp.T)
+
+    def backup(q):
+        if isinstance(T, SparseArray):
+            v = T.right_dot(q.max(0)).reshape(r.shape)
+        else:
+            v = T.dot(q.max(0))
+        return r + pomdp.discount * v
+
+    return _iterate(backup, np.zeros_like(r), n_iterations, tolerance)
+
+
+def mdp_values(pomdp, n_iterations=1000, tolerance=1.e-6):
+    """State values of the underlying MDP, as an array of shape (n_states,).
+    """
+    return mdp_q_values(pomdp, n_iterations=n_iterations,
+                        tolerance=tolerance).max(0)
+
+
+def qmdp_alphas(pomdp, n_iterations=1000, tolerance=1.e-6):
+    """QMDP alpha vectors (the MDP Q-values), one per action.
+
+    :return: array of shape (n_actions, n_states)
+    """
+    return mdp_q_values(pomdp, n_iterations=n_iterations, tolerance=tolerance)
+
+
+def fib_alphas(pomdp, n_iterations=1000, tolerance=1.e-6):
+    """Fast informed bound alpha vectors, one per action.
+
+    :return: array of shape (n_actions, n_states)
+    """
+    r = pomdp.expected_rewards()
+    T = pomdp.T
+    if not isinstance(T, SparseArray):
+        T = SparseArray.from_dense(T)
+    O = np.asarray(pomdp.O)
+    # Non-zero transitions of each row (a, s), padded to the longest row:
+    # for the j-th entry (a, s, z), columns[(a, s), j] = z and
+    # w[(a, s), o, j] = T[a, s, z] * O[a, z, o]
+    lengths = np.diff(T.indptr)
+    rows = np.repeat(np.arange(lengths.shape[0]), lengths)
+    positions = np.arange(T.nnz) - T.indptr[:-1][rows]
+    a, _, z = T.nonzero()
+    columns = np.zeros((lengths.shape[0], lengths.max()), dtype=np.int64)
+    columns[rows, positions] = z
+    w = np.zeros((lengths.shape[0], O.shape[-1], columns.shape[1]))
+    w[rows, :, positions] = T.data[:, None] * O[a, z]
+
+    def backup(q):
+        # g[(a, s), o, a'] = sum_z T[a, s, z] O[a, z, o] q[a', z]
+        g = np.matmul(w, q.T[columns])
+        return r + pomdp.discount * g.max(-1).sum(-1).reshape(r.shape)
+
+    return _iterate(backup, np.zeros_like(r), n_iterations, tolerance)
@@ -0,0 +1,152 @@
+"""On disk cache for solver results, indexed by content fingerprints."""
+
+import os
+import json
+import hashlib
+import tempfile
+
+import numpy as np
+
+from .py23 import replace, text_type, integer_types
+from .utils import NPEncoder
+
+
+def _update_hash(h, x):
+    """Text (str, unicode, or bytes) is hashed as UTF-8 bytes and integers
+    as int so that digests are the same with Python 2 and 3.
+    """
+    if isinstance(x, np.generic):
+        x = np.asarray(x)
+    if isinstance(x, np.ndarray):
+        x = np.ascontiguousarray(x)
+        h.update('array {} {}:'.format(x.dtype.str, x.shape).encode())
+        h.update(x.tobytes())
+    elif isinstance(x, (list, tuple)):
+        h.update('{} {}:'.format(type(x).__name__, len(x)).encode())
+        for y in x:
+            _update_hash(h, y)
+    elif isinstance(x, dict):
+        h.update('dict {}:'.format(len(x)).encode())
+        for k in sorted(x):
+            _update_hash(h, k)
+            _update_hash(h, x[k])
+    elif isinstance(x, (text_type, bytes)):
+        if isinstance(x, text_type):
+            x = x.encode('utf-8')
+        h.update('text {}:'.format(len(x)).encode())
+        h.update(x)
+    elif x is None:
+        h.update(b'none;')
+    elif isinstance(x, bool):
+        h.update('bool {};'.format(int(x)).encode())
+    elif isinstance(x, integer_types):
+        h.update('int {:d};'.format(x).encode())
+    elif isinstance(x, float):
+        h.update('float {!r};'.format(x).encode())
+    else:
+        raise TypeError("Can't fingerprint {}.".format(type(x)))
+
+
+def fingerprint(*objects):
+    """Stable hexadecimal digest of objects made of numpy arrays, lists,
+    tuples, dictionaries, and scalars.
+    """
+    h = hashlib.sha256()
+    _update_hash(h, objects)
+    return h.hexdigest()
+
+
+class FileCache(object):
+    """Directory of JSON files indexed by key (such as a fingerprint).
+
+    When the files take more than max_bytes the least recently used are
+    removed. Files are written to a temporary file then renamed so that the
+    directory may be shared between processes.
+
+    :param directory: path of the directory (created if needed)
+    :param max_bytes: maximum total size of cached files (None: no limit)
+    """
+
+    suffix = '.json'
+
+    def __init__(self, directory, max_bytes=100 * 2 ** 20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def _entries(self):
+        """List of (last use, size, path) for cached files."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(self.suffix):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:  # Removed by another process
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def __len__(self):
+        return len(self._entries())
+
+    def __contains__(self, key):
+        return os.path.isfile(self._path(key))
+
+    @property
+    def nbytes(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def get(self, key):
+        """Returns the stored value or None if key is not in the cache."""
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                value = json.load(f)
+            os.utime(path, None)  # Mark as recently used
+        except (IOError, OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Stores a value that can be serialized to JSON (numpy arrays and
+        scalars are converted to lists and numbers).
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(value, f, cls=NPEncoder)
+            replace(tmp_path, self._path(key))
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        self._evict()
+
+    def _evict(self):
+        if self.max_bytes is None:
+            return
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:  # Already removed by another process
+                pass
+            total -= size
+
+    def clear(self):
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,204 @@
+"""Point-based value iteration (PBVI) for tabular POMDPs, in numpy.
+
+The value function is represented by alpha vectors that are backed up on a
+finite set of beliefs [Pineau2003]. All backups of an iteration are computed
+at once from the arrays T, O, and R of the POMDP.
+"""
+
+import time
+
+import numpy as np
+
+from .pomdp import GraphPolicy
+from .sparse import SparseArray
+
+
+def _dense_or_sparse(a):
+    return a if isinstance(a, SparseArray) else np.asarray(a)
+
+
+def _transition_dot(T, a, x):
+    """T[a].dot(x) for a dense or sparse T."""
+    if isinstance(T, SparseArray):
+        n = T.shape[1]
+        return T.right_dot(x, start=a * n, stop=(a + 1) * n)
+    else:
+        return T[a].dot(x)
+
+
+def _joint_successors(pomdp, O, a, b):
+    """Array p of shape (n_states, n_observations) of joint probabilities of
+    next states and observations from belief b after action a.
+    """
+    states = np.flatnonzero(b)
+    return (pomdp._successor_probabilities(a, states, b[states])[:, None] *
+            O[a])
+
+
+def collect_beliefs(pomdp, n_beliefs=100, min_distance=1.e-3,
+                    max_tries=None, random_state=None):
+    """Collects beliefs reachable from the start belief by random actions.
+
+    :param min_distance: beliefs closer than that (in L1 norm) to an already
+        collected belief are discarded
+    :param max_tries: maximum number of successors to try (default to
+        10 * n_beliefs)
+    :return: array of shape (n, n_states) with n <= n_beliefs
+    """
+    rng = np.random.RandomState() if random_state is None else random_state
+    if max_tries is None:
+        max_tries = 10 * n_beliefs
+    O = np.asarray(pomdp.O)
+    beliefs = [np.asarray(pomdp.start, dtype=float)]
+    for _ in range(max_tries):
+        if len(beliefs) >= n_beliefs:
+            break
+        b = beliefs[rng.randint(len(beliefs))]
+        a = rng.randint(pomdp.n_actions)
+        p = _joint_successors(pomdp, O, a, b)
+        p_o = p.sum(0)
+        o = rng.choice(pomdp.n_observations, p=p_o / p_o.sum())
+        new_b = p[:, o] / p_o[o]
+        if np.abs(np.vstack(beliefs) - new_b).sum(-1).min() > min_distance:
+            beliefs.append(new_b)
+    return np.vstack(beliefs)
+
+
+def _projections(T, O, a, alphas, discount):
+    """Array g of shape (n_observations, n_alphas, n_states) such that
+    g[o, i, s] = discount * sum_z T[a, s, z] O[a, z, o] alphas[i, z].
+    """
+    n_s = O.shape[1]
+    x = O[a][:, :, None] * alphas.T[:, None, :]  # x[z, o, i]
+    g = _transition_dot(T, a, x.reshape((n_s, -1)))
+    return discount * g.reshape((n_s,) + x.shape[1:]).transpose((1, 2, 0))
+
+
+def _backup(beliefs, alphas, r, T, O, discount):
+    """Point-based backup of all beliefs.
+
+    Actions are processed one at a time so that intermediate arrays are at
+    most of shape (n_beliefs, n_observations, n_alphas).
+
+    :param T: dense or sparse transition array
+    :param O: dense observation array
+    :return: array of new alpha vectors (one per belief), corresponding
+        actions, and array of shape (n_beliefs, n_observations) of the
+        indices of the previous alpha vectors used for each observation
+    """
+    n_b, n_s = beliefs.shape
+    n_o = O.shape[-1]
+    best_values = np.full((n_b,), -np.inf)
+    new_alphas = np.zeros((n_b, n_s))
+    actions = np.zeros((n_b,), dtype=np.int64)
+    used = np.zeros((n_b, n_o), dtype=np.int64)
+    for a in range(r.shape[0]):
+        g = _projections(T, O, a, alphas, discount)
+        best_i = beliefs.dot(g.reshape((-1, n_s)).T).reshape(
+            (n_b, n_o, -1)).argmax(-1)
+        alpha = np.tile(r[a], (n_b, 1))
+        for o in range(n_o):
+            alpha += g[o, best_i[:, o]]
+        values = (beliefs * alpha).sum(-1)
+        better = values > best_values
+        best_values[better] = values[better]
+        new_alphas[better] = alpha[better]
+        actions[better] = a
+        used[better] = best_i[better]
+    return new_alphas, actions, used
+
+
+def _policy_graph(pomdp, alphas, actions, witnesses):
+    """Builds a GraphPolicy from alpha vectors, their actions and, for each
+    of them, a belief for which it is the best vector.
+
+    Each node transitions on observation o to the best vector for the
+    updated witness belief, or to None if o is impossible.
+    """
+    O = np.asarray(pomdp.O)
+    transitions = []
+    for b, a in zip(witnesses, actions):
+        next_b = _joint_successors(pomdp, O, a, b).T
+        possible = next_b.sum(-1) > 0
+        best = next_b.dot(alphas.T).argmax(-1)
+        transitions.append([int(n) if p else None
+                            for n, p in zip(best, possible)])
+    return GraphPolicy([pomdp.actions[a] for a in actions],
+                       pomdp.observations, transitions, alphas,
+                       start=pomdp.start)
+
+
+def policy_from_alphas(pomdp, alphas, actions=None, beliefs=None,
+                       seed=None):
+    """GraphPolicy acting greedily with respect to given alpha vectors.
+
+    Witness beliefs for the nodes are taken from beliefs (default to
+    collect_beliefs(pomdp)); vectors that are best for none of them are
+    dropped.
+
+    :param actions: action index for each vector (default to one vector per
+        action, as for QMDP or FIB bounds)
+    """
+    alphas = np.atleast_2d(alphas)
+    if actions is None:
+        actions = np.arange(alphas.shape[0])
+    if beliefs is None:
+        beliefs = collect_beliefs(pomdp,
+                                  random_state=np.random.RandomState(seed))
+    beliefs = np.vstack([pomdp.start, beliefs])
+    best = beliefs.dot(alphas.T).argmax(-1)
+    kept, first = np.unique(best, return_index=True)
+    return _policy_graph(pomdp, alphas[kept], np.asarray(actions)[kept],
+                         beliefs[first])
+
+
+def solve_pbvi(pomdp, beliefs=None, n_beliefs=100, n_iterations=100,
+               timeout=None, values=None, tolerance=1.e-6, seed=None):
+    """Point-based value iteration.
+
+    :param beliefs: array of shape (n, n_states) of beliefs on which to
+        compute backups (default to collect_beliefs(pomdp, n_beliefs))
+    :param n_iterations: maximum number of backups
+    :param timeout: maximum time in seconds (checked between iterations)
+    :param values: initial alpha vectors, of shape (n, n_states), for
+        instance values of a previously computed policy (warm start). If not
+        given the initial value is the lower bound given by the smallest
+        expected reward, received forever (discount < 1) or, if negative,
+        for n_iterations steps (discount of 1). Backups from an upper bound
+        have no guarantee.
+    :param tolerance: stops when the value of no belief changes by more
+        than tolerance between two iterations
+    :return: GraphPolicy
+    """
+    end_time = None if timeout is None else time.time() + timeout
+    if beliefs is None:
+        beliefs = collect_beliefs(pomdp, n_beliefs=n_beliefs,
+                                  random_state=np.random.RandomState(seed))
+    beliefs = np.atleast_2d(beliefs)
+    r = pomdp.expected_rewards()
+    T, O = _dense_or_sparse(pomdp.T), np.asarray(pomdp.O)
+    if values is None:
+        if pomdp.discount < 1:
+            lower_bound = r.min() / (1. - pomdp.discount)
+        else:
+            # Positive rewards would stack on the backups
+            lower_bound = min(r.min(), 0.) * n_iterations
+        values = np.full((1, pomdp.n_states), lower_bound)
+    alphas = np.atleast_2d(values)
+    actions = None
+    previous = beliefs.dot(alphas.T).max(-1)
+    for _ in range(n_iterations):
+        alphas, actions, _ = _backup(beliefs, alphas, r, T, O,
+                                     pomdp.discount)
+        # Keep one copy of each vector (with its first witness belief)
+        alphas, first = np.unique(alphas, axis=0, return_index=True)
+        actions = actions[first]
+        witnesses = beliefs[first]
+        current = beliefs.dot(alphas.T).max(-1)
+        converged = np.abs(current - previous).max() < tolerance
+        previous = current
+        if converged or (end_time is not None and time.time() > end_time):
+            break
+    if actions is None:
+        raise ValueError('At least one iteration is needed.')
+    return _policy_graph(pomdp, alphas, actions, witnesses)
@@ -1,13 +1,16 @@
 import time
 import math
 import json
+import heapq
 import threading
 from numbers import Integral
+from multiprocessing import Process, Pipe, cpu_count
 
 import numpy as np
 
-from .belief import (ArrayBelief, ParticleBelief, MaxSamplesReached,
-                     format_belief_array)
+from .belief import (ArrayBelief, SparseArrayBelief, ParticleBelief,
+                     WeightedParticleBelief, MaxSamplesReached,
+                     SuccessorCache, format_belief_array)
 
 
 class Horizon(object):
@@ -31,11 +34,41 @@ class Horizon(object):
     def copy(self):
         raise NotImplementedError
 
+    def batch(self, n):
+        """Returns a BatchHorizon tracking n copies of the horizon (or None
+        if batches are not supported).
+        """
+        return None
+
     @classmethod
     def generator(cls, model, **parameters):
         raise NotImplementedError
 
 
+class BatchHorizon(object):
+    """Tracks several copies of a horizon for rollouts run in lockstep.
+
+    Lanes are the indices of the copies; is_reached returns a boolean array
+    over all lanes and decrement takes arrays of lanes, actions, states,
+    new states and observations.
+    """
+
+    def __init__(self, n):
+        self.n = np.array(n)
+
+    def is_reached(self):
+        return self.n <= 0
+
+    def decrement(self, lanes, a, s, new_s, o):
+        raise NotImplementedError
+
+
+class NTransitionsBatchHorizon(BatchHorizon):
+
+    def decrement(self, lanes, a, s, new_s, o):
+        self.n[lanes] -= 1
+
+
 class NTransitionsHorizon(Horizon):
 
     def __init__(self, n):
@@ -50,6 +83,9 @@ class NTransitionsHorizon(Horizon):
     def copy(self):
         return NTransitionsHorizon(self.n)
 
+    def batch(self, n):
+        return NTransitionsBatchHorizon(np.full((n,), self.n))
+
     @classmethod
     def generator(cls, model, n=100):
         return cls._Generator(cls, n)
@@ -64,16 +100,45 @@ def _null_logger(*args, **kwargs):
     pass
 
 
+# Rough estimate of the memory used by an observation node and its action
+# children, excluding the belief
+_NODE_BYTES = 1000
+
+
 class _SearchTree:
+    """
+    :param max_nodes: maximum number of observation nodes (None for no limit)
+    :param max_bytes: maximum approximate memory used by the tree
+    When the budget is exceeded, the least visited leaves are evicted until
+    the tree is under (1 - evict_fraction) times the budget. Evicted nodes
+    are created again (and evaluated with rollouts) when visited.
+    :param belief_cache_size: if set, observation nodes (except the root)
+        do not store their belief. Beliefs are computed from the parent belief
+        on first access and at most belief_cache_size of them are kept in
+        belief_cache (rollouts from new nodes start from the sampled state
+        instead). (Note that with particle beliefs, computing a belief
+        again gives different particles.)
+    """
+
+    evict_fraction = .1
 
     def __init__(self, model, horizon_generator, exploration,
                  relative_exploration=False, rollout_it=1, belief='array',
-                 belief_params={}, node_params={}, logger=None):
+                 belief_params={}, node_params={}, max_nodes=None,
+                 max_bytes=None, belief_cache_size=None, logger=None):
         self._belief = belief
         self._belief_params = belief_params
         self.model = model
         self._node_params = node_params
+        self.max_nodes = max_nodes
+        self.max_bytes = max_bytes
+        self.belief_cache = (None if belief_cache_size is None
+                             else SuccessorCache(belief_cache_size))
+        self.n_observation_nodes = 0
+        self.n_evicted = 0
+        self._belief_bytes = 0
         self.root = self._observation_node_for_belief(self._belief_start())
+        self.root_history = []  # History leading to root (see reroot)
         self.horizon_gen = horizon_generator
         self.exploration = exploration
         self.relative_explo = relative_exploration
@@ -83,42 +148,211 @@ class _SearchTree:
     def _belief_start(self):
         if self._belief == 'array':
             return ArrayBelief(self.model.start, **self._belief_params)
+        elif self._belief == 'sparse':
+            return SparseArrayBelief.from_array(self.model.start,
+                                                **self._belief_params)
         elif self._belief == 'particle':
             return ParticleBelief(self.model.sample_start, self.model.n_states,
                                   **self._belief_params)
+        elif self._belief == 'weighted':
+            return WeightedParticleBelief(self.model.sample_start,
+                                          self.model.n_states,
+                                          **self._belief_params)
         else:
             raise ValueError('Unknown belief type: ' + self._belief)
 
+    def _history_from_root(self, history):
+        n = len(self.root_history)
+        if list(history[:n]) != self.root_history:
+            raise ValueError('History does not go through the root.')
+        return history[n:]
+
+    def reroot(self, history):
+        """Makes the node for history the new root of the tree, dropping all
+        branches that can not be reached from it. Statistics of the new root
+        subtree are kept.
+
+        If history does not go through the current root, the tree restarts
+        from a new root for the initial belief.
+        """
+        if len(history) % 2 != 0:
+            raise ValueError('Can only reroot on an observation node.')
+        if list(history) == self.root_history:
+            return
+        try:
+            node = self.get_node(history)
+        except ValueError:
+            self.root = self._observation_node_for_belief(self._belief_start())
+            self.root_history = []
+            node = self.get_node(history)
+        self.root = node
+        self.root_history = list(history)
+        if isinstance(node, _LazySearchObservationNode):
+            # Also releases the parent, and through it the rest of the tree
+            node.materialize_belief()
+        self._drop_unreachable()
+
+    def _drop_unreachable(self):
+        """Called after rerooting to forget unreachable nodes and update
+        node count.
+        """
+        self.n_observation_nodes = 0
+        self._belief_bytes = 0
+        visited = set()
+        to_visit = [self.root]
+        while len(to_visit) > 0:
+            node = to_visit.pop()
+            if id(node) not in visited:
+                visited.add(id(node))
+                self._count_node(node.stored_belief, 1)
+                for c in node._iterate_children():
+                    to_visit.extend(c.children.values())
+        if self.belief_cache is not None:
+            # The root stores its belief
+            visited.discard(id(self.root))
+            self.belief_cache.retain(lambda node: id(node) in visited)
+
+    def _count_node(self, belief, n):
+        self.n_observation_nodes += n
+        if belief is not None:
+            self._belief_bytes += n * belief.nbytes
+
+    @property
+    def nbytes(self):
+        """Approximate memory used by the tree (including cached beliefs)."""
+        cache_bytes = (0 if self.belief_cache is None
+                       else self.belief_cache.nbytes)
+        return (self._belief_bytes + cache_bytes +
+                _NODE_BYTES * self.n_observation_nodes)
+
+    def _over_budget(self, margin=1.):
+        return ((self.max_nodes is not None and
+                 self.n_observation_nodes > margin * self.max_nodes) or
+                (self.max_bytes is not None and
+                 self.nbytes > margin * self.max_bytes))
+
+    def _enforce_budget(self, protected):
+        if self._over_budget():
+            # Evict below the budget to not evict on each simulation
+            self._evict_leaves(protected)
+
+    def _evict_leaves(self, protected):
+        """Evicts least visited leaves (observation nodes without grand
+        children) until under target. Nodes that become leaves are also
+        candidates. Returns the number of evicted nodes.
+        """
+        # Parent action node, observation, and grand parent of each node
+        parents = {}
+        heap = []
+        to_visit = [self.root]
+        while len(to_visit) > 0:
+            node = to_visit.pop()
+            leaf = True
+            for c in node._iterate_children():
+                for o, gc in c.children.items():
+                    parents[id(gc)] = (c, o, node)
+                    to_visit.append(gc)
+                    leaf = False
+            if leaf:
+                self._push_leaf(heap, node, protected)
+        n = 0
+        while (len(heap) > 0 and
+               self._over_budget(margin=1. - self.evict_fraction)):
+            _, _, node = heapq.heappop(heap)
+            parent, o, grand_parent = parents.pop(id(node))
+            del parent.children[o]
+            self._count_node(node.stored_belief, -1)
+            if self.belief_cache is not None:
+                self.belief_cache.discard(node)
+            self.n_evicted += 1
+            n += 1
+            if not any(len(c.children) > 0
+                       for c in grand_parent._iterate_children()):
+                self._push_leaf(heap, grand_parent, protected)
+        return n
+
+    def _push_leaf(self, heap, node, protected):
+        if node is not self.root and node is not protected:
+            # id breaks ties without comparing nodes
+            heapq.heappush(heap, (node.n_simulations, id(node), node))
+
     def get_node(self, history):
         """Raises ValueError if node does not exist or history is invalid."""
+        history = self._history_from_root(history)
         node = self.root
-        last_belief = node.belief
+        parent = node
         for i, h in enumerate(history):
             if isinstance(node, _SearchActionNode):  # h is an observation
                 if h not in node.children:
-                    node.children[h] = self._observation_node_for_belief(
-                        last_belief.successor(self.model, history[i - 1], h))
+                    node.children[h] = self._child_node(
+                        parent, history[i - 1], h)
                 node = node.children[h]
             else:  # h is an action
-                last_belief = node.belief
+                parent = node
                 node = node.safe_get_child(h)
         return node
 
     def random_action(self):
         return np.random.randint(self.model.n_actions)
 
-    def rollout_from_node(self, node, horizon):
+    def rollout_from_node(self, node, horizon, state=None):
+        """:param state: if given, rollouts start from state instead of
+            samples from the node belief
+        """
         if horizon.is_reached():
             return 0
         else:
-            returns = 0.
-            for _ in range(self.rollout_it):
-                state = node.belief.sample()
-                returns += self._one_rollout_from_node(state, horizon.copy())
-            returns /= self.rollout_it  # Avg over rollouts
+            belief = node.belief if state is None else None
+            returns = self._rollouts(belief, horizon, state=state)
             node.update(returns)  # Only counts one visit
             return returns
 
+    def _rollouts(self, belief, horizon, state=None):
+        """Average return of rollout_it rollouts from belief (or state).
+
+        Rollouts are run in lockstep when both the model and the horizon
+        support batches (see _batch_rollout).
+        """
+        batch = None
+        if (self.rollout_it > 1 and
+                hasattr(self.model, 'sample_transition_batch')):
+            batch = horizon.batch(self.rollout_it)
+        if batch is None:
+            returns = 0.
+            for _ in range(self.rollout_it):
+                s = belief.sample() if state is None else state
+                returns += self._one_rollout_from_node(s, horizon.copy())
+            return returns / self.rollout_it  # Avg over rollouts
+        else:
+            if state is not None:
+                states = np.array([state] * self.rollout_it)
+            elif hasattr(belief, 'sample_batch'):
+                states = belief.sample_batch(self.rollout_it)
+            else:
+                states = np.array([belief.sample()
+                                   for _ in range(self.rollout_it)])
+            return self._batch_rollout(states, batch).mean()
+
+    def _batch_rollout(self, states, horizon):
+        """Rollouts from an array of states, using
+        model.sample_transition_batch on all unfinished lanes at once.
+
+        :param horizon: BatchHorizon with one lane per state
+        """
+        returns = np.zeros(states.shape)
+        gamma = np.ones(states.shape)
+        lanes = np.flatnonzero(~horizon.is_reached())
+        while len(lanes) > 0:
+            a = np.random.randint(self.model.n_actions, size=len(lanes))
+            s = states[lanes]
+            new_s, o, r = self.model.sample_transition_batch(a, s)
+            horizon.decrement(lanes, a, s, new_s, o)
+            states[lanes] = new_s
+            returns[lanes] += gamma[lanes] * r
+            gamma[lanes] *= self.model.discount
+            lanes = lanes[~horizon.is_reached()[lanes]]
+        return returns
+
     def _one_rollout_from_node(self, state, horizon):
         gamma = 1.
         full_return = 0.
@@ -134,9 +368,31 @@ class _SearchTree:
     def simulate_from_node(self, node, action=None):
         state = node.belief.sample()
         self._simulate_from_node(node, state, self.horizon_gen(), a=action)
+        self._enforce_budget(node)
 
-    def _observation_node_for_belief(self, b):
-        return _SearchObservationNode(b, self.model.n_actions, **self._node_params)
+    def _observation_node_for_belief(self, b, parent=None, a=None, o=None):
+        """Creates observation node with belief b, reached from observation
+        node parent by action a and observation o (if not the root).
+        """
+        node = _SearchObservationNode(b, self.model.n_actions,
+                                      **self._node_params)
+        self._count_node(node.stored_belief, 1)
+        return node
+
+    def _child_node(self, parent, a, o):
+        """Creates the observation node reached from parent by action a and
+        observation o. With a belief cache its belief is only computed when
+        first needed.
+        """
+        if self.belief_cache is None:
+            return self._observation_node_for_belief(
+                parent.belief.successor(self.model, a, o),
+                parent=parent, a=a, o=o)
+        node = _LazySearchObservationNode(
+            self.model, self.belief_cache, parent, a, o,
+            self.model.n_actions, **self._node_params)
+        self._count_node(None, 1)
+        return node
 
     def _simulate_from_node(self, node, state, horizon, a=None):
         if horizon.is_reached():
@@ -152,11 +408,11 @@ class _SearchTree:
             if o not in child.children:
                 try:
                     # Create node with updated belief
-                    child.children[o] = self._observation_node_for_belief(
-                        node.belief.successor(self.model, a, o))
-                    # Use rollout
-                    partial_return = self.rollout_from_node(child.children[o],
-                                                            horizon)
+                    child.children[o] = self._child_node(node, a, o)
+                    # Use rollout (from new_s if the belief is not computed)
+                    partial_return = self.rollout_from_node(
+                        child.children[o], horizon,
+                        state=None if self.belief_cache is None else new_s)
                 except MaxSamplesReached:
                     self.log('Maximum number of samples reached, skipping.')
                     partial_return = 0.
@@ -184,26 +440,68 @@ class _SearchTree:
 
 
 class _ObservationLookupSearchTree(_SearchTree):
+    """Search tree in which histories leading to the same belief share the
+    same observation node.
+
+    :param belief_tolerance: if positive, beliefs are bucketed by their
+        probabilities rounded to multiples of belief_tolerance, so that
+        beliefs in the same bucket (which differ by less than the tolerance
+        on each state) share a node. Close beliefs on both sides of a
+        rounding boundary are not merged. If 0, only identical beliefs are
+        merged.
+    Lookups (n_lookups) and the ones that found an existing node (n_merges)
+    are counted.
+    """
 
     def __init__(self, model, horizon, exploration,
                  relative_exploration=False, belief='array', rollout_it=1,
-                 belief_params={}, node_params={}, logger=None):
-        self._obs_nodes = {}  # used in super for root initialization
-        if belief == 'particle':
+                 belief_params={}, node_params={}, max_nodes=None,
+                 max_bytes=None, belief_cache_size=None, belief_tolerance=0.,
+                 logger=None):
+        # used in super for root initialization
+        self._obs_nodes = {}
+        self.belief_tolerance = belief_tolerance
+        self.n_lookups = 0
+        self.n_merges = 0
+        if belief in ('particle', 'weighted'):
             raise ValueError(
                 '_ObservationLookupSearchTree does not support particle belief')
+        if max_nodes is not None or max_bytes is not None:
+            raise ValueError(
+                '_ObservationLookupSearchTree does not support memory budget')
+        if belief_cache_size is not None:
+            raise ValueError(
+                '_ObservationLookupSearchTree needs beliefs in all nodes')
         super(_ObservationLookupSearchTree, self).__init__(
             model, horizon, exploration,
             relative_exploration=relative_exploration,
-            belief=belief, rollout_it=rollout_it, belief_params={},
+            belief=belief, rollout_it=rollout_it, belief_params=belief_params,
             node_params=node_params, logger=logger)
 
-    def _observation_node_for_belief(self, b):
+    @property
+    def merge_rate(self):
+        """Fraction of lookups that returned an existing node."""
+        return self.n_merges / float(self.n_lookups or 1)
+
+    def _belief_key(self, b):
+        if self.belief_tolerance == 0:
+            return b  # Beliefs are hashable (and cache their hash)
+        states, probabilities = b.sparse_histogram()
+        q = np.round(probabilities / self.belief_tolerance).astype(np.int64)
+        non_zero = q != 0
+        return (states[non_zero].tobytes(), q[non_zero].tobytes())
+
+    def _observation_node_for_belief(self, b, parent=None, a=None, o=None):
         # Returns node for given belief, creating one if none exists
-        if b not in self._obs_nodes:
-            self._obs_nodes[b] = _SearchObservationNode(
+        key = self._belief_key(b)
+        self.n_lookups += 1
+        if key in self._obs_nodes:
+            self.n_merges += 1
+        else:
+            self._count_node(b, 1)
+            self._obs_nodes[key] = _SearchObservationNode(
                 b, self.model.n_actions, **self._node_params)
-        return self._obs_nodes[b]
+        return self._obs_nodes[key]
 
     # Here we need to keep track of visited children since the tree is no more
     # a tree...
@@ -211,6 +509,247 @@ class _ObservationLookupSearchTree(_SearchTree):
         return self.root.to_dict(self.model, as_policy=as_policy,
                                  exclude_visited=set())
 
+    def _drop_unreachable(self):
+        reachable = {}
+        to_visit = [self.root]
+        while len(to_visit) > 0:
+            node = to_visit.pop()
+            key = self._belief_key(node.belief)
+            if key not in reachable:
+                reachable[key] = node
+                for c in node._iterate_children():
+                    to_visit.extend(c.children.values())
+        self._obs_nodes = reachable
+        self.n_observation_nodes = 0
+        self._belief_bytes = 0
+        for node in self._obs_nodes.values():
+            self._count_node(node.belief, 1)
+
+
+class _ArraySearchTree(_SearchTree):
+    """Search tree storing node statistics in growable numpy arrays.
+
+    Observation and action nodes are identified by integer ids in two
+    _NodeTable instances; only beliefs remain python objects. Nodes returned
+    by root and get_node are lightweight views on the tables that implement
+    the same interface as _SearchObservationNode and _SearchActionNode (their
+    children are read-only). Rerooting invalidates previously obtained views.
+    Ids of evicted nodes are reused.
+    """
+
+    def __init__(self, model, horizon_generator, exploration,
+                 relative_exploration=False, rollout_it=1, belief='array',
+                 belief_params={}, node_params={}, max_nodes=None,
+                 max_bytes=None, belief_cache_size=None, logger=None):
+        if belief_cache_size is not None:
+            raise ValueError('_ArraySearchTree does not support lazy beliefs')
+        alpha = node_params.get('alpha', .001)
+        assert(0 <= alpha <= 1)
+        self._obs = _NodeTable(model.n_actions, alpha=alpha)
+        self._act = _NodeTable(model.n_observations, alpha=alpha)
+        self._beliefs = []
+        super(_ArraySearchTree, self).__init__(
+            model, horizon_generator, exploration,
+            relative_exploration=relative_exploration, rollout_it=rollout_it,
+            belief=belief, belief_params=belief_params,
+            node_params=node_params, max_nodes=max_nodes,
+            max_bytes=max_bytes, logger=logger)
+
+    @property
+    def n_nodes(self):
+        return self._obs.n_used + self._act.n_used
+
+    @property
+    def nbytes(self):
+        """Approximate memory used by the tree (only counts used rows of
+        the tables, which capacity does not shrink after evictions).
+        """
+        return (self._belief_bytes + self._obs.nbytes + self._act.nbytes +
+                8 * self._obs.n_used)
+
+    def _observation_node_for_belief(self, b, parent=None, a=None, o=None):
+        return _ArrayObservationNode(self, self._new_observation_node(b))
+
+    def _new_observation_node(self, b):
+        i = self._obs.add()
+        if i == len(self._beliefs):
+            self._beliefs.append(b)
+        else:
+            self._beliefs[i] = b
+        self._count_node(b, 1)
+        return i
+
+    def _safe_action_child(self, i, a):
+        c = self._obs.children[i, a]
+        if c < 0:
+            c = self._act.add()
+            self._obs.children[i, a] = c
+        return c
+
+    def _best_action(self, i, exploration=0, relative_exploration=False):
+        children = self._obs.children[i]
+        counts = np.where(children < 0, 0,
+                          self._act.n_simulations[children])
+        not_init = np.flatnonzero(counts == 0)
+        if len(not_init) > 0:
+            # Chose an unexplored action
+            return np.random.choice(not_init)
+        # Augmented greedy (UCT)
+        assert(self._obs.n_simulations[i] > 0)
+        values = self._act.total_value[children] / counts
+        if exploration > 0 and relative_exploration:
+            exploration *= values.max() - values.min()
+        return np.argmax(values + exploration * np.sqrt(
+            np.log(self._obs.n_simulations[i]) / counts))
+
+    def _drop_unreachable(self):
+        self._compact(self.root._id)
+        self.root = _ArrayObservationNode(self, 0)
+        self.n_observation_nodes = 0
+        self._belief_bytes = 0
+        for b in self._beliefs:
+            self._count_node(b, 1)
+
+    def _evict_leaves(self, protected):
+        if self._act.size == 0:  # Only root
+            return 0
+        obs_children = self._obs.children[:self._obs.size]
+        act_children = self._act.children[:self._act.size]
+        # Parent action and observation of each observation node, and
+        # parent observation node of each action node
+        parent = -np.ones((self._obs.size,), dtype=np.int64)
+        parent_o = np.zeros((self._obs.size,), dtype=np.int64)
+        rows, obs = np.nonzero(act_children >= 0)
+        parent[act_children[rows, obs]] = rows
+        parent_o[act_children[rows, obs]] = obs
+        act_parent = -np.ones((self._act.size,), dtype=np.int64)
+        rows, acts = np.nonzero(obs_children >= 0)
+        act_parent[obs_children[rows, acts]] = rows
+        act_has_child = (act_children >= 0).any(axis=1)
+        has_grand_children = np.where(obs_children >= 0,
+                                      act_has_child[obs_children],
+                                      False).any(axis=1)
+        # Root, free and unreachable nodes have no parent
+        is_candidate = parent >= 0
+        is_candidate[protected._id] = False
+        leaves = np.flatnonzero(is_candidate & ~has_grand_children)
+        heap = list(zip(self._obs.n_simulations[leaves].tolist(),
+                        leaves.tolist()))
+        heapq.heapify(heap)
+        n = 0
+        while (len(heap) > 0 and
+               self._over_budget(margin=1. - self.evict_fraction)):
+            _, i = heapq.heappop(heap)
+            p = parent[i]
+            self._act.children[p, parent_o[i]] = -1
+            actions = self._obs.children[i]
+            self._act.free(actions[actions >= 0])
+            self._obs.free([i])
+            self._count_node(self._beliefs[i], -1)
+            self._beliefs[i] = None
+            self.n_evicted += 1
+            n += 1
+            # The grand parent may have become a leaf
+            g = act_parent[p]
+            if (is_candidate[g] and
+                    not (self._act.children[p] >= 0).any()):
+                actions = self._obs.children[g]
+                actions = actions[actions >= 0]
+                if not (self._act.children[actions] >= 0).any():
+                    heapq.heappush(heap, (int(self._obs.n_simulations[g]), g))
+        return n
+
+    def _compact(self, i):
+        """Only keeps nodes from the subtree of observation node i, which
+        gets id 0.
+        """
+        obs_ids = [np.array([i])]
+        act_ids = []
+        while len(obs_ids[-1]) > 0:
+            a = self._obs.children[obs_ids[-1]].ravel()
+            act_ids.append(a[a >= 0])
+            o = self._act.children[act_ids[-1]].ravel()
+            obs_ids.append(o[o >= 0])
+        obs_ids = np.concatenate(obs_ids)
+        act_ids = np.concatenate(act_ids)
+        obs_map = -np.ones((self._obs.size,), dtype=np.int64)
+        obs_map[obs_ids] = np.arange(len(obs_ids))
+        act_map = -np.ones((self._act.size,), dtype=np.int64)
+        act_map[act_ids] = np.arange(len(act_ids))
+        self._obs = self._obs.take(obs_ids, act_map)
+        self._act = self._act.take(act_ids, obs_map)
+        self._beliefs = [self._beliefs[j] for j in obs_ids]
+
+    def get_node(self, history):
+        """Raises ValueError if history is invalid (see _SearchTree)."""
+        history = self._history_from_root(history)
+        i = self.root._id
+        last_belief = self._beliefs[i]
+        for j, h in enumerate(history):
+            n = self.model.n_observations if j % 2 else self.model.n_actions
+            if not 0 <= h < n:
+                raise ValueError('Invalid history: {} at {}.'.format(h, j))
+            if j % 2 == 1:  # i is an action node and h an observation
+                c = self._act.children[i, h]
+                if c < 0:
+                    c = self._new_observation_node(last_belief.successor(
+                        self.model, history[j - 1], h))
+                    self._act.children[i, h] = c
+                i = c
+            else:  # h is an action
+                last_belief = self._beliefs[i]
+                i = self._safe_action_child(i, h)
+        if len(history) % 2 == 1:
+            return _ArrayActionNode(self, i)
+        else:
+            return _ArrayObservationNode(self, i)
+
+    def rollout_from_node(self, node, horizon):
+        return self._rollout_from_id(node._id, horizon)
+
+    def _rollout_from_id(self, i, horizon):
+        if horizon.is_reached():
+            return 0
+        else:
+            returns = self._rollouts(self._beliefs[i], horizon)
+            self._obs.update(i, returns)  # Only counts one visit
+            return returns
+
+    def simulate_from_node(self, node, action=None):
+        state = self._beliefs[node._id].sample()
+        self._simulate_from_id(node._id, state, self.horizon_gen(), a=action)
+        self._enforce_budget(node)
+
+    def _simulate_from_id(self, i, state, horizon, a=None):
+        if horizon.is_reached():
+            return self._obs.value(i)
+        if a is None:
+            a = self._best_action(i, exploration=self.exploration,
+                                  relative_exploration=self.relative_explo)
+        child = self._safe_action_child(i, a)
+        new_s, o, r = self.model.sample_transition(a, state)
+        horizon.decrement(a, state, new_s, o)
+        grand_child = self._act.children[child, o]
+        if grand_child < 0:
+            try:
+                # Create node with updated belief
+                grand_child = self._new_observation_node(
+                    self._beliefs[i].successor(self.model, a, o))
+                self._act.children[child, o] = grand_child
+                # Use rollout
+                partial_return = self._rollout_from_id(grand_child, horizon)
+            except MaxSamplesReached:
+                self.log('Maximum number of samples reached, skipping.')
+                partial_return = 0.
+        else:
+            # Continue regular search
+            partial_return = self._simulate_from_id(grand_child, new_s,
+                                                    horizon)
+        full_return = r + self.model.discount * partial_return
+        self._act.update(child, full_return)
+        self._obs.update(i, full_return)
+        return full_return
+
 
 class _ValueAverage(object):
 
@@ -231,10 +770,44 @@ class _ValueAverage(object):
         self.n_simulations += 1
 
 
+class _ChildrenStatistics(object):
+    """Statistics of the children of a node stored in contiguous arrays."""
+
+    def __init__(self, n_children):
+        self.n_simulations = np.zeros((n_children,), dtype=np.int64)
+        self.total_value = np.zeros((n_children,))
+
+
+class _ChildValueAverage(_ValueAverage):
+    """_ValueAverage stored in the statistics shared by siblings."""
+
+    def __init__(self, statistics, i, alpha=0):
+        self._stats = statistics
+        self._i = i
+        assert(0 <= alpha <= 1)
+        self.alpha = alpha
+
+    @property
+    def n_simulations(self):
+        return int(self._stats.n_simulations[self._i])
+
+    @n_simulations.setter
+    def n_simulations(self, n):
+        self._stats.n_simulations[self._i] = n
+
+    @property
+    def total_value(self):
+        return float(self._stats.total_value[self._i])
+
+    @total_value.setter
+    def total_value(self, value):
+        self._stats.total_value[self._i] = value
+
+
 class _SearchNode(object):
 
-    def __init__(self, alpha=.001):
-        self._avg = _ValueAverage(alpha=alpha)
+    def __init__(self, alpha=.001, avg=None):
+        self._avg = _ValueAverage(alpha=alpha) if avg is None else avg
         self.children = {}
 
     def __str__(self):
@@ -255,6 +828,10 @@ class _SearchNode(object):
     def update(self, value):
         self._avg.update(value)
 
+    def _set_statistics(self, n_simulations, total_value):
+        self._avg.n_simulations = n_simulations
+        self._avg.total_value = total_value
+
     def to_dict(self, model, as_policy=False, exclude_visited=None,
                 recursive=True):
         return {"value": self.value,
@@ -282,6 +859,13 @@ class _SearchObservationNode(_SearchNode):
         self.belief = belief
         self.children = [None for _ in range(n_actions)]
         self._children_alpha = alpha
+        # Kept up to date by children for vectorized action selection
+        self._children_stats = _ChildrenStatistics(n_actions)
+
+    @property
+    def stored_belief(self):
+        """Belief held by the node (None if computed on demand)."""
+        return self.belief
 
     def children_dict(self, model):
         return {model.actions[a]: c
@@ -306,12 +890,16 @@ class _SearchObservationNode(_SearchNode):
                 for child in self.children]
 
     def get_best_action(self, exploration=0, relative_exploration=False):
-        not_init = self._not_init_children()
+        counts = self._children_stats.n_simulations
+        not_init = np.flatnonzero(counts == 0)
         if len(not_init) == 0:
             assert(self.n_simulations > 0)  # explored if children explored
             # Augmented greedy (UCT)
-            a = np.argmax([self.augmented_values(
-                exploration=exploration, relative=relative_exploration)])
+            values = self._children_stats.total_value / counts
+            if exploration > 0 and relative_exploration:
+                exploration *= values.max() - values.min()
+            a = np.argmax(values + exploration * np.sqrt(
+                np.log(self.n_simulations) / counts))
         else:
             # Chose an unexplored action
             a = np.random.choice(not_init)
@@ -319,7 +907,8 @@ class _SearchObservationNode(_SearchNode):
 
     def safe_get_child(self, a):
         if self.children[a] is None:
-            self.children[a] = _SearchActionNode(alpha=self._children_alpha)
+            self.children[a] = _SearchActionNode(avg=_ChildValueAverage(
+                self._children_stats, a, alpha=self._children_alpha))
         return self.children[a]
 
     def _iterate_children(self):
@@ -379,6 +968,45 @@ class _SearchObservationNode(_SearchNode):
         return base
 
 
+class _LazySearchObservationNode(_SearchObservationNode):
+    """Observation node that computes its belief from the parent belief,
+    action, and observation when needed. Computed beliefs are kept in a
+    bounded cache shared by the tree (a root may instead store its belief,
+    see materialize_belief).
+    """
+
+    def __init__(self, model, cache, parent, a, o, n_actions, alpha=.001):
+        self._model = model
+        self._cache = cache
+        self._parent = parent
+        self._a = a
+        self._o = o
+        super(_LazySearchObservationNode, self).__init__(None, n_actions,
+                                                         alpha=alpha)
+
+    @property
+    def belief(self):
+        if self._belief is not None:
+            return self._belief
+        return self._cache.get(self, self._compute_belief)
+
+    @belief.setter
+    def belief(self, belief):
+        self._belief = belief
+
+    @property
+    def stored_belief(self):
+        return self._belief
+
+    def _compute_belief(self):
+        return self._parent.belief.successor(self._model, self._a, self._o)
+
+    def materialize_belief(self):
+        """Stores the belief in the node and forgets the parent."""
+        self._belief = self.belief
+        self._parent = None
+
+
 class _SearchActionNode(_SearchNode):
     """
     Children indexed by observation.
@@ -402,25 +1030,236 @@ class _SearchActionNode(_SearchNode):
             return base
 
 
+class _NodeTable(object):
+    """Statistics and children of search nodes stored in numpy arrays.
+
+    Rows are node ids; arrays are grown by doubling their capacity.
+    Children are node ids in the other table, -1 meaning no child.
+    Values are averaged the same way as in _ValueAverage.
+    Freed rows are reused by add.
+    """
+
+    def __init__(self, n_children, alpha=.001, capacity=64):
+        self.alpha = alpha
+        self.size = 0  # Number of rows ever used
+        self._free = []
+        self.n_simulations = np.zeros((capacity,), dtype=np.int64)
+        self.total_value = np.zeros((capacity,))
+        self.children = -np.ones((capacity, n_children), dtype=np.int64)
+
+    @property
+    def capacity(self):
+        return self.n_simulations.shape[0]
+
+    @property
+    def n_used(self):
+        return self.size - len(self._free)
+
+    @property
+    def row_bytes(self):
+        return (self.n_simulations.itemsize + self.total_value.itemsize +
+                self.children.itemsize * self.children.shape[1])
+
+    @property
+    def nbytes(self):
+        """Memory used by the rows in use (freed rows are not counted)."""
+        return self.n_used * self.row_bytes
+
+    def _grow(self):
+        c = self.capacity
+        self.n_simulations = np.concatenate(
+            [self.n_simulations, np.zeros((c,), dtype=np.int64)])
+        self.total_value = np.concatenate([self.total_value, np.zeros((c,))])
+        self.children = np.concatenate(
+            [self.children, -np.ones_like(self.children)])
+
+    def take(self, ids, children_map):
+        """New table with rows ids, children being remapped."""
+        table = _NodeTable(self.children.shape[1], alpha=self.alpha,
+                           capacity=max(len(ids), 1))
+        table.size = len(ids)
+        table.n_simulations[:table.size] = self.n_simulations[ids]
+        table.total_value[:table.size] = self.total_value[ids]
+        children = self.children[ids]
+        has_child = children >= 0
+        children[has_child] = children_map[children[has_child]]
+        table.children[:table.size] = children
+        return table
+
+    def free(self, ids):
+        self.n_simulations[ids] = 0
+        self.total_value[ids] = 0.
+        self.children[ids] = -1
+        self._free.extend(ids)
+
+    def add(self):
+        if len(self._free) > 0:
+            return self._free.pop()
+        if self.size == self.capacity:
+            self._grow()
+        self.size += 1
+        return self.size - 1
+
+    def value(self, i):
+        n = self.n_simulations[i]
+        return 0. if n == 0 else float(self.total_value[i] / n)
+
+    def update(self, i, value):
+        n = self.n_simulations[i]
+        self.total_value[i] = ((self.total_value[i] + value) *
+                               (1 - self.alpha) +
+                               self.alpha * (n + 1) * value)
+        self.n_simulations[i] = n + 1
+
+
+class _ArrayNodeView(object):
+
+    def __init__(self, tree, i):
+        self._tree = tree
+        self._id = i
+
+    def __eq__(self, other):
+        return (type(self) is type(other) and self._tree is other._tree and
+                self._id == other._id)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((id(self._tree), self._id))
+
+    @property
+    def _table(self):
+        raise NotImplementedError
+
+    @property
+    def n_simulations(self):
+        return int(self._table.n_simulations[self._id])
+
+    @property
+    def value(self):
+        return self._table.value(self._id)
+
+    def update(self, value):
+        self._table.update(self._id, value)
+
+    def _set_statistics(self, n_simulations, total_value):
+        self._table.n_simulations[self._id] = n_simulations
+        self._table.total_value[self._id] = total_value
+
+
+class _ArrayObservationNode(_ArrayNodeView, _SearchObservationNode):
+    """View on an observation node of an _ArraySearchTree."""
+
+    @property
+    def _table(self):
+        return self._tree._obs
+
+    @property
+    def belief(self):
+        return self._tree._beliefs[self._id]
+
+    @property
+    def children(self):
+        return [None if c < 0 else _ArrayActionNode(self._tree, c)
+                for c in self._table.children[self._id]]
+
+    def get_best_action(self, exploration=0, relative_exploration=False):
+        return self._tree._best_action(
+            self._id, exploration=exploration,
+            relative_exploration=relative_exploration)
+
+    def safe_get_child(self, a):
+        return _ArrayActionNode(self._tree,
+                                self._tree._safe_action_child(self._id, a))
+
+
+class _ArrayActionNode(_ArrayNodeView, _SearchActionNode):
+    """View on an action node of an _ArraySearchTree."""
+
+    @property
+    def _table(self):
+        return self._tree._act
+
+    @property
+    def children(self):
+        return {o: _ArrayObservationNode(self._tree, c)
+                for o, c in enumerate(self._table.children[self._id])
+                if c >= 0}
+
+
+def _simulate_until(tree, node, iterations=None, end_time=None,
+                    check_every=8):
+    """Runs simulations from node until the number of iterations or the end
+    time (as returned by time.time) is reached. The clock is only checked
+    every check_every simulations. Returns the number of simulations.
+    """
+    n = 0
+    while iterations is None or n < iterations:
+        if (end_time is not None and n % check_every == 0 and
+                time.time() >= end_time):
+            break
+        tree.simulate_from_node(node)
+        n += 1
+    return n
+
+
+def _end_time(deadline_ms):
+    return None if deadline_ms is None else time.time() + deadline_ms / 1000.
+
+
 class POMCPPolicyRunner(object):
     """
     :param particles: number of particles for belief estimation
     :param horizon: length of simulation episodes
     :param iterations: number of simulation episodes to run
+    :param deadline_ms: time budget for each decision in milliseconds
+        (if set, simulations are run until it is reached instead of
+        running the constructor iterations; iterations explicitly given to
+        get_action still stop the search earlier)
     :param exploration: UCT exploration parameter (c in [Silver2010])
     :param belief_values: group values for histories with same belief
+    :param belief_tolerance: with belief_values, also group histories with
+        close beliefs (see _ObservationLookupSearchTree)
+    :param belief: 'array' (exact), 'sparse' (exact, only stores the
+        support, requires model.sparse_belief_update), 'particle' (rejection
+        sampling), or 'weighted' (importance weighted particles, requires
+        model.observation_probability)
+    :param belief_params: extra parameters for the beliefs (e.g.
+        n_particles for particle beliefs, or successor_cache for array
+        beliefs)
+    :param compact: store the search tree in numpy arrays (_ArraySearchTree)
+    :param prune: reroot the tree on the current node after each step,
+        dropping unreachable branches (reset then restarts from a new root)
+    :param max_nodes: maximum number of observation nodes in the tree
+    :param max_bytes: maximum approximate memory used by the tree
+        (least visited leaves are evicted when the budget is exceeded)
+    :param belief_cache_size: compute beliefs of nodes on demand, keeping
+        at most that many in a cache (see _SearchTree)
     """
 
     def __init__(self, model, particles=20, iterations=100, horizon=100,
                  exploration=None, relative_exploration=False, rollout_it=1,
                  belief_values=False, belief='array', belief_params={},
+                 compact=False, deadline_ms=None, prune=False, max_nodes=None,
+                 max_bytes=None, belief_cache_size=None, belief_tolerance=0.,
                  logger=None):
         if logger is None:
             from logging import warning as logger
         if exploration is None:
             exploration = 1. if relative_exploration else 100
-        tree_class = (_ObservationLookupSearchTree if belief_values
-                      else _SearchTree)
+        tree_params = {}
+        if belief_values and compact:
+            raise ValueError('Compact tree does not support belief values.')
+        elif belief_values:
+            tree_class = _ObservationLookupSearchTree
+            tree_params['belief_tolerance'] = belief_tolerance
+        elif belief_tolerance != 0:
+            raise ValueError('Belief tolerance requires belief values.')
+        elif compact:
+            tree_class = _ArraySearchTree
+        else:
+            tree_class = _SearchTree
         if isinstance(horizon, Horizon._Generator):
             horizon_generator = horizon
         elif isinstance(horizon, Integral):
@@ -431,11 +1270,16 @@ class POMCPPolicyRunner(object):
                                relative_exploration=relative_exploration,
                                rollout_it=rollout_it, belief=belief,
                                belief_params=belief_params,
-                               logger=logger)
+                               max_nodes=max_nodes, max_bytes=max_bytes,
+                               belief_cache_size=belief_cache_size,
+                               logger=logger, **tree_params)
         if iterations < model.n_actions:
             logger('{} iterations is smaller than the number of actions'.format(
                 iterations))
         self.iterations = iterations
+        self.deadline_ms = deadline_ms
+        self.prune = prune
+        self.last_n_simulations = 0  # Simulations run by last get_action
         self._reset()
 
     @property
@@ -456,6 +1300,8 @@ class POMCPPolicyRunner(object):
         if belief is not None:
             raise NotImplementedError
         self.history = []
+        if self.prune:
+            self.tree.reroot(self.history)
         self._node = self.tree.root
         self._last_action = None
 
@@ -463,13 +1309,22 @@ class POMCPPolicyRunner(object):
     def belief(self):
         return self._node.belief
 
-    def get_action(self, iterations=None):
+    def _search_budget(self, iterations, deadline_ms):
+        """Returns maximum number of iterations (or None) and end time.
+        Iterations are only used with a deadline if explicitly given.
+        """
+        if deadline_ms is None:
+            deadline_ms = self.deadline_ms
+        if iterations is None and deadline_ms is None:
+            iterations = self.iterations
+        return iterations, _end_time(deadline_ms)
+
+    def get_action(self, iterations=None, deadline_ms=None):
         # Note iterations must be greater than the number of actions
         # to guarantee that any action chosen as best_action is explored first
-        if iterations is None:
-            iterations = self.iterations
-        for _ in range(iterations):
-            self.tree.simulate_from_node(self._node)
+        iterations, end_time = self._search_budget(iterations, deadline_ms)
+        self.last_n_simulations = _simulate_until(
+            self.tree, self._node, iterations=iterations, end_time=end_time)
         a = self._node.get_best_action()
         # No exploration during exploitation?
         self._last_action = a
@@ -485,6 +1340,9 @@ class POMCPPolicyRunner(object):
         # the node for the new history (would raise MaxSamplesReached)
         self._node = self.tree.get_node(new_history)
         self.history = new_history  # updates only after get_node has succeeded
+        if self.prune:
+            self.tree.reroot(self.history)
+            self._node = self.tree.root
 
     def trajectory_trees_from_starts(self, qvalue=False):
         return {"graphs": [self.tree.to_dict(as_policy=not qvalue)]}
@@ -497,8 +1355,7 @@ class POMCPPolicyRunner(object):
         logger('New trajectory')
         self.reset()
         s = model.sample_start()
-        belief_quotient = model._int_to_state().belief_quotient
-        belief_preferences = model._int_to_state().belief_preferences
+        _s = model._int_to_state()
         while not model.is_final(s):
             a = self.get_action()
             ns, o, r = model.sample_transition(model.actions.index(a), s)
@@ -509,40 +1366,70 @@ class POMCPPolicyRunner(object):
                 model._int_to_state(ns),
                 model.observations[o],
                 r))
+            histogram = self.belief.sparse_histogram()
             logger('belief: {} | {:.2f}'.format(
-                format_belief_array(belief_quotient(self.belief.array)),
-                belief_preferences(self.belief.array)[0]))
+                format_belief_array(_s.sparse_belief_quotient(*histogram)),
+                _s.sparse_belief_preferences(*histogram)[0]))
             s = ns
             R += r
         logger("Total reward: %f" % R)
 
 
 class AsyncPOMCPPolicyRunner(POMCPPolicyRunner):
+    """Keeps exploring from the current node in a background thread, in
+    between calls to get_action and step.
+
+    The number of background simulations run before each decision is
+    reported in last_n_background_simulations.
+    """
 
     class _Thread(threading.Thread):
         """Continuously explores and enable another thread to execute
         some exploitation in between two explorations.
+
+        Simulations are run in batches of batch_size. The batch is
+        interrupted as soon as another thread requests access to the tree
+        through execute, and exploration only resumes once all such requests
+        are done.
         """
 
+        batch_size = 32
+
         def __init__(self, tree):
             super(AsyncPOMCPPolicyRunner._Thread, self).__init__()
+            self.daemon = True
             self.tree = tree
             self._node = tree.root
             self._action = None
             self._done = False
-            self._lock = threading.Lock()
+            self._error = None
+            self._condition = threading.Condition()
+            self._requests = 0
+            self._requests_lock = threading.Lock()
+            self.n_simulations = 0  # Since last call to pop_n_simulations
+
+        def _add_request(self, n):
+            with self._requests_lock:
+                self._requests += n
 
-        def _stop(self):
+        def _set_done(self):
             self._done = True
 
         def stop(self):
-            self.execute(self._stop)
+            self.execute(self._set_done)
 
         def execute(self, fun, *args, **kwargs):
-            """Waits until current exploration is done and execute fun.
+            """Interrupts current exploration batch and execute fun.
             """
-            with self._lock:
-                return fun(*args, **kwargs)
+            self._add_request(1)
+            with self._condition:
+                self._add_request(-1)
+                try:
+                    if self._error is not None:
+                        raise self._error
+                    return fun(*args, **kwargs)
+                finally:
+                    self._condition.notify()
 
         def set_node(self, node):
             self._node = node
@@ -551,43 +1438,173 @@ class AsyncPOMCPPolicyRunner(POMCPPolicyRunner):
         def set_action(self, action):
             self._action = action
 
+        def pop_n_simulations(self):
+            n = self.n_simulations
+            self.n_simulations = 0
+            return n
+
         def explore(self):
             self.tree.simulate_from_node(self._node, action=self._action)
+            self.n_simulations += 1
+
+        def _explore_batch(self):
+            for _ in range(self.batch_size):
+                if self._requests > 0:  # Preempted
+                    break
+                self.explore()
 
         def run(self):
-            done = False
-            while not done:
-                with self._lock:
-                    self.explore()
-                    done = self._done
-                time.sleep(.01)
+            with self._condition:
+                while not self._done:
+                    if self._requests > 0:
+                        self._condition.wait()
+                    else:
+                        try:
+                            self._explore_batch()
+                        except Exception as e:
+                            self._error = e
+                            break
 
     def __init__(self, *args, **kwargs):
         super(AsyncPOMCPPolicyRunner, self).__init__(*args, **kwargs)
+        self.last_n_background_simulations = 0
         self.thread = self._Thread(self.tree)
         self.thread.start()
 
-    def step(self, observation):
+    def _step(self, observation):
         super(AsyncPOMCPPolicyRunner, self).step(observation)
-        self.thread.execute(self.thread.set_node, self._node)
+        self.thread.set_node(self._node)
 
-    def reset(self, belief=None):
+    def step(self, observation):
+        self.thread.execute(self._step, observation)
+
+    def _reset_thread(self, belief=None):
         self._reset(belief=belief)
-        self.thread.execute(self.thread.set_node, self._node)
+        self.thread.set_node(self._node)
 
-    def get_action(self, iterations=None):
-        # Start with minimal number of iterations to have explored all actions
-        a = self.thread.execute(super(AsyncPOMCPPolicyRunner, self).get_action)
-        self.thread.execute(self.thread.set_action, self._last_action)
+    def reset(self, belief=None):
+        self.thread.execute(self._reset_thread, belief=belief)
+
+    def _get_action(self, iterations=None, deadline_ms=None):
+        self.last_n_background_simulations = self.thread.pop_n_simulations()
+        a = super(AsyncPOMCPPolicyRunner, self).get_action(
+            iterations=iterations, deadline_ms=deadline_ms)
+        self.thread.set_action(self._last_action)
         return a
 
+    def get_action(self, iterations=None, deadline_ms=None):
+        return self.thread.execute(self._get_action, iterations=iterations,
+                                   deadline_ms=deadline_ms)
+
     def stop(self):
-        self.thread.stop()
-        if self.thread.isAlive():
+        if self.thread.is_alive():
+            self.thread.stop()
             self.thread.join()
 
     def execute(self, *args, **kwargs):
-        self.thread.execute(*args, **kwargs)
+        return self.thread.execute(*args, **kwargs)
+
+    def __del__(self):
+        self.stop()
+
+
+def _node_statistics(node):
+    return (node.n_simulations, node.value,
+            [None if c is None else (c.n_simulations, c.value)
+             for c in node.children])
+
+
+def _search_worker(tree, connection):
+    """Grows tree from histories received through the connection and sends
+    back statistics of the corresponding node (until None is received).
+    """
+    while True:
+        job = connection.recv()
+        if job is None:
+            break
+        history, iterations, end_time, seed, prune = job
+        try:
+            np.random.seed(seed)
+            if prune:
+                tree.reroot(history)
+            node = tree.get_node(history)
+            n = _simulate_until(tree, node, iterations=iterations,
+                                end_time=end_time)
+            connection.send((n, _node_statistics(node)))
+        except Exception as e:
+            connection.send(e)
+    connection.close()
+
+
+class RootParallelPOMCPPolicyRunner(POMCPPolicyRunner):
+    """Root parallelization of POMCP.
+
+    Each worker process grows its own copy of the search tree with a
+    different random seed. At decision time, statistics of the current node
+    and of its action children are merged by visit-weighted averaging into
+    the tree of the runner, from which the best action is chosen.
+
+    :param n_processes: number of worker processes (default to cpu count)
+    Other parameters are the ones from POMCPPolicyRunner; iterations are
+    split between workers while all workers search until the deadline.
+    """
+
+    def __init__(self, model, n_processes=None, **kwargs):
+        super(RootParallelPOMCPPolicyRunner, self).__init__(model, **kwargs)
+        if n_processes is None:
+            n_processes = cpu_count()
+        self.n_processes = n_processes
+        self._connections = []
+        self._workers = []
+        for _ in range(n_processes):
+            connection, worker_connection = Pipe()
+            p = Process(target=_search_worker,
+                        args=(self.tree, worker_connection))
+            p.daemon = True
+            p.start()
+            self._connections.append(connection)
+            self._workers.append(p)
+
+    def _search(self, iterations, end_time):
+        for c in self._connections:
+            c.send((self.history, iterations, end_time,
+                    np.random.randint(2 ** 32), self.prune))
+        results = [c.recv() for c in self._connections]
+        for r in results:
+            if isinstance(r, Exception):
+                raise r
+        self.last_n_simulations = sum([n for n, _ in results])
+        return [stats for _, stats in results]
+
+    def _merge(self, results):
+        # Visit-weighted averages are obtained by summing total values
+        self._node._set_statistics(sum([n for n, _, _ in results]),
+                                   sum([n * v for n, v, _ in results]))
+        for a in range(self.tree.model.n_actions):
+            stats = [c[a] for _, _, c in results if c[a] is not None]
+            if len(stats) > 0:
+                self._node.safe_get_child(a)._set_statistics(
+                    sum([n for n, _ in stats]),
+                    sum([n * v for n, v in stats]))
+
+    def get_action(self, iterations=None, deadline_ms=None):
+        iterations, end_time = self._search_budget(iterations, deadline_ms)
+        if iterations is not None:
+            # Round up so that at least iterations simulations are run
+            iterations = -(-iterations // self.n_processes)
+        self._merge(self._search(iterations, end_time))
+        a = self._node.get_best_action()
+        self._last_action = a
+        return self.actions[a]
+
+    def stop(self):
+        for c, p in zip(self._connections, self._workers):
+            if p.is_alive():
+                c.send(None)
+                p.join()
+            c.close()
+        self._connections = []
+        self._workers = []
 
     def __del__(self):
         self.stop()
@@ -1,14 +1,18 @@
 # encoding: utf-8
 
+import io
 import os
 import json
-import subprocess
+import itertools
 from distutils import spawn
 
 import numpy as np
 
-from .py23 import TemporaryDirectory, Queue
+from .py23 import TemporaryDirectory, Queue, subprocess
 from .utils import assert_normal
+from .sparse import SparseArray, CompressedReward
+from .cache import fingerprint
+from .binary import save_arrays, load_arrays
 
 SOLVER_NAME = 'pomdp-solve'
 
@@ -21,39 +25,89 @@ class Impossible(ValueError):
     pass
 
 
-def parse_value_function(reader):
-    has_action = False
-    actions = []
-    vectors = []
-    for line in reader:
-        if not line.isspace():
-            if has_action:
-                # expect vector
-                vectors.append(np.fromstring(line, sep=' '))
-                has_action = False
-            else:
-                # expect action
-                actions.append(int(line))
-                has_action = True
-        # else: skip line
-    if has_action:
+def _first_non_empty_lines(lines, n):
+    non_empty = (l for l in lines if l and not l.isspace())
+    return [next(non_empty, '') for _ in range(n)]
+
+
+def _value_function_from_numbers(numbers, vector_line):
+    """Splits all numbers of a value function file into actions and vectors.
+
+    :param vector_line: first vector line, giving the number of states
+    """
+    n = len(vector_line.split()) + 1
+    if n == 1 or numbers.shape[0] % n != 0:
         raise ValueFunctionParseError('Action defined but no vectors follows.')
-    return actions, np.vstack(vectors)
+    table = numbers.reshape((-1, n))
+    return table[:, 0].astype(int), table[:, 1:]
+
+
+def parse_value_function(reader):
+    """Parses a value function (.alpha file) written by pomdp-solve.
+
+    All numbers are parsed at once in a single array.
+
+    :return: list of actions and array of vectors
+    """
+    text = reader.read()
+    _, vector_line = _first_non_empty_lines(io.StringIO(text), 2)
+    actions, vectors = _value_function_from_numbers(
+        np.fromstring(text, sep=' '), vector_line)
+    return actions.tolist(), vectors
+
+
+def load_value_function(path, npy_path=None, mmap_mode='r'):
+    """Loads a value function (.alpha file) written by pomdp-solve.
+
+    The file is parsed by numpy without going through python strings.
+
+    :param npy_path: if given, the parsed values are saved to this file and
+        returned as a memory map of it, so that large value functions are
+        not kept in memory
+    :param mmap_mode: 'r' | 'r+' | 'c' (see numpy.load), only used with
+        npy_path
+    :return: array of actions and array of vectors
+    """
+    with open(path, 'r') as f:
+        _, vector_line = _first_non_empty_lines(f, 2)
+    actions, vectors = _value_function_from_numbers(
+        np.fromfile(path, sep=' '), vector_line)
+    if npy_path is None:
+        return actions, vectors
+    np.save(npy_path, vectors)
+    return actions, np.load(npy_path, mmap_mode=mmap_mode)
+
+
+def _policy_graph_arrays(text):
+    """Arrays of actions and transitions (-1 for none) of a policy graph.
+
+    Lines are 'N A  Z1 Z2 Z3' where N is the node index, A the action, and
+    Zi the next node for each observation or '-'.
+    """
+    first_line, = _first_non_empty_lines(io.StringIO(text), 1)
+    n = len(first_line.split())
+    # Node indices are not negative so '-' only marks missing transitions
+    table = np.fromstring(text.replace('-', '-1'), sep=' ', dtype=np.int64)
+    table = table.reshape((-1, n))
+    assert((table[:, 0] == np.arange(table.shape[0])).all())
+    return table[:, 1], table[:, 2:]
+
+
+def _transitions_with_none(transitions):
+    """Object array of transitions where -1 is replaced by None."""
+    t = transitions.astype(object)
+    t[transitions < 0] = None
+    return t
 
 
 def parse_policy_graph(reader):
-    actions = []
-    transitions = []
-    for i, line in enumerate(reader):
-        line = line.rstrip('\n').rstrip()
-        if not line.isspace():
-            # 'N A  Z1 Z2 Z3'.split(' ') -> ['N', 'A', '', 'Z1', 'Z2', 'Z3']
-            l = line.split(' ')
-            n = int(l[0])  # Node name
-            assert(n == i)
-            actions.append(int(l[1]))
-            transitions.append([None if x == '-' else int(x) for x in l[3:]])
-    return actions, transitions
+    """Parses a policy graph (.pg file) written by pomdp-solve.
+
+    :return: list of actions and list of transitions for each node (None
+        for observations that can not happen)
+    """
+    actions, transitions = _policy_graph_arrays(reader.read())
+    return actions.tolist(), _transitions_with_none(transitions).tolist()
 
 
 PREAMBLE_FMT = """discount: {discount}
@@ -64,6 +118,10 @@ observations: {observations}
 """
 DECIMALS = 5
 NUMBER_FORMAT = '{:0.' + str(DECIMALS) + 'f}'
+NUMBER_PERCENT_FORMAT = '%0.' + str(DECIMALS) + 'f'
+# Matrices with at most this fraction of entries to write are written with
+# one line per entry
+SPARSE_FRACTION = .25
 
 
 def _as_list(lst_or_int):
@@ -73,6 +131,14 @@ def _as_list(lst_or_int):
         return lst_or_int
 
 
+def _index_dict(lst):
+    """Dictionary from elements of lst to their (first) index."""
+    d = {}
+    for i, x in enumerate(lst):
+        d.setdefault(x, i)
+    return d
+
+
 def _dump_list(lst):
     return ' '.join([str(x) for x in lst])
 
@@ -84,18 +150,66 @@ def _dump_list_or_count(lst_or_int):
         return _dump_list(lst_or_int)
 
 
-def _dump_1d_array(a):
-    # Make sure that sum stays the same even after trunc
-    trunc_sum = np.around(a.sum(), decimals=DECIMALS)
+def _truncate(a):
+    """Rounds values to DECIMALS, keeping the rounded sum of each row (on
+    the last dimension) unchanged.
+    """
+    a = np.asarray(a, dtype=float)
     trunc = np.around(a, decimals=DECIMALS)
-    imax = np.argmax(trunc)
+    diff = np.around(a.sum(-1), decimals=DECIMALS) - trunc.sum(-1)
     # Compensate on max to avoid negative values
-    trunc[imax] += trunc_sum - trunc.sum()
-    return ' '.join([NUMBER_FORMAT.format(x) for x in trunc])
+    imax = trunc.argmax(-1)[..., None]
+    np.put_along_axis(trunc, imax, np.take_along_axis(trunc, imax, -1) +
+                      diff[..., None], -1)
+    return trunc
+
+
+def _truncate_sparse(a):
+    """Same as _truncate for the entries of a SparseArray."""
+    n_rows = a.indptr.shape[0] - 1
+    lengths = np.diff(a.indptr)
+    rows = np.repeat(np.arange(n_rows), lengths)
+    trunc = np.around(a.data, decimals=DECIMALS)
+    diff = (np.around(np.bincount(rows, weights=a.data, minlength=n_rows),
+                      decimals=DECIMALS) -
+            np.bincount(rows, weights=trunc, minlength=n_rows))
+    # First maximum of each row (rows are contiguous)
+    order = np.lexsort((-trunc, rows))
+    non_empty = lengths > 0
+    trunc[order[a.indptr[:-1][non_empty]]] += diff[non_empty]
+    return trunc
+
+
+def _format_rows(a):
+    """Formats a 2d array, one line per row (each line ends with a newline).
+    All numbers are formatted at once.
+    """
+    n_rows, n = a.shape
+    line = ' '.join([NUMBER_PERCENT_FORMAT] * n) + '\n'
+    return (line * n_rows) % tuple(a.ravel().tolist())
+
+
+def _dump_1d_array(a):
+    return _format_rows(_truncate(a)[None, :])[:-1]
 
 
 def _dump_2d_array(a):
-    return '\n'.join([_dump_1d_array(x) for x in a])
+    return _format_rows(_truncate(a))[:-1]
+
+
+def _write_dense_array(f, a, name, names):
+    """Writes an array for a POMDP file, as one matrix for each index on
+    all but the last two dimensions.
+
+    :param a: the array
+    :param name: the name of the array in the file
+    :param names: names for the leading dimensions
+    """
+    trunc = _truncate(a)
+    for index in np.ndindex(*a.shape[:-2]):
+        f.write(' : '.join([name] + [str(names[d][i])
+                                     for d, i in enumerate(index)]) + '\n')
+        f.write(_format_rows(trunc[index]))
 
 
 def _dump_3d_array(a, name, xs):
@@ -105,10 +219,9 @@ def _dump_3d_array(a, name, xs):
     :param name: the name of the array in the file
     :param xs: names of the first dimension
     """
-    return '\n'.join([
-        "{} : {}\n{}".format(name, x, _dump_2d_array(a[ix, :, :]))
-        for ix, x in enumerate(xs)
-        ])
+    f = io.StringIO()
+    _write_dense_array(f, a, name, [xs])
+    return f.getvalue()[:-1]
 
 
 def _dump_4d_array(a, name, xs, ys):
@@ -119,11 +232,213 @@ def _dump_4d_array(a, name, xs, ys):
     :param xs: names of the first dimension
     :param ys: names of the second dimension
     """
-    return '\n'.join([
-        _dump_3d_array(a[ix, :, :, :], name,
-                       ["{} : {}".format(x, y) for y in ys])
-        for ix, x in enumerate(xs)
-        ])
+    f = io.StringIO()
+    _write_dense_array(f, a, name, [xs, ys])
+    return f.getvalue()[:-1]
+
+
+def _write_entries(f, name, index_names, values, chunk_size=100000):
+    """Writes one line 'name: i : j : ... value' per entry, using the
+    sparse entry syntax of POMDP files.
+
+    :param index_names: list of arrays of names (one array per dimension,
+        one name per entry)
+    :param values: array of entry values
+    """
+    line = (name + ': ' + ' : '.join(['%s'] * len(index_names)) + ' ' +
+            NUMBER_PERCENT_FORMAT + '\n')
+    for start in range(0, values.shape[0], chunk_size):
+        columns = [n[start:start + chunk_size].tolist() for n in index_names]
+        columns.append(values[start:start + chunk_size].tolist())
+        f.write((line * len(columns[-1])) %
+                tuple(itertools.chain.from_iterable(zip(*columns))))
+
+
+def _names(names, index):
+    """Array of names for an index array."""
+    return np.array([str(x) for x in names], dtype=object)[index]
+
+
+def _write_sparse_array(f, a, name, names):
+    """Writes the non-zero entries of a SparseArray for a POMDP file.
+
+    :param names: names for each dimension
+    """
+    index = a.nonzero()
+    _write_entries(f, name, [_names(n, i) for n, i in zip(names, index)],
+                   _truncate_sparse(a))
+
+
+def _write_compressed_reward(f, R, actions, states, observations):
+    """Writes a CompressedReward for a POMDP file: default values for each
+    action and state, followed by overrides (later entries take precedence).
+    """
+    a, s = np.nonzero(R.base)
+    anything = np.full(a.shape, '*', dtype=object)
+    _write_entries(f, 'R', [_names(actions, a), _names(states, s),
+                            anything, anything], R.base[a, s])
+    a, s, new_s, o = R.override_index()
+    if R.observation_dependent:
+        o = _names(observations, o)
+    else:
+        o = np.full(o.shape, '*', dtype=object)
+    _write_entries(f, 'R', [_names(actions, a), _names(states, s),
+                            _names(states, new_s), o], R.values)
+
+
+def _fingerprint_data(a, reward=False):
+    """Canonical content of dense or sparse arrays, for fingerprints, so that
+    the storage does not change the digest: non-zero entries of
+    probabilities, and compressed form of rewards (see
+    CompressedReward.canonical).
+    """
+    if reward:
+        if isinstance(a, CompressedReward):
+            r = a.canonical()
+        else:
+            r = CompressedReward.from_dense(a)
+        return (tuple(int(n) for n in r.shape), r.base.astype(float),
+                [i.astype(np.int64) for i in r.override_index()],
+                r.values.astype(float), bool(r.observation_dependent))
+    if isinstance(a, SparseArray):
+        index, values = a.nonzero(), a.data
+        keep = values != 0
+    else:
+        a = np.asarray(a)
+        index = np.nonzero(a)
+        values = a[index]
+        keep = slice(None)
+    return (tuple(int(n) for n in a.shape),
+            [i[keep].astype(np.int64) for i in index],
+            values[keep].astype(float))
+
+
+def _array_to_json(a, as_lists=True):
+    if isinstance(a, (SparseArray, CompressedReward)):
+        return a.to_dict(as_lists=as_lists)
+    elif as_lists:
+        return a.tolist()
+    else:
+        return np.asarray(a)
+
+
+def _array_from_json(x, cls):
+    if isinstance(x, dict):
+        return cls.from_dict(x)
+    else:
+        return np.asarray(x)
+
+
+def _rows_searchsorted(c, starts, stops, u):
+    """Same as searchsorted(c[start:stop], u, side='right') for each start,
+    stop, and u, vectorized over rows. Returns indices in c, capped to the
+    last element of each row.
+    """
+    lo = np.array(starts, dtype=np.int64)
+    hi = np.asarray(stops, dtype=np.int64) - 1
+    active = lo < hi
+    while active.any():
+        mid = (lo + hi) // 2
+        right = c[mid] <= u
+        lo = np.where(active & right, mid + 1, lo)
+        hi = np.where(active & ~right, mid, hi)
+        active = lo < hi
+    return lo
+
+
+def _check_normalized(sums):
+    if not np.allclose(sums, 1.):
+        raise ValueError('Probabilities must sum to 1 on last dimension.')
+
+
+class _CumulativeTable(object):
+
+    """Inverse CDF sampling from the distributions on the last dimension of
+    an array of probabilities.
+
+    Cumulative sums of all rows are stored in a single flat array; samples
+    for several rows are obtained with one binary search vectorized over
+    the rows.
+
+    :param p: array of probabilities (must sum to 1 on last dimension)
+    """
+
+    def __init__(self, p):
+        self.n = p.shape[-1]
+        self.shape = p.shape[:-1]
+        c = p.reshape((-1, self.n)).cumsum(axis=1)
+        _check_normalized(c[:, -1])
+        c /= c[:, -1:]
+        c[:, -1] = 1.  # Guards against rounding errors
+        self._cumsum = c.ravel()
+
+    def sample(self, *index):
+        """Samples from a single row, index is given as integers."""
+        r = 0
+        for i, n in zip(index, self.shape):
+            r = r * n + i
+        start = r * self.n
+        i = np.searchsorted(self._cumsum[start:start + self.n],
+                            np.random.random(), side='right')
+        return int(min(i, self.n - 1))
+
+    def sample_batch(self, *index):
+        """Samples from a row for each element of the index arrays."""
+        start = np.ravel_multi_index(index, self.shape) * self.n
+        i = _rows_searchsorted(self._cumsum, start, start + self.n,
+                               np.random.random(start.shape))
+        return i - start
+
+
+class _SparseCumulativeTable(_CumulativeTable):
+
+    """Same as _CumulativeTable for a SparseArray, only non-zero entries are
+    stored.
+    """
+
+    def __init__(self, p):
+        self.n = p.n_columns
+        self.shape = p.shape[:-1]
+        self._indptr = p.indptr
+        self._columns = p.indices
+        n_rows = self._indptr.shape[0] - 1
+        rows = np.repeat(np.arange(n_rows), np.diff(self._indptr))
+        sums = np.bincount(rows, weights=p.data, minlength=n_rows)
+        _check_normalized(sums)
+        c = p.data.cumsum()
+        c -= np.append(0., c)[self._indptr[:-1]][rows]  # restart on each row
+        c /= sums[rows]
+        c[self._indptr[1:] - 1] = 1.
+        self._cumsum = c
+
+    def sample(self, *index):
+        r = 0
+        for i, n in zip(index, self.shape):
+            r = r * n + i
+        start, end = self._indptr[r], self._indptr[r + 1]
+        i = np.searchsorted(self._cumsum[start:end], np.random.random(),
+                            side='right')
+        return int(self._columns[start + min(i, end - start - 1)])
+
+    def sample_batch(self, *index):
+        r = np.ravel_multi_index(index, self.shape)
+        i = _rows_searchsorted(self._cumsum, self._indptr[r],
+                               self._indptr[r + 1],
+                               np.random.random(r.shape))
+        return self._columns[i]
+
+
+def _cumulative_table(p):
+    if isinstance(p, SparseArray):
+        return _SparseCumulativeTable(p)
+    else:
+        return _CumulativeTable(p)
+
+
+def _check_no_parameters(method, names):
+    if names:
+        raise TypeError('Unexpected parameters for {}: {}.'.format(
+            method, ', '.join(sorted(names))))
 
 
 class POMDP:
@@ -137,6 +452,9 @@ class POMDP:
         (must sum to 1 on last dimension)
     :param R: array of shape (n_actions, n_states, n_states, n_observations)
         Rewards or cost (must sum to 1 on last dimension)
+
+        T and O may be given as SparseArray and R as CompressedReward
+        (see task_models.lib.sparse), they are then kept in this form.
     :param start: array of shape (n_states)
         Initial state probabilities
     :param discount: discount factor (int)
@@ -149,7 +467,8 @@ class POMDP:
     :values: ('reward' | 'cost')
         How to interpret reward coefficients.
     :solver_path: string
-        Path in which to look for the executable (default to $PATH)
+        Path in which to look for the pomdp-solve executable (default to
+        $PATH), only needed by the incprune and grid solvers.
     """
 
     def __init__(self, T, O, R, start, discount, states=None, actions=None,
@@ -161,6 +480,8 @@ class POMDP:
         self._init_observations(observations, o)
         self.T = T
         self.O = O
+        self._sampling_tables = None
+        self._belief_operators = None
         if values == 'reward':
             self.R = R
         elif values == 'cost':
@@ -177,8 +498,6 @@ class POMDP:
         self.discount = discount
         self._solver_path = spawn.find_executable(SOLVER_NAME,
                                                   path=solver_path)
-        if self._solver_path is None:
-            raise ImportError('Could not find executable for pomdp-solve.')
 
     def _init_states(self, states, s):
         if states is not None:
@@ -256,48 +575,234 @@ class POMDP:
         assert_no_dup(self.actions, 'action(s)')
         assert_no_dup(self.observations, 'observation(s)')
 
+    def _successor_probabilities(self, a, states, probabilities):
+        """Next state probabilities from the given states (dense array)."""
+        if isinstance(self.T, SparseArray):
+            return self.T.dot_rows(self.T.rows(a, states), probabilities)
+        else:
+            return probabilities.dot(self.T[a, states, :])
+
+    def _observation_probabilities(self, a, o):
+        """Probabilities of observing o in each state after action a."""
+        if isinstance(self.O, SparseArray):
+            return self.O[a, np.arange(self.n_states), o]
+        else:
+            return self.O[a, :, o]
+
+    def _belief_operator(self, a, o):
+        """Fused operator T[a] * O[a, :, o] such that the belief update for
+        action a and observation o is b.dot(operator), normalized.
+
+        :return: 2D SparseArray if T is sparse, otherwise a dense array
+        """
+        p_o = self._observation_probabilities(a, o)
+        if isinstance(self.T, SparseArray):
+            n = self.n_states
+            indptr = self.T.indptr[a * n:(a + 1) * n + 1]
+            start, end = indptr[0], indptr[-1]
+            rows = np.repeat(np.arange(n), np.diff(indptr))
+            columns = self.T.indices[start:end]
+            values = self.T.data[start:end] * p_o[columns]
+            keep = values > 0
+            return SparseArray((n, n), (rows[keep], columns[keep]),
+                               values[keep])
+        else:
+            return np.asarray(self.T[a]) * p_o
+
+    def precompute_belief_operators(self):
+        """Computes and stores the belief update operators for all actions
+        and observations, used by belief_update, sparse_belief_update, and
+        belief_update_many.
+
+        This uses as much memory as T for each observation. Note: they need
+        to be recomputed if T or O are modified in place (randomize drops
+        them).
+        """
+        self._belief_operators = [
+            [self._belief_operator(a, o) for o in range(self.n_observations)]
+            for a in range(self.n_actions)]
+
+    def _get_belief_operator(self, a, o):
+        if self._belief_operators is None:
+            return self._belief_operator(a, o)
+        else:
+            return self._belief_operators[a][o]
+
     def belief_update(self, a, o, b):
-        new_b = b.dot(self.T[a, ...]) * self.O[a, :, o]
+        if self._belief_operators is not None:
+            M = self._belief_operators[a][o]
+            if isinstance(M, SparseArray):
+                states = np.flatnonzero(b)
+                new_b = M.dot_rows(states, b[states])
+            else:
+                new_b = b.dot(M)
+        else:
+            if isinstance(self.T, SparseArray):
+                states = np.flatnonzero(b)
+                new_b = self._successor_probabilities(a, states, b[states])
+            else:
+                new_b = b.dot(self.T[a, ...])
+            new_b *= self._observation_probabilities(a, o)
         s = new_b.sum()
         if s == 0.:
             raise Impossible('Impossible observation: ' + str(o))
         return new_b / s
 
+    def belief_update_many(self, a, o, beliefs):
+        """Same as belief_update for several beliefs at once.
+
+        The belief update operator is computed once for all beliefs if not
+        precomputed (see precompute_belief_operators).
+
+        :param beliefs: array of beliefs (one per row)
+        :return: array of new beliefs
+        """
+        M = self._get_belief_operator(a, o)
+        if isinstance(M, SparseArray):
+            new_b = M.left_dot(beliefs)
+        else:
+            new_b = np.asarray(beliefs).dot(M)
+        s = new_b.sum(-1)
+        if (s == 0.).any():
+            raise Impossible('Impossible observation: ' + str(o))
+        return new_b / s[..., np.newaxis]
+
+    def sparse_belief_update(self, a, o, states, probabilities):
+        """Same as belief_update for a belief given by its support and the
+        corresponding probabilities. Only the rows of T for the support are
+        used.
+
+        :return: support and probabilities of the new belief
+        """
+        if self._belief_operators is not None:
+            M = self._belief_operators[a][o]
+            if isinstance(M, SparseArray):
+                new_b = M.dot_rows(states, probabilities)
+            else:
+                new_b = probabilities.dot(M[states, :])
+        else:
+            new_b = (self._successor_probabilities(a, states, probabilities) *
+                     self._observation_probabilities(a, o))
+        new_states = np.flatnonzero(new_b)
+        if new_states.shape[0] == 0:
+            raise Impossible('Impossible observation: ' + str(o))
+        new_b = new_b[new_states]
+        return new_states, new_b / new_b.sum()
+
+    def _get_sampling_tables(self):
+        """Cumulative tables for T and O, built on first use.
+
+        Note: they need to be reset if T or O are modified in place (as done
+        by randomize).
+        """
+        if self._sampling_tables is None:
+            self._sampling_tables = (_cumulative_table(self.T),
+                                     _cumulative_table(self.O))
+        return self._sampling_tables
+
     def sample_transition(self, a, s):
-        new_s = np.random.choice(self.n_states, p=self.T[a, s, :])
-        o = np.random.choice(self.n_observations, p=self.O[a, new_s, :])
+        T, O = self._get_sampling_tables()
+        new_s = T.sample(a, s)
+        o = O.sample(a, new_s)
         r = self.R[a, s, new_s, o]
         return new_s, o, r
 
+    def sample_transition_batch(self, actions, states):
+        """Samples one transition for each pair of action and state.
+
+        :param actions: integer array of actions
+        :param states: integer array of states (same shape as actions)
+        :return: arrays of new states, observations, and rewards
+        """
+        T, O = self._get_sampling_tables()
+        a = np.asarray(actions)
+        s = np.asarray(states)
+        new_s = T.sample_batch(a, s)
+        o = O.sample_batch(a, new_s)
+        return new_s, o, self.R[a, s, new_s, o]
+
+    def observation_probability(self, a, s, new_s, o):
+        """Probabilities of observing o on the transitions from states s to
+        new_s (arrays) with action a.
+        """
+        return self.O[a, new_s, o]
+
+    def expected_rewards(self):
+        """Array of shape (n_actions, n_states) of expected immediate
+        rewards.
+        """
+        if isinstance(self.R, CompressedReward):
+            return self.R.expected(self.T, self.O)
+        else:
+            return np.einsum('asz,azo,aszo->as', np.asarray(self.T),
+                             np.asarray(self.O), self.R)
+
     def sample_start(self):
         return np.random.choice(self.n_states, p=self.start)
 
-    def dump(self):
+    def write(self, f, sparse=None):
         """Write POMDP description following:
         `<http://www.pomdp.org/code/pomdp-file-spec.html>`_
+        to an open file.
+
+        :param sparse: None | True | False
+            Whether to write T, O and R with one line per non-zero entry
+            (or per default value and override for rewards). By default
+            only done when they have few entries compared to their size
+            (see SPARSE_FRACTION).
         """
-        preamble = PREAMBLE_FMT.format(
+        f.write(PREAMBLE_FMT.format(
             discount=self.discount,
             states=_dump_list_or_count(self._s),
             actions=_dump_list_or_count(self._a),
-            observations=_dump_list_or_count(self._o))
-        start = "start: {}".format(_dump_1d_array(np.asarray(self.start)))
-        T = _dump_3d_array(self.T, 'T', self.actions)
-        O = _dump_3d_array(self.O, 'O', self.actions)
-        R = _dump_4d_array(self.R, 'R', self.actions, self.states)
-        return '\n\n'.join([preamble, start, T, O, R])
-
-    def dump_to(self, path, name):
+            observations=_dump_list_or_count(self._o)))
+        f.write("\n\nstart: {}\n\n".format(
+            _dump_1d_array(np.asarray(self.start))))
+        for name, a, names in [
+                ('T', self.T, [self.actions, self.states, self.states]),
+                ('O', self.O, [self.actions, self.states, self.observations])]:
+            if not isinstance(a, SparseArray) and sparse is not False:
+                a = SparseArray.from_dense(a)
+            if isinstance(a, SparseArray) and (
+                    sparse or sparse is None and
+                    a.nnz <= SPARSE_FRACTION * np.prod(a.shape)):
+                _write_sparse_array(f, a, name, names)
+            else:
+                _write_dense_array(f, a, name, names[:-2])
+            f.write('\n')
+        R = self.R
+        if not isinstance(R, CompressedReward) and sparse is not False:
+            R = CompressedReward.from_dense(R)
+        if isinstance(R, CompressedReward) and (
+                sparse or sparse is None and
+                (np.count_nonzero(R.base) + R.n_overrides <=
+                 SPARSE_FRACTION * np.prod(R.shape))):
+            _write_compressed_reward(f, R, self.actions, self.states,
+                                     self.observations)
+        else:
+            _write_dense_array(f, self.R, 'R', [self.actions, self.states])
+
+    def dump(self, sparse=None):
+        """POMDP description as a string (see write)."""
+        f = io.StringIO()
+        self.write(f, sparse=sparse)
+        return f.getvalue().rstrip('\n')
+
+    def dump_to(self, path, name, sparse=None):
         full_path = os.path.join(path, name + '.pomdp')
         with open(full_path, 'w') as f:
-            f.write(self.dump())
+            self.write(f, sparse=sparse)
         return full_path
 
-    def to_dict(self):
-        return {'T': self.T.tolist(),
-                'O': self.O.tolist(),
-                'R': self.R.tolist(),
-                'start': self.start.tolist(),
+    def to_dict(self, as_lists=True):
+        """Sparse arrays and compressed rewards are stored as dictionaries.
+
+        :param as_lists: False to keep numpy arrays (see save)
+        """
+        return {'T': _array_to_json(self.T, as_lists),
+                'O': _array_to_json(self.O, as_lists),
+                'R': _array_to_json(self.R, as_lists),
+                'start': _array_to_json(self.start, as_lists),
                 'discount': self.discount,
                 'states': self.states,
                 'actions': self.actions,
@@ -313,7 +818,9 @@ class POMDP:
 
     @classmethod
     def from_dict(cls, d):
-        return cls(np.asarray(d['T']), np.asarray(d['O']), np.asarray(d['R']),
+        return cls(_array_from_json(d['T'], SparseArray),
+                   _array_from_json(d['O'], SparseArray),
+                   _array_from_json(d['R'], CompressedReward),
                    np.asarray(d['start']), d['discount'], states=d['states'],
                    actions=d['actions'], observations=d['observations'],
                    values='reward')
@@ -329,18 +836,103 @@ class POMDP:
             d = json.load(f)
             return cls.from_dict(d)
 
+    def save(self, path):
+        """Saves the model in binary form in directory path (see binary)."""
+        save_arrays(path, self.to_dict(as_lists=False))
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        """Loads a model saved with save.
+
+        :param mmap_mode: None | 'r' | 'r+' | 'c'
+            Memory map the arrays instead of reading them (see numpy.load);
+            use 'r' to share a large model between processes.
+        """
+        return cls.from_dict(load_arrays(path, mmap_mode=mmap_mode))
+
     def randomize(self, p_unexpected=1.e-3):
+        """Adds probability p_unexpected to every transition and observation.
+
+        Raises ValueError on sparse T or O since every entry becomes non
+        zero (convert them explicitly with numpy.asarray first).
+        """
+        if isinstance(self.T, SparseArray) or isinstance(self.O, SparseArray):
+            raise ValueError("Can't randomize sparse T or O, convert them "
+                             "to dense arrays first.")
         self.T += p_unexpected
         self.T /= self.T.sum(-1)[..., None]
         self.O += p_unexpected
         self.O /= self.O.sum(-1)[..., None]
+        self._sampling_tables = None
+        self._belief_operators = None
+
+    def fingerprint(self):
+        """Digest of the model content (arrays, discount, and names of
+        states, actions, and observations).
+        """
+        return fingerprint(
+            _fingerprint_data(self.T), _fingerprint_data(self.O),
+            _fingerprint_data(self.R, reward=True),
+            np.asarray(self.start), float(self.discount),
+            [self.states, self.actions, self.observations])
 
     def solve(self, timeout=None, n_iterations=None, method='incprune',
-              grid_type=None, seed=None, verbose=False):
+              grid_type=None, seed=None, verbose=False, cache=None,
+              job_timeout=None, **pbvi_params):
         """
-        :param method: incprune | grid (incprune)
+        :param method: incprune | grid | pbvi | qmdp | fib (incprune)
+            incprune and grid run the external pomdp-solve, pbvi runs
+            task_models.lib.pbvi.solve_pbvi in process, qmdp and fib
+            return the greedy policy for the corresponding bound (see
+            task_models.lib.bounds).
         :param grid_type: simplex | pairwise (simplex)
+        :param cache: None | task_models.lib.cache.FileCache
+            If given, policies are stored in and loaded from the cache,
+            indexed by the model fingerprint and the solver parameters
+            (note that a seed of None is then not random).
+        :param job_timeout: hard limit in seconds for pomdp-solve, which is
+            killed when reached (subprocess.TimeoutExpired is raised).
+            Unlike timeout, which pomdp-solve checks between iterations, it
+            does not return a policy. For pbvi it is only used as timeout.
+            On Python 2 it requires the subprocess32 package.
+        :param pbvi_params: additional parameters for solve_pbvi (beliefs,
+            n_beliefs, values, tolerance); qmdp and fib only accept beliefs
+            (and neither timeout nor job_timeout)
         """
+        if cache is not None:
+            key = fingerprint(self.fingerprint(), method, timeout,
+                              n_iterations, grid_type, seed, pbvi_params)
+            d = cache.get(key)
+            if d is None:
+                policy = self.solve(timeout=timeout, n_iterations=n_iterations,
+                                    method=method, grid_type=grid_type,
+                                    seed=seed, verbose=verbose,
+                                    job_timeout=job_timeout, **pbvi_params)
+                cache.put(key, policy.to_dict())
+                return policy
+            else:
+                return GraphPolicy.from_dict(d)
+        # pbvi and bounds depend on this module (imported when needed)
+        if method == 'pbvi':
+            from .pbvi import solve_pbvi
+            if n_iterations is not None:
+                pbvi_params['n_iterations'] = n_iterations
+            if job_timeout is not None:
+                timeout = min(job_timeout, timeout or job_timeout)
+            return solve_pbvi(self, timeout=timeout, seed=seed, **pbvi_params)
+        elif method in ('qmdp', 'fib'):
+            # Bounds are computed without time limit, only from beliefs
+            unexpected = [k for k in pbvi_params if k != 'beliefs']
+            unexpected.extend(
+                k for k, v in (('timeout', timeout),
+                               ('job_timeout', job_timeout))
+                if v is not None)
+            _check_no_parameters(method, unexpected)
+            return self._solve_bound(method, n_iterations=n_iterations,
+                                     seed=seed, **pbvi_params)
+        _check_no_parameters(method, pbvi_params)
+        if self._solver_path is None:
+            raise ImportError('Could not find executable for pomdp-solve.')
         name = 'tosolve'
         args = []
         if timeout is not None:
@@ -357,26 +949,42 @@ class POMDP:
         with TemporaryDirectory() as tmpdir:
             pomdp_file = self.dump_to(tmpdir, name)
             args.extend(['-o', name, '-pomdp', pomdp_file])
+            # Only pass timeout if needed (not supported on Python 2)
+            call_params = {} if job_timeout is None else {
+                'timeout': job_timeout}
             with open(os.devnull, 'w') as DEVNULL:
                 subprocess.check_call(
                     [self._solver_path] + args, cwd=tmpdir,
-                    stdout=None if verbose else DEVNULL)
+                    stdout=None if verbose else DEVNULL, **call_params)
             return self.load_policy_from(tmpdir, name)
 
-    def load_policy_from(self, path, name):
-        value_function_file = os.path.join(path, name + '.alpha')
-        policy_graph_file = os.path.join(path, name + '.pg')
-        with open(value_function_file, 'r') as vf:
-            actions, vf = parse_value_function(vf)
-        with open(policy_graph_file, 'r') as pf:
-            actions2, pg = parse_policy_graph(pf)
-        assert(actions == actions2)  # policy and value function share actions
-        assert(max(actions) < len(self.actions))  # actions are well-formed
-        assert(max([t for ts in pg for t in ts if t is not None]) <= len(pg))
-        # (transitions are well-formed)
+    def _solve_bound(self, method, n_iterations=None, seed=None,
+                     beliefs=None):
+        from .bounds import qmdp_alphas, fib_alphas
+        from .pbvi import policy_from_alphas
+        bound = qmdp_alphas if method == 'qmdp' else fib_alphas
+        params = {} if n_iterations is None else {
+            'n_iterations': n_iterations}
+        return policy_from_alphas(self, bound(self, **params),
+                                  beliefs=beliefs, seed=seed)
+
+    def load_policy_from(self, path, name, npy_path=None):
+        """Loads the policy written by pomdp-solve in path.
+
+        :param npy_path: if given, values are stored in this file and memory
+            mapped (see load_value_function)
+        """
+        actions, vf = load_value_function(
+            os.path.join(path, name + '.alpha'), npy_path=npy_path)
+        with open(os.path.join(path, name + '.pg'), 'r') as pf:
+            actions2, pg = _policy_graph_arrays(pf.read())
+        # policy and value function share actions
+        assert(np.array_equal(actions, actions2))
+        assert(actions.max() < len(self.actions))  # actions are well-formed
+        assert(pg.max() <= pg.shape[0])  # transitions are well-formed
         action_names = [self.actions[a] for a in actions]
-        return GraphPolicy(action_names, self.observations, pg, vf,
-                           start=self.start)
+        return GraphPolicy(action_names, self.observations,
+                           _transitions_with_none(pg), vf, start=self.start)
 
 
 class GraphPolicy:
@@ -385,6 +993,7 @@ class GraphPolicy:
                  init=None):
         self.actions = actions
         self.observations = observations
+        self._observation_index = _index_dict(observations)
         self.transitions = np.asarray(transitions)
         assert(self.transitions.shape == (self.n_nodes, len(observations)))
         self.values = np.asarray(values)
@@ -403,17 +1012,46 @@ class GraphPolicy:
     def get_node_from_belief(self, b):
         return self.values.dot(b[:, np.newaxis]).argmax()
 
+    def get_nodes_from_beliefs(self, beliefs):
+        """Same as get_node_from_belief for an array of beliefs (one per
+        row), with a single product.
+
+        :return: integer array of nodes
+        """
+        return np.asarray(beliefs).dot(self.values.T).argmax(-1)
+
     def get_action(self, current):
         return self.actions[current]
 
+    def observation_index(self, observation):
+        return self._observation_index[observation]
+
     def next(self, current, observation):
-        return self.transitions[current, self.observations.index(observation)]
+        return self.transitions[current, self._observation_index[observation]]
+
+    def next_node(self, current, o):
+        """Same as next with the index of the observation.
 
-    def to_dict(self):
+        current and o may also be integer arrays, to step several runs at
+        once (None marks unexpected observations).
+        """
+        return self.transitions[current, o]
+
+    def to_dict(self, as_lists=True):
+        """:param as_lists: False to keep numpy arrays (see save); missing
+            transitions are then stored as -1
+        """
+        if as_lists:
+            transitions = self.transitions.tolist()
+            values = self.values.tolist()
+        else:
+            transitions = np.where(np.equal(self.transitions, None), -1,
+                                   self.transitions).astype(np.int64)
+            values = self.values
         return {'actions': self.actions,
                 'observations': self.observations,
-                'transitions': self.transitions.tolist(),
-                'values': self.values.tolist(),
+                'transitions': transitions,
+                'values': values,
                 'initial': str(self.init),
                 }
 
@@ -438,6 +1076,20 @@ class GraphPolicy:
         with open(path) as f:
             return cls.from_dict(json.load(f))
 
+    def save(self, path):
+        """Saves the policy in binary form in directory path (see binary)."""
+        save_arrays(path, self.to_dict(as_lists=False))
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        """Loads a policy saved with save.
+
+        :param mmap_mode: see POMDP.load (only values are memory mapped)
+        """
+        d = load_arrays(path, mmap_mode=mmap_mode)
+        d['transitions'] = _transitions_with_none(d['transitions'])
+        return cls.from_dict(d)
+
 
 class GraphPolicyRunner(object):
 
@@ -455,7 +1107,11 @@ class GraphPolicyRunner(object):
         return self.gp.get_action(self.current)
 
     def step(self, observation):
-        self.current = self.gp.next(self.current, observation)
+        self.step_index(self.gp.observation_index(observation))
+
+    def step_index(self, o):
+        """Same as step with the index of the observation."""
+        self.current = self.gp.next_node(self.current, o)
         if self.current is None:
             raise Impossible('Got unexpected observation')
 
@@ -465,6 +1121,10 @@ class GraphPolicyBeliefRunner(GraphPolicyRunner):
     def __init__(self, graph_policy, pomdp):
         self.gp = graph_policy
         self.pomdp = pomdp
+        # Index in the POMDP of the action of each node
+        action_index = _index_dict(pomdp.actions)
+        self._node_actions = [action_index[a] for a in graph_policy.actions]
+        self._observation_index = _index_dict(pomdp.observations)
         self.reset()
 
     def reset(self, belief=None):
@@ -474,9 +1134,12 @@ class GraphPolicyBeliefRunner(GraphPolicyRunner):
         super(GraphPolicyBeliefRunner, self).reset(belief=belief)
 
     def step(self, observation):
-        a = self.pomdp.actions.index(self.get_action())
-        o = self.pomdp.observations.index(observation)
-        b = self.pomdp.belief_update(a, o, self.current_belief)
+        self.step_index(self._observation_index[observation])
+
+    def step_index(self, o):
+        """Same as step with the index of the observation in the POMDP."""
+        b = self.pomdp.belief_update(self._node_actions[self.current], o,
+                                     self.current_belief)
         self.reset(belief=b)
 
     def _rec_trajectory_tree(self, obs, horizon):
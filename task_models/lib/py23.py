@@ -1,3 +1,4 @@
+import os
 import sys
 import tempfile
 
@@ -5,6 +6,11 @@ if sys.version_info >= (3, 0):
     TemporaryDirectory = tempfile.TemporaryDirectory
     from queue import Queue
     import pickle
+    import subprocess
+    import concurrent.futures as futures
+    replace = os.replace
+    text_type = str
+    integer_types = (int,)
 else:
     import shutil
 
@@ -20,6 +26,17 @@ else:
             shutil.rmtree(self.name)
 
     from Queue import Queue
+    replace = os.rename  # Atomic on POSIX systems
+    text_type = unicode  # noqa: F821
+    integer_types = (int, long)  # noqa: F821
+    try:  # Backport with timeout support
+        import subprocess32 as subprocess
+    except ImportError:
+        import subprocess
+    try:  # Backport from the futures package
+        import concurrent.futures as futures
+    except ImportError:
+        futures = None
     try:
         import cpickle as pickle
     except ImportError:
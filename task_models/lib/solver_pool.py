@@ -0,0 +1,75 @@
+"""Solving several POMDPs concurrently."""
+
+from multiprocessing import cpu_count
+
+from .py23 import futures
+
+
+def _solve(pomdp, params):
+    return pomdp.solve(**params)
+
+
+class SolverPool(object):
+    """Bounded pool of workers that run POMDP.solve.
+
+    Threads are enough for pomdp-solve (incprune and grid methods) which
+    runs in its own process; use processes=True for in-process solvers
+    (pbvi) to use several cores.
+
+    Temporary directories of failed or killed jobs are removed by
+    POMDP.solve. Use job_timeout (see POMDP.solve) to bound the duration of
+    each job.
+
+    :param n_workers: maximum number of concurrent jobs (default to the
+        number of cores)
+    :param processes: run jobs in worker processes instead of threads
+    """
+
+    def __init__(self, n_workers=None, processes=False):
+        if futures is None:
+            raise ImportError('SolverPool requires concurrent.futures '
+                              '(install the futures package on Python 2).')
+        if n_workers is None:
+            n_workers = cpu_count()
+        self.n_workers = n_workers
+        executor = (futures.ProcessPoolExecutor if processes
+                    else futures.ThreadPoolExecutor)
+        self._executor = executor(max_workers=n_workers)
+
+    def solve_async(self, pomdp, **params):
+        """Queues the solving of pomdp.
+
+        :param params: parameters for POMDP.solve
+        :return: concurrent.futures.Future of the GraphPolicy
+        """
+        return self._executor.submit(_solve, pomdp, params)
+
+    def solve_many(self, pomdps, **params):
+        """Solves all pomdps with the same parameters.
+
+        :return: list of GraphPolicy (in the order of pomdps); the first
+            exception raised by a job, if any, is raised once all jobs
+            are done
+        """
+        futures = [self.solve_async(p, **params) for p in pomdps]
+        for f in futures:  # Wait for every job before raising
+            f.exception()
+        return [f.result() for f in futures]
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+
+def solve_many(pomdps, n_workers=None, processes=False, **params):
+    """Solves all pomdps concurrently on a temporary SolverPool.
+
+    :return: list of GraphPolicy
+    """
+    with SolverPool(n_workers=n_workers, processes=processes) as pool:
+        return pool.solve_many(pomdps, **params)
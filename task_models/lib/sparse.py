@@ -0,0 +1,440 @@
+"""Compact storage for POMDP arrays.
+
+- SparseArray stores the non-zero entries of an array of probability
+  distributions (on the last dimension) such as T or O, row by row.
+- CompressedReward stores rewards as a default value for each action and
+  start state, plus the transitions that differ from it.
+
+Both support the integer indexing used to sample transitions (one integer
+or integer array per dimension) and conversion to dense arrays with
+np.asarray.
+"""
+
+import numpy as np
+
+
+def _export(a, as_lists):
+    return a.tolist() if as_lists else a
+
+
+def _is_integer_index(index, ndim):
+    return (isinstance(index, tuple) and len(index) == ndim and
+            all(np.issubdtype(np.asarray(i).dtype, np.integer)
+                for i in index))
+
+
+def _lookup(keys, values, k, default):
+    """Values for flat keys k in sorted keys, default where not found."""
+    if keys.shape[0] == 0:
+        found, values = np.zeros(np.shape(k), dtype=bool), 0.
+    else:
+        i = np.minimum(np.searchsorted(keys, k), keys.shape[0] - 1)
+        found = keys[i] == k
+        values = values[i]
+    return np.where(found, values, default)[()]
+
+
+class SparseArray(object):
+    """Non-zero entries of an array, stored in compressed rows on the last
+    dimension.
+
+    :param shape: shape of the full array
+    :param index: tuple of integer arrays, coordinates of the entries
+    :param values: array of values for the entries (values for duplicate
+        coordinates are summed)
+    """
+
+    def __init__(self, shape, index, values):
+        self.shape = tuple(shape)
+        self.n_columns = self.shape[-1]
+        n_rows = int(np.prod(self.shape[:-1]))
+        keys = np.ravel_multi_index(index, self.shape).ravel()
+        values = np.broadcast_to(values, keys.shape)
+        keys, inverse = np.unique(keys, return_inverse=True)
+        self._keys = keys
+        self.data = np.bincount(inverse.ravel(), weights=values)
+        self._entry_rows, self.indices = np.divmod(keys, self.n_columns)
+        self.indptr = np.zeros((n_rows + 1,), dtype=np.int64)
+        np.cumsum(np.bincount(self._entry_rows, minlength=n_rows),
+                  out=self.indptr[1:])
+        self._columns = None
+
+    @classmethod
+    def _from_canonical(cls, shape, keys, entry_rows, indices, indptr,
+                        data):
+        """Wraps arrays already in the stored form (see to_dict with
+        as_lists=False) without copying them, so that memory mapped arrays
+        stay mapped.
+        """
+        a = cls.__new__(cls)
+        a.shape = tuple(int(n) for n in shape)
+        a.n_columns = a.shape[-1]
+        a._keys = keys
+        a._entry_rows = entry_rows
+        a.indices = indices
+        a.indptr = indptr
+        a.data = data
+        a._columns = None
+        return a
+
+    @classmethod
+    def from_dense(cls, a):
+        a = np.asarray(a)
+        index = np.nonzero(a)
+        return cls(a.shape, index, a[index])
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def nnz(self):
+        return self.data.shape[0]
+
+    @property
+    def nbytes(self):
+        return (self._keys.nbytes + self._entry_rows.nbytes +
+                self.data.nbytes + self.indices.nbytes + self.indptr.nbytes)
+
+    def nonzero(self):
+        """Coordinates of the stored entries (sorted in row major order)."""
+        return np.unravel_index(self._keys, self.shape)
+
+    def toarray(self):
+        a = np.zeros(self.shape)
+        a.flat[self._keys] = self.data
+        return a
+
+    def __array__(self, dtype=None, copy=None):
+        a = self.toarray()
+        return a if dtype is None else a.astype(dtype)
+
+    def __getitem__(self, index):
+        """Integer indices (one per dimension) are looked up in the sparse
+        entries, other indices are applied to the dense array.
+        """
+        if _is_integer_index(index, self.ndim):
+            k = np.ravel_multi_index(index, self.shape)
+            return _lookup(self._keys, self.data, k, 0.)
+        return self.toarray()[index]
+
+    def sum(self, axis=-1):
+        """Sum on last axis (only one supported)."""
+        if axis not in (-1, self.ndim - 1):
+            raise ValueError('Only sum on last axis is supported.')
+        return np.bincount(self._entry_rows, weights=self.data,
+                           minlength=self.indptr.shape[0] - 1
+                           ).reshape(self.shape[:-1])
+
+    def rows(self, *index):
+        """Flat row indices for the given (integer) indices on all but the
+        last dimension.
+        """
+        return np.ravel_multi_index(index, self.shape[:-1])
+
+    def _row_entries(self, rows):
+        """Positions of the entries of given rows, and the number of entries
+        for each row.
+        """
+        starts = self.indptr[rows]
+        lengths = self.indptr[rows + 1] - starts
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return offsets + np.arange(lengths.sum()), lengths
+
+    def dot_rows(self, rows, weights):
+        """Weighted sum of given rows, as a dense array.
+
+        :param rows: flat row indices (see rows)
+        :param weights: one weight per row
+        """
+        positions, lengths = self._row_entries(np.asarray(rows))
+        return np.bincount(self.indices[positions],
+                           weights=self.data[positions] *
+                           np.repeat(weights, lengths),
+                           minlength=self.n_columns)
+
+    def right_dot(self, x, start=0, stop=None):
+        """Dense product of flat rows start to stop by x (on the last
+        dimension), i.e. a.reshape((-1, n_columns))[start:stop].dot(x).
+
+        :param x: array with n_columns rows
+        """
+        if stop is None:
+            stop = self.indptr.shape[0] - 1
+        x = np.asarray(x)
+        indptr = self.indptr[start:stop + 1]
+        lo = indptr[0]
+        positions = slice(lo, indptr[-1])
+        out = np.zeros((stop - start,) + x.shape[1:])
+        not_empty = np.diff(indptr) > 0
+        if not_empty.any():
+            data = self.data[positions].reshape((-1,) + (1,) * (x.ndim - 1))
+            products = data * x[self.indices[positions]]
+            out[not_empty] = np.add.reduceat(
+                products, indptr[:-1][not_empty] - lo, axis=0)
+        return out
+
+    def _get_columns(self):
+        """Entries sorted by column, and positions of the first entry of
+        each non-empty column (built on first use).
+        """
+        if self._columns is None:
+            order = np.argsort(self.indices, kind='stable')
+            columns = self.indices[order]
+            starts = np.flatnonzero(np.diff(columns, prepend=-1))
+            self._columns = order, starts, columns[starts]
+        return self._columns
+
+    def left_dot(self, b):
+        """Dense product b.dot(a) for a 2D sparse array a.
+
+        :param b: vector or array of row vectors
+        """
+        if self.ndim != 2:
+            raise ValueError('Only 2D arrays are supported.')
+        b = np.asarray(b)
+        order, starts, columns = self._get_columns()
+        out = np.zeros(b.shape[:-1] + (self.n_columns,))
+        if starts.shape[0] > 0:
+            products = b[..., self._entry_rows[order]] * self.data[order]
+            out[..., columns] = np.add.reduceat(products, starts, axis=-1)
+        return out
+
+    def to_dict(self, as_lists=True):
+        """:param as_lists: False to keep numpy arrays (see binary), which
+            are then stored in their internal form
+        """
+        if not as_lists:
+            return {'shape': list(self.shape),
+                    'keys': self._keys,
+                    'entry_rows': self._entry_rows,
+                    'indices': self.indices,
+                    'indptr': self.indptr,
+                    'values': self.data,
+                    }
+        return {'shape': list(self.shape),
+                'index': [_export(i, as_lists) for i in self.nonzero()],
+                'values': _export(self.data, as_lists),
+                }
+
+    @classmethod
+    def from_dict(cls, d):
+        if 'keys' in d:
+            return cls._from_canonical(d['shape'], d['keys'], d['entry_rows'],
+                                       d['indices'], d['indptr'], d['values'])
+        return cls(d['shape'], tuple(np.asarray(i, dtype=np.int64)
+                                     for i in d['index']), d['values'])
+
+
+def _row_modes(x):
+    """Most frequent value of each row of a 2D array."""
+    x = np.sort(x, axis=1)
+    flat = x.ravel()
+    rows = np.repeat(np.arange(x.shape[0]), x.shape[1])
+    new_run = np.ones(flat.shape, dtype=bool)
+    new_run[1:] = (flat[1:] != flat[:-1]) | (rows[1:] != rows[:-1])
+    starts = np.flatnonzero(new_run)
+    lengths = np.diff(np.append(starts, flat.shape[0]))
+    run_rows = rows[starts]
+    order = np.lexsort((-lengths, run_rows))  # longest run first in each row
+    first = np.ones(order.shape, dtype=bool)
+    first[1:] = run_rows[order][1:] != run_rows[order][:-1]
+    return flat[starts[order[first]]]
+
+
+class CompressedReward(object):
+    """Rewards of shape (n_actions, n_states, n_states, n_observations)
+    stored as a default value for each action and start state, and sparse
+    overrides for the transitions that differ from it.
+
+    When overrides do not depend on the observation they are stored for
+    (action, state, next state) only.
+
+    :param base: array of shape (n_actions, n_states)
+    :param n_observations: number of observations
+    :param index: tuple of integer arrays, coordinates of the overrides
+        (action, state, next state, and observation if observation_dependent)
+    :param values: values of the overrides
+    :param observation_dependent: whether overrides are given per
+        observation
+    """
+
+    def __init__(self, base, n_observations, index=None, values=None,
+                 observation_dependent=False):
+        self.base = np.asarray(base, dtype=float)
+        n_a, n_s = self.base.shape
+        self.shape = (n_a, n_s, n_s, n_observations)
+        self.observation_dependent = observation_dependent
+        self._override_shape = (n_a, n_s, n_s,
+                                n_observations if observation_dependent else 1)
+        if index is None:
+            index = (np.zeros((0,), dtype=np.int64),) * 4
+            values = np.zeros((0,))
+        elif not observation_dependent:
+            index = tuple(index[:3]) + (np.zeros_like(index[0]),)
+        keys = np.ravel_multi_index(index, self._override_shape).ravel()
+        values = np.broadcast_to(values, keys.shape)
+        self._keys, first = np.unique(keys, return_index=True)
+        self.values = values[first].astype(float)
+
+    @classmethod
+    def _from_canonical(cls, base, n_observations, keys, values,
+                        observation_dependent):
+        """Wraps arrays already in the stored form (see to_dict with
+        as_lists=False) without copying them.
+        """
+        r = cls.__new__(cls)
+        r.base = base
+        n_a, n_s = base.shape
+        r.shape = (n_a, n_s, n_s, n_observations)
+        r.observation_dependent = observation_dependent
+        r._override_shape = (n_a, n_s, n_s,
+                             n_observations if observation_dependent else 1)
+        r._keys = keys
+        r.values = values
+        return r
+
+    @classmethod
+    def from_dense(cls, R, n_observations=None):
+        """Compresses a dense array of rewards.
+
+        :param R: array of shape (n_actions, n_states, n_states, n_obs) or
+            (n_actions, n_states, n_states, 1) for rewards that do not
+            depend on the observation
+        :param n_observations: needed if the last dimension is 1
+        """
+        R = np.asarray(R)
+        if n_observations is None:
+            n_observations = R.shape[-1]
+        dependent = R.shape[-1] > 1 and not (R == R[..., :1]).all()
+        if not dependent:
+            R = R[..., :1]
+        n_a, n_s = R.shape[:2]
+        flat = R.reshape((n_a * n_s, -1))
+        base = _row_modes(flat)
+        keys = np.flatnonzero(flat != base[:, None])
+        index = np.unravel_index(keys, R.shape)
+        return cls(base.reshape((n_a, n_s)), n_observations, index=index,
+                   values=R.ravel()[keys], observation_dependent=dependent)
+
+    @property
+    def ndim(self):
+        return 4
+
+    @property
+    def n_overrides(self):
+        return self._keys.shape[0]
+
+    @property
+    def nbytes(self):
+        return self.base.nbytes + self._keys.nbytes + self.values.nbytes
+
+    def canonical(self):
+        """Equivalent CompressedReward in the form given by from_dense: the
+        base is the most frequent value of each action and state, and
+        overrides depend on the observation only if needed.
+
+        Only the (action, state) rows that have overrides are expanded.
+        """
+        n_a, n_s = self.base.shape
+        index = self.override_index()
+        rows = np.unique(np.ravel_multi_index(index[:2], (n_a, n_s)))
+        R = np.empty((rows.shape[0],) + self._override_shape[2:])
+        R[...] = self.base.flat[rows][:, None, None]
+        flat = R.reshape((rows.shape[0], int(np.prod(R.shape[1:]))))
+        pos = np.searchsorted(rows, self._keys // flat.shape[1])
+        flat[pos, self._keys % flat.shape[1]] = self.values
+        dependent = (self.observation_dependent and
+                     not (R == R[..., :1]).all())
+        if not dependent:
+            R = R[..., :1]
+            flat = R.reshape((rows.shape[0], R.shape[1]))
+        base = self.base.copy()
+        if rows.shape[0] > 0:
+            base.flat[rows] = _row_modes(flat)
+        r, c = np.nonzero(flat != base.flat[rows][:, None])
+        a, s = np.unravel_index(rows[r], (n_a, n_s))
+        return CompressedReward(
+            base, self.shape[-1],
+            index=(a, s) + np.unravel_index(c, R.shape[1:]),
+            values=flat[r, c], observation_dependent=dependent)
+
+    def override_index(self):
+        """Coordinates of the overrides (the observation is 0 if they do not
+        depend on it).
+        """
+        return np.unravel_index(self._keys, self._override_shape)
+
+    def toarray(self):
+        R = np.empty(self._override_shape)
+        R[...] = self.base[:, :, None, None]
+        R.flat[self._keys] = self.values
+        return np.broadcast_to(R, self.shape).copy()
+
+    def __array__(self, dtype=None, copy=None):
+        R = self.toarray()
+        return R if dtype is None else R.astype(dtype)
+
+    def __getitem__(self, index):
+        """Integer indices (one per dimension) are looked up in the compact
+        form, other indices are applied to the dense array.
+        """
+        if _is_integer_index(index, 4):
+            a, s, new_s, o = index
+            if not self.observation_dependent:
+                o = np.zeros_like(o)
+            k = np.ravel_multi_index((a, s, new_s, o), self._override_shape)
+            return _lookup(self._keys, self.values, k, self.base[a, s])
+        return self.toarray()[index]
+
+    def __neg__(self):
+        return CompressedReward(
+            -self.base, self.shape[-1], index=self.override_index(),
+            values=-self.values,
+            observation_dependent=self.observation_dependent)
+
+    def expected(self, T, O):
+        """Expected immediate rewards for each action and state.
+
+        :param T: transition probabilities (dense or SparseArray)
+        :param O: observation probabilities (dense or SparseArray)
+        :return: array of shape (n_actions, n_states)
+        """
+        a, s, new_s, o = self.override_index()
+        p = T[a, s, new_s]
+        if self.observation_dependent:
+            p = p * O[a, new_s, o]
+        r = self.base.copy()
+        np.add.at(r, (a, s), p * (self.values - self.base[a, s]))
+        return r
+
+    def to_dict(self, as_lists=True):
+        """:param as_lists: False to keep numpy arrays (see binary), which
+            are then stored in their internal form
+        """
+        if not as_lists:
+            return {'base': self.base,
+                    'n_observations': self.shape[-1],
+                    'keys': self._keys,
+                    'values': self.values,
+                    'observation_dependent': self.observation_dependent,
+                    }
+        return {'base': _export(self.base, as_lists),
+                'n_observations': self.shape[-1],
+                'index': [_export(i, as_lists)
+                          for i in self.override_index()],
+                'values': _export(self.values, as_lists),
+                'observation_dependent': self.observation_dependent,
+                }
+
+    @classmethod
+    def from_dict(cls, d):
+        if 'keys' in d:
+            return cls._from_canonical(d['base'], d['n_observations'],
+                                       d['keys'], d['values'],
+                                       d['observation_dependent'])
+        return cls(d['base'], d['n_observations'],
+                   index=tuple(np.asarray(i, dtype=np.int64)
+                               for i in d['index']),
+                   values=np.asarray(d['values']),
+                   observation_dependent=d['observation_dependent'])
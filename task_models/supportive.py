@@ -3,7 +3,7 @@ from itertools import chain
 from .task import (AbstractAction, SequentialCombination,
                    AlternativeCombination, LeafCombination,
                    ParallelCombination)
-from .lib.pomcp import Horizon
+from .lib.pomcp import Horizon, BatchHorizon
 
 
 def unique(l):
@@ -213,6 +213,22 @@ class _SupportivePOMDPState(object):
 
         return [sum_all_but(pp, i) for i, _ in enumerate(pp.shape)]
 
+    def sparse_belief_quotient(self, states, probabilities):
+        """Same as belief_quotient for a belief given as arrays of states
+        and probabilities.
+        """
+        return np.bincount(np.asarray(states) >> self._shift_htm,
+                           weights=probabilities, minlength=self.n_htm)
+
+    def sparse_belief_preferences(self, states, probabilities):
+        """Same as belief_preferences for a belief given as arrays of states
+        and probabilities.
+        """
+        states = np.asarray(states)
+        return [probabilities[(states >> (self._shift_pref + i)) & 1 == 1
+                              ].sum()
+                for i in range(self.n_preferences)]
+
     def random_object_changes(self, p):
         to_change = np.random.random((self.n_objects)) < p
         for i in to_change.nonzero()[0]:
@@ -508,6 +524,207 @@ class SupportivePOMDP:
             r = -self.cost_intrinsic  # Intrinsic action cost
         return _new_s.to_int(), obs, r
 
+    def _batch_tables(self):
+        """Padded arrays describing the HTM and the object actions, used by
+        sample_transition_batch (computed once).
+        """
+        if getattr(self, '_tables', None) is None:
+            n_nodes = len(self.htm_nodes)
+            succs = np.zeros((n_nodes, max(len(l) for l in self.htm_succs)),
+                             dtype=int)
+            n_succs = np.array([len(l) for l in self.htm_succs])
+            for i, l in enumerate(self.htm_succs):
+                succs[i, :len(l)] = l
+            n_cond = max([len(c) for c in self.htm_conditions] + [0])
+            cond = np.full((n_nodes, n_cond), -1, dtype=int)
+            cond_obj = np.zeros((n_nodes, n_cond), dtype=int)
+            for i, l in enumerate(self.htm_conditions):
+                for j, (c, o) in enumerate(l):
+                    cond[i, j] = c
+                    cond_obj[i, j] = o
+            # 1 for 'h', 2 for 'v', 0 for no hold (padded for clean/final)
+            holds = np.zeros((self.n_htm_states,), dtype=int)
+            for i, n in enumerate(self.htm_nodes):
+                holds[i] = {'h': self.A_HOLD_H,
+                            'v': self.A_HOLD_V}.get(n.action.hold, 0)
+            a_obj = np.full((self.n_actions,), -1, dtype=int)
+            a_bring = np.zeros((self.n_actions,), dtype=bool)
+            for o, (a_b, a_c) in enumerate(zip(self._a_bring, self._a_clear)):
+                a_obj[a_b] = o
+                a_bring[a_b] = True
+                if a_c is not None:
+                    a_obj[a_c] = o
+            distinct = all(len(set(o for _, o in l)) == len(l)
+                           for l in self.htm_conditions)
+            self._tables = (succs, n_succs, cond, cond_obj, holds, a_obj,
+                            a_bring, distinct)
+        return self._tables
+
+    def sample_transition_batch(self, actions, states, random=True):
+        """Vectorized version of sample_transition.
+
+        :param actions: integer array of actions
+        :param states: integer array of states (same shape as actions)
+        :return: arrays of new states, observations, and rewards
+        """
+        holds, a_obj, a_bring = self._batch_tables()[4:7]
+        a = np.asarray(actions, dtype=int)
+        s = np.array(states, dtype=np.int64)
+        k = s.shape[0]
+        self.n_simulator_calls += k
+        _s = self._int_to_state()
+        shift_htm = _s._shift_htm
+        if random:
+            # random transitions on objects and preferences
+            p = np.zeros((_s._shift_htm,))
+            p[:_s.n_objects] = self.p_changed_by_human
+            p[_s._shift_pref:] = self.p_change_preference
+            s ^= (np.random.random((k, len(p))) < p).dot(
+                np.left_shift(1, np.arange(len(p), dtype=np.int64)))
+        new_s = s.copy()
+        obs = np.full((k,), self.O_NONE, dtype=int)
+        r = np.zeros((k,))
+        has_pref = (s >> (_s._shift_pref + self.PREF_HOLD)) & 1 == 1
+
+        # Actions that trigger a HTM state transition
+        i = np.flatnonzero(a <= self.A_HOLD_V)
+        if len(i) > 0:
+            r[i] = np.where(a[i] == self.A_WAIT, 0., -self.cost_hold)
+            htm = s[i] >> shift_htm
+            costs = np.array([self._cost_get(o)
+                              for o in range(_s.n_objects)])
+            # Cleaning state: only WAIT finishes the task
+            clean = htm == self.htm_clean
+            if clean.any():
+                j = i[clean & (a[i] == self.A_WAIT)]
+                has_obj = (s[j, None] >> np.arange(_s.n_objects)) & 1
+                r[j] += self.r_final - has_obj.dot(costs)
+                new_s[j] += (self.htm_final - self.htm_clean) << shift_htm
+                obs[i[clean & (a[i] != self.A_WAIT)]] = self.O_FAIL
+            # Transitions within the given HTM
+            within = htm < self.htm_clean
+            hold = a[i] != self.A_WAIT
+            # Successful supportive action for preference
+            pref_hold = within & hold & has_pref[i] & (holds[htm] == a[i])
+            r[i[pref_hold]] += self.r_preference
+            # Undesired HOLD: most likely gets an error
+            failed = within & hold & ~pref_hold
+            if random:
+                failed &= np.random.random(len(i)) < .98
+            obs[i[failed]] = self.O_FAIL
+            moves = within & ~failed
+            if moves.any():
+                self._update_for_transition_batch(
+                    new_s, r, i[moves], htm[moves], costs)
+                if self.reward_independent_preference:
+                    r[i[moves & ~has_pref[i]]] += (self.r_preference -
+                                                   self.cost_hold)
+
+        # Ask action
+        i = np.flatnonzero(a == self.A_ASK)
+        if len(i) > 0:
+            r[i] = -self.cost_intrinsic
+            answers = np.where(has_pref[i], self.O_YES, self.O_NO)
+            if random:
+                answers[np.random.random(len(i)) >=
+                        np.where(has_pref[i], .9, .95)] = self.O_NONE
+            obs[i] = answers
+
+        # Clear and bring actions
+        i = np.flatnonzero(a > self.A_ASK)
+        if len(i) > 0:
+            r[i] = -self.cost_intrinsic  # Intrinsic action cost
+            obj = a_obj[a[i]]
+            is_bring = a_bring[a[i]]
+            not_found = ((s[i] >> obj) & 1 == 1) == is_bring
+            obs[i[not_found]] = self.O_NOT_FOUND
+            done = ~not_found
+            if random:
+                fails = done & (np.random.random(len(i)) < self.p_fail)
+                obs[i[fails]] = self.O_FAIL
+                done &= ~fails
+            # Object state is flipped (it was not as requested)
+            new_s[i[done]] ^= np.left_shift(1, obj[done]).astype(np.int64)
+        return new_s, obs, r
+
+    def _update_for_transition_batch(self, new_s, r, lanes, nodes, costs):
+        """Vectorized _update_for_transition, in place on new_s and r.
+
+        :param costs: array of costs for getting each object
+        """
+        succs, n_succs, cond, cond_obj = self._batch_tables()[:4]
+        if not self._batch_tables()[7]:
+            # Conditions need to be applied one after the other
+            for l, node in zip(lanes, nodes):
+                _s = self._int_to_state(int(new_s[l]))
+                r[l] += self._update_for_transition(_s, node) + self.r_subtask
+                new_s[l] = _s.to_int()
+            return
+        n = len(lanes)
+        s = new_s[lanes]
+        i_succ = (np.random.random(n) * n_succs[nodes]).astype(int)
+        s += (succs[nodes, i_succ] - nodes) << self._int_to_state()._shift_htm
+        # Conditions of a node are on distinct objects so they can be
+        # applied simultaneously.
+        c = cond[nodes]
+        o = cond_obj[nodes]
+        has_c = c >= 0
+        missing = has_c & ((s[:, None] >> o) & 1 == 0)
+        r[lanes] += self.r_subtask - (missing * costs[o]).sum(axis=1)
+        set_to = c == USES
+        some = c == CONSUMES_SOME
+        if some.any():
+            set_to[some] = np.random.random(some.sum()) >= self.p_consume_all
+        bits = np.left_shift(1, o).astype(np.int64)
+        new_s[lanes] = ((s & ~np.bitwise_or.reduce(has_c * bits, axis=1)) |
+                        np.bitwise_or.reduce(set_to * bits, axis=1))
+
+    def observation_probability(self, a, s, new_s, o):
+        """Probabilities of observing o on the transitions from states s to
+        new_s (arrays) with action a (see sample_transition).
+
+        Observations are mostly determined by the transition. For clear and
+        bring actions the object may also have been changed by the human
+        before the action, so that the object being as requested after the
+        action is explained both by not finding it and by a successful
+        action.
+        """
+        s = np.asarray(s)
+        new_s = np.asarray(new_s)
+        _s = self._int_to_state()
+        if a in (self.A_WAIT, self.A_HOLD_H, self.A_HOLD_V):
+            if a == self.A_WAIT:
+                p_fail = np.zeros(s.shape)
+            else:
+                # Hold fails iff the HTM state does not change (except final)
+                htm = s >> _s._shift_htm
+                p_fail = ((htm != self.htm_final) &
+                          (htm == new_s >> _s._shift_htm)).astype(float)
+            p = {self.O_FAIL: p_fail, self.O_NONE: 1. - p_fail}
+        elif a == self.A_ASK:
+            pref = (new_s >> (_s._shift_pref + self.PREF_HOLD)) & 1 == 1
+            p = {self.O_YES: np.where(pref, .9, 0.),
+                 self.O_NO: np.where(pref, 0., .95),
+                 self.O_NONE: np.where(pref, .1, .05)}
+        else:
+            obj = self._obj_from_action(a)
+            is_bring = int(self._is_bring(a))
+            before = (s >> obj) & 1 == is_bring  # Already as requested
+            after = (new_s >> obj) & 1 == is_bring
+            # Posterior on the object being as requested when the action
+            # starts (random changes happen first), given it is after
+            p_changed = np.broadcast_to(self.p_changed_by_human,
+                                        (_s.n_objects,))[obj]
+            w_not_found = np.where(before, 1. - p_changed, p_changed)
+            w_done = (1. - w_not_found) * (1. - self.p_fail)
+            total = w_not_found + w_done
+            p_not_found = np.divide(w_not_found, total,
+                                    out=np.ones(total.shape), where=total > 0)
+            p = {self.O_NOT_FOUND: np.where(after, p_not_found, 0.),
+                 self.O_FAIL: (~after).astype(float),
+                 self.O_NONE: np.where(after, 1. - p_not_found, 0.)}
+        return p.get(o, np.zeros(s.shape))
+
     def sample_start(self):
         """Samples a starting state."""
         htm_id = np.random.choice(self.htm_init)
@@ -543,6 +760,22 @@ class NHTMHorizon(Horizon):
     def copy(self):
         return NHTMHorizon(self.model, self.n)
 
+    def batch(self, n):
+        return NHTMBatchHorizon(self.model, np.full((n,), self.n))
+
     @classmethod
     def generator(cls, model, n=3):
         return cls._Generator(cls, model, n)
+
+
+class NHTMBatchHorizon(BatchHorizon):
+
+    def __init__(self, model, n):
+        super(NHTMBatchHorizon, self).__init__(n)
+        self.model = model
+
+    def decrement(self, lanes, a, s, new_s, o):
+        shift = self.model._int_to_state()._shift_htm
+        new_htm = new_s >> shift
+        self.n[lanes] -= (s >> shift) != new_htm
+        self.n[lanes[new_htm == self.model.htm_final]] = 0
@@ -1,6 +1,7 @@
 import numpy as np
 
 from .lib.pomdp import POMDP
+from .lib.sparse import SparseArray, CompressedReward, _row_modes
 from .task import (AbstractAction, SequentialCombination,
                    AlternativeCombination, LeafCombination,
                    ParallelCombination)
@@ -14,6 +15,77 @@ def uniform(n):
     return np.ones((n)) * 1. / n
 
 
+def _set_rows(X, s_start, block):
+    """Sets rows X[:, s_start:(s_start + n)] from block (of shape
+    (n_actions, n, ...)) on a dense array or a _RowBuilder.
+    """
+    if isinstance(X, np.ndarray):
+        X[:, s_start:(s_start + block.shape[1])] = block
+    else:
+        X.set_rows(s_start, block)
+
+
+class _RowBuilder(object):
+    """Collects blocks of rows of an array of shape
+    (n_actions, n_states, ...), compressing them as they are set, so that
+    the full dense array is never allocated.
+    """
+
+    def __init__(self, shape):
+        self.shape = tuple(shape)
+        self._blocks = []
+
+    def set_rows(self, s_start, block):
+        self._blocks.append((s_start, self._compress(block)))
+
+
+class _SparseTransitions(_RowBuilder):
+    """Builds the transition array as a SparseArray."""
+
+    def _compress(self, block):
+        index = np.nonzero(block)
+        return index, block[index]
+
+    def to_array(self):
+        index = [[], [], []]
+        values = []
+        for s_start, ((a, s, new_s), v) in self._blocks:
+            for i, x in zip(index, (a, s + s_start, new_s)):
+                i.append(x)
+            values.append(v)
+        return SparseArray(self.shape, tuple(np.concatenate(i) for i in index),
+                           np.concatenate(values))
+
+
+class _CompressedRewards(_RowBuilder):
+    """Builds observation independent rewards as a CompressedReward (shape
+    must be (n_actions, n_states, n_states, 1)).
+    """
+
+    def _compress(self, block):
+        # Same as CompressedReward.from_dense on the block of rows
+        n_a, n_s = block.shape[:2]
+        flat = block.reshape((n_a * n_s, -1))
+        base = _row_modes(flat)
+        a_s, new_s = np.nonzero(flat != base[:, None])
+        return (base.reshape((n_a, n_s)), np.unravel_index(a_s, (n_a, n_s)),
+                new_s, flat[a_s, new_s])
+
+    def to_array(self, n_observations):
+        base = np.zeros(self.shape[:2])
+        index = [[], [], []]
+        values = []
+        for s_start, (b, (a, s), new_s, v) in self._blocks:
+            base[:, s_start:(s_start + b.shape[1])] = b
+            for i, x in zip(index, (a, s + s_start, new_s)):
+                i.append(x)
+            values.append(v)
+        return CompressedReward(
+            base, n_observations,
+            index=tuple(np.concatenate(i) for i in index),
+            values=np.concatenate(values))
+
+
 class CollaborativeAction(AbstractAction):
     """Collaborative action that can be achieved either by robot or human.
 
@@ -190,28 +262,32 @@ class _LeafToPOMDP(_NodeToPOMDP):
         s_i = s_start + self._init
         s_h = s_start + self._h
         s_r = s_start + self._r
+        # Only own rows are filled (next states are global indices)
+        B = np.zeros((T.shape[0], 3) + tuple(T.shape[2:]))
+        i, h, r = self._init, self._h, self._r
         # Note: if error the model assumes that human waits that robot is done
         # recovering or communicating before moving to next action.
-        T[:, s_i, s_i] = 1.
-        T[a_ai, s_i, s_i] = .0
-        T[a_ai, s_i, s_r] = self._proba_no
-        T[a_ai, s_i, s_h] = 1 - self._proba_no
-        T[a_ti, s_i, s_i] = 0.
-        T[a_ti, s_i, s_r] = 1.
+        B[:, i, s_i] = 1.
+        B[a_ai, i, s_i] = .0
+        B[a_ai, i, s_r] = self._proba_no
+        B[a_ai, i, s_h] = 1 - self._proba_no
+        B[a_ti, i, s_i] = 0.
+        B[a_ti, i, s_r] = 1.
         if 'deterministic' in self.flags:
-            T[:, s_h, s_h] = 1.
-            T[a_af, s_h, s_h] = 0.
-            T[a_af, s_h, s_next] = uniform(len(s_next))
+            B[:, h, s_h] = 1.
+            B[a_af, h, s_h] = 0.
+            B[a_af, h, s_next] = uniform(len(s_next))
         else:
             p_h_not_finish = self._h_probas_not_finished_from_d(
                     np.asarray(durations))
-            T[:, s_h, s_h] = p_h_not_finish
-            T[:, s_h, :][:, s_next] = \
+            B[:, h, s_h] = p_h_not_finish
+            B[:, h, :][:, s_next] = \
                 np.outer(1 - p_h_not_finish, s_next_probas)
-        T[:, s_r, s_r] = 1.
-        T[a_phy, s_r, s_r] = self._proba_fail
-        T[a_phy, s_r, s_next] = [(1 - self._proba_fail) * x
-                                 for x in s_next_probas]
+        B[:, r, s_r] = 1.
+        B[a_phy, r, s_r] = self._proba_fail
+        B[a_phy, r, s_next] = [(1 - self._proba_fail) * x
+                               for x in s_next_probas]
+        _set_rows(T, s_start, B)
 
     def update_O(self, O, a_start, s_start, s_next, s_before, s_after):
         a_phy = a_start + self._phy
@@ -252,31 +328,29 @@ class _LeafToPOMDP(_NodeToPOMDP):
 
     def update_R(self, R, a_wait, a_start, s_start, durations, intr_cost):
         a_phy = a_start + self._phy
-        a_ai = a_start + self._ask_intention
         a_ti = a_start + self._tell_intention
-        a_af = a_start + self._ask_finished
-        s_i = s_start + self._init
         s_h = s_start + self._h
         s_r = s_start + self._r
         # Note: every node is responsible for filling
         # R[:, [one own's states], :, :]
-        # R is initialized with zeros.
-        R[:, s_start:s_start+3, :, :] = np.asarray(durations)[
-            :, np.newaxis, np.newaxis, np.newaxis]
+        # Only these rows are built (next states are global indices)
+        B = np.empty((R.shape[0], 3) + tuple(R.shape[2:]))
+        i, r = self._init, self._r
+        B[...] = np.asarray(durations)[:, np.newaxis, np.newaxis, np.newaxis]
         # Adds intrinsic cost to all but action wait
-        R[:a_wait, s_start:s_start+3, :, :] += intr_cost
-        R[(a_wait + 1):, s_start:s_start+3, :, :] += intr_cost
+        B[:a_wait] += intr_cost
+        B[(a_wait + 1):] += intr_cost
         # Fix the duration cost for the non-failed physical action
-        R[a_phy, s_r, :, :] = self.t_rob + intr_cost
+        B[a_phy, r] = self.t_rob + intr_cost
         if 'structured' in self.flags:
-            R[a_ti, :, :, :] = 100
-            R[a_ti, s_i, s_h, :] = self.t_com + intr_cost
-            R[a_ti, s_i, s_r, :] = self.t_com + intr_cost
+            B[a_ti] = 100
+            B[a_ti, i, s_h] = self.t_com + intr_cost
+            B[a_ti, i, s_r] = self.t_com + intr_cost
         if 'subtask_reward' in self.flags:
             # Value transitions to any other node
-            R[:, s_start:(s_start + 3), :s_start, :] -= self.subtask_reward
-            R[:, s_start:(s_start + 3),
-              (s_start + 3):, :] -= self.subtask_reward
+            B[:, :, :s_start] -= self.subtask_reward
+            B[:, :, (s_start + 3):] -= self.subtask_reward
+        _set_rows(R, s_start, B)
 
 
 def _start_indices_from(l):
@@ -410,24 +484,33 @@ class HTMToPOMDP:
             self.flags.add('subtask_reward')
 
     def update_T_end(self, T, init):
+        n_a, n_s = T.shape[:2]
+        end = np.zeros((n_a, 1, n_s))
         if 'loop' in self.flags:
-            T[:, self.end, init] = 1.  # go back to start
+            end[:, 0, init] = 1.  # go back to start
         else:
             if 'reward_state' in self.flags:
-                T[:, self.endr, self.end] = 1.  # go to end after reward
-            T[:, self.end, self.end] = 1.  # end stats is stable
+                endr = np.zeros((n_a, 1, n_s))
+                endr[:, 0, self.end] = 1.  # go to end after reward
+                _set_rows(T, n_s + self.endr, endr)
+            end[:, 0, self.end] = 1.  # end stats is stable
+        _set_rows(T, n_s + self.end, end)
 
     def update_O_wait(self, O):
         O[self.wait, :, :] = _NodeToPOMDP.o_none
 
     def update_R_end(self, R):
-        R[:, self.end, ...] = self.c_intr  # end state has cost 1
+        n_s = R.shape[1]
+        shape = (R.shape[0], 1) + tuple(R.shape[2:])
+        end = np.full(shape, float(self.c_intr))  # end state has cost 1
         if 'reward_state' in self.flags:
-            R[:, self.endr, ...] = self.c_intr  # only wait gives reward
-            R[self.wait, self.endr, ...] = -self.end_reward  # get reward
-            R[self.wait, self.end, ...] = 0   # except on wait
+            endr = np.full(shape, float(self.c_intr))  # only wait gives reward
+            endr[self.wait] = -self.end_reward  # get reward
+            end[self.wait] = 0   # except on wait
+            _set_rows(R, n_s + self.endr, endr)
         else:
-            R[self.wait, self.end, ...] = -self.end_reward   # except on wait
+            end[self.wait] = -self.end_reward   # except on wait
+        _set_rows(R, n_s + self.end, end)
 
     def task_to_pomdp(self, task):
         n2p = _NodeToPOMDP.from_node(task.root, self.t_ask, self.t_tell,
@@ -448,7 +531,8 @@ class HTMToPOMDP:
         else:
             end = n_s - 1
         durations = [self.t_wait] + n2p.durations
-        T = np.zeros((n_a, n_s, n_s))
+        # T and R are built by blocks of rows, in compact form
+        T = _SparseTransitions((n_a, n_s, n_s))
         n2p.update_T(T, self.wait, 1, 0, [end], [1.], durations)
         self.update_T_end(T, n2p.init)
         O = np.zeros((n_a, n_s, n_o))
@@ -466,9 +550,12 @@ class HTMToPOMDP:
             O[:, end, :] = [0, 0, 0, 0, 1]  # Always observe done
             # at the end even if other question asked
             n2p.observations = n2p.observations + ['done']
-        R = np.zeros((n_a, n_s, n_s, n_o))
+        # Rewards do not depend on observations: fill a single one (most
+        # transitions have the cost of their action and state)
+        R = _CompressedRewards((n_a, n_s, n_s, 1))
         n2p.update_R(R, self.wait, 1, 0, durations, self.c_intr)
         self.update_R_end(R)
-        return POMDP(T, O, R, start, discount=1., states=states,
+        return POMDP(T.to_array(), O, R.to_array(n_o), start, discount=1.,
+                     states=states,
                      actions=actions, observations=n2p.observations,
                      values='cost')
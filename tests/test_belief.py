@@ -3,8 +3,9 @@ from unittest import TestCase
 
 import numpy as np
 
-from task_models.lib.belief import (ArrayBelief, ParticleBelief,
-                                    MaxSamplesReached)
+from task_models.lib.belief import (ArrayBelief, SparseArrayBelief,
+                                    ParticleBelief, WeightedParticleBelief,
+                                    MaxSamplesReached, SuccessorCache)
 
 
 class BeliefBaseTest(object):
@@ -51,6 +52,92 @@ class TestArrayBelief(BeliefBaseTest, TestCase):
         np.testing.assert_array_equal(succ.array, p_succ)
 
 
+    def test_hash_and_eq(self):
+        other = ArrayBelief(self.p.copy())
+        self.assertEqual(hash(other), hash(self.belief))
+        self.assertEqual(other, self.belief)
+        self.assertNotEqual(ArrayBelief([0., 1., 0.]), self.belief)
+
+    def test_successor_cache(self):
+        cache = SuccessorCache()
+        belief = ArrayBelief(self.p, successor_cache=cache)
+        model = self.FakeModel(np.array([0., 0.1, 0.9]),
+                               np.array([.6, .4, 0.]))
+        succ = belief.successor(model, 2, 1)
+        self.assertIs(succ.successor_cache, cache)
+        self.assertIs(ArrayBelief(self.p.copy(), successor_cache=cache
+                                  ).successor(model, 2, 1), succ)
+        self.assertIsNot(belief.successor(model, 1, 1), succ)
+        self.assertEqual((cache.hits, cache.misses, len(cache)), (1, 2, 2))
+
+
+class TestSuccessorCache(TestCase):
+
+    def test_drops_least_recently_used(self):
+        cache = SuccessorCache(max_size=2)
+        cache.get('a', lambda: 1)
+        cache.get('b', lambda: 2)
+        self.assertEqual(cache.get('a', lambda: 3), 1)  # Now most recent
+        cache.get('c', lambda: 4)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('a', lambda: 5), 1)
+        self.assertEqual(cache.get('b', lambda: 6), 6)
+        self.assertEqual((cache.hits, cache.misses), (2, 4))
+
+    def test_nbytes_and_retain(self):
+        cache = SuccessorCache(max_size=2)
+        cache.put('a', np.zeros(3))
+        cache.put('b', np.zeros(5))
+        cache.put('c', 1)  # no nbytes
+        self.assertEqual(cache.nbytes, 40)
+        cache.retain(lambda k: k != 'b')
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.nbytes, 0)
+        cache.put('a', np.zeros(3))
+        cache.discard('a')
+        cache.discard('a')
+        self.assertEqual((len(cache), cache.nbytes), (1, 0))
+
+
+class TestSparseArrayBelief(BeliefBaseTest, TestCase):
+
+    class FakeModel:
+
+        def sparse_belief_update(self, a, o, states, probabilities):
+            return states + a, probabilities[::-1]
+
+    def setUp(self):
+        super(TestSparseArrayBelief, self).setUp()
+        self.belief = SparseArrayBelief.from_array(self.p)
+
+    def test_from_array(self):
+        np.testing.assert_array_equal(self.belief.states, [0, 2])
+        np.testing.assert_array_equal(self.belief.probabilities, [.7, .3])
+        np.testing.assert_array_equal(self.belief.array, self.p)
+
+    def test_successor(self):
+        b = SparseArrayBelief([0, 1], [.2, .8], 4)
+        succ = b.successor(self.FakeModel(), 2, 0)
+        self.assertIsInstance(succ, SparseArrayBelief)
+        np.testing.assert_array_equal(succ.array, [0., 0., .8, .2])
+
+    def test_successor_cache(self):
+        cache = SuccessorCache()
+        belief = SparseArrayBelief.from_array(self.p, successor_cache=cache)
+        succ = belief.successor(self.FakeModel(), 1, 0)
+        self.assertIs(succ.successor_cache, cache)
+        self.assertIs(SparseArrayBelief.from_array(
+            self.p.copy(), successor_cache=cache).successor(
+                self.FakeModel(), 1, 0), succ)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_hash_and_eq(self):
+        other = SparseArrayBelief.from_array(self.p.copy())
+        self.assertEqual(hash(other), hash(self.belief))
+        self.assertEqual(other, self.belief)
+        self.assertNotEqual(SparseArrayBelief([1], [1.], 3), self.belief)
+
+
 class TestParticleBelief(BeliefBaseTest, TestCase):
 
     def setUp(self):
@@ -88,4 +175,75 @@ class TestParticleBelief(BeliefBaseTest, TestCase):
 
         p = ParticleBelief(sampler_once, 10, 99)
         self.assertEqual(len(p.part_states), 99)
-        self.assertEqual(p.part_states, [3] * 99)
+        self.assertEqual(p.part_states.tolist(), [3] * 99)
+
+    def test_array(self):
+        self.belief.part_states = np.array([0, 2, 2, 0, 0, 0, 2, 0, 2, 0])
+        np.testing.assert_allclose(self.belief.array, [.6, 0., .4])
+        self.assertIs(self.belief.array, self.belief.array)
+
+    def test_sparse_histogram(self):
+        self.belief.part_states = np.array([0, 2, 2, 0, 0, 0, 2, 0, 2, 0])
+        states, p = self.belief.sparse_histogram()
+        np.testing.assert_array_equal(states, [0, 2])
+        np.testing.assert_allclose(p, [.6, .4])
+
+    def test_sample_batch(self):
+        samples = self.belief.sample_batch(20)
+        self.assertEqual(samples.shape, (20,))
+        self.assertTrue(np.isin(samples, self.belief.part_states).all())
+
+
+class TestWeightedParticleBelief(BeliefBaseTest, TestCase):
+
+    class FakeModel:
+
+        n_states = 3
+
+        def sample_transition(self, a, s):
+            return (s + a) % self.n_states, None, 0.
+
+        def observation_probability(self, a, s, new_s, o):
+            # Observes whether new state is 0
+            return np.where((new_s == 0) == o, .9, .1)
+
+    def setUp(self):
+        super(TestWeightedParticleBelief, self).setUp()
+
+        def sampler():
+            return int(np.random.choice(3, p=self.p))
+
+        self.belief = WeightedParticleBelief(sampler, 3, 10)
+        self.model = self.FakeModel()
+
+    def test_successor(self):
+        self.belief.resample_threshold = 0.
+        succ = self.belief.successor(self.model, 1, True)
+        self.assertIsInstance(succ, WeightedParticleBelief)
+        np.testing.assert_array_equal(succ.states,
+                                      (self.belief.states + 1) % 3)
+        self.assertAlmostEqual(succ.weights.sum(), 1.)
+        self.assertNotIn(2, succ.states)
+
+    def test_successor_weights(self):
+        self.belief.resample_threshold = 0.
+        self.belief.states = np.array([0, 2] * 5)
+        succ = self.belief.successor(self.model, 1, True)
+        np.testing.assert_allclose(succ.weights[:2], [.02, .18])
+        np.testing.assert_allclose(succ.array, [.9, .1, 0.])
+        states, p = succ.sparse_histogram()
+        np.testing.assert_array_equal(states, [0, 1])
+        np.testing.assert_allclose(p, [.9, .1])
+
+    def test_resamples_on_low_effective_sample_size(self):
+        self.belief.states = np.array([0] * 9 + [2])
+        # Weights are .05 for each of the 1 states, and .5 for the 0 state
+        succ = self.belief.successor(self.model, 1, True)
+        np.testing.assert_allclose(succ.weights, .1)
+        self.assertEqual((succ.states == 0).sum(), 5)
+        self.assertEqual((succ.states == 1).sum(), 5)
+
+    def test_raises_MaxSamplesReached(self):
+        self.model.observation_probability = lambda a, s, new_s, o: 0. * s
+        with self.assertRaises(MaxSamplesReached):
+            self.belief.successor(self.model, 1, True)
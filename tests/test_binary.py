@@ -0,0 +1,65 @@
+import os
+from unittest import TestCase
+
+import numpy as np
+
+from task_models.lib.py23 import TemporaryDirectory
+from task_models.lib.binary import save_arrays, load_arrays, HEADER
+
+
+class TestArrays(TestCase):
+
+    def setUp(self):
+        self.d = {'a': np.random.random((3, 4)),
+                  'nested': {'index': [np.arange(3), np.arange(3)[::-1]],
+                             'name': 'x'},
+                  'x': 1.5,
+                  'names': ['a', 'b'],
+                  }
+
+    def assertSame(self, d):
+        np.testing.assert_array_equal(d['a'], self.d['a'])
+        for i, j in zip(d['nested']['index'], self.d['nested']['index']):
+            np.testing.assert_array_equal(i, j)
+        self.assertEqual(d['nested']['name'], 'x')
+        self.assertEqual(d['x'], 1.5)
+        self.assertEqual(d['names'], ['a', 'b'])
+
+    def test_save_load(self):
+        with TemporaryDirectory() as path:
+            save_arrays(path, self.d)
+            self.assertIn(HEADER, os.listdir(path))
+            self.assertSame(load_arrays(path))
+
+    def test_mmap(self):
+        with TemporaryDirectory() as path:
+            save_arrays(path, self.d)
+            d = load_arrays(path, mmap_mode='r')
+            self.assertIsInstance(d['a'], np.memmap)
+            self.assertSame(d)
+            del d
+
+    def test_overwrite_keeps_mapped_arrays(self):
+        with TemporaryDirectory() as parent:
+            path = os.path.join(parent, 'arrays')
+            save_arrays(path, self.d)
+            d = load_arrays(path, mmap_mode='r')
+            a = self.d['a'].copy()
+            self.d['a'] = np.zeros((3, 4))
+            save_arrays(path, self.d)
+            np.testing.assert_array_equal(d['a'], a)
+            self.assertSame(load_arrays(path))
+            self.assertEqual(os.listdir(parent), ['arrays'])
+            del d
+
+    def test_does_not_replace_other_directory(self):
+        with TemporaryDirectory() as path:
+            open(os.path.join(path, 'other'), 'w').close()
+            with self.assertRaises(ValueError):
+                save_arrays(path, self.d)
+            self.assertEqual(os.listdir(path), ['other'])
+
+    def test_object_array_raises(self):
+        with TemporaryDirectory() as path:
+            with self.assertRaises(TypeError):
+                save_arrays(path, {'a': np.array([1, None])})
@@ -0,0 +1,107 @@
+import os
+import time
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from task_models.lib.cache import fingerprint, FileCache
+
+
+class TestFingerprint(TestCase):
+
+    def test_stable(self):
+        a = np.random.random((3, 4))
+        self.assertEqual(fingerprint(a, [1, 'b'], {'x': None}),
+                         fingerprint(a.copy(), [1, 'b'], {'x': None}))
+
+    def test_differs(self):
+        a = np.zeros((2, 3))
+        b = a.copy()
+        b[1, 2] = 1.e-12
+        self.assertNotEqual(fingerprint(a), fingerprint(b))
+        self.assertNotEqual(fingerprint(a), fingerprint(a.reshape((3, 2))))
+        self.assertNotEqual(fingerprint(a), fingerprint(a.astype(np.float32)))
+        self.assertNotEqual(fingerprint(1), fingerprint(1.))
+        self.assertNotEqual(fingerprint([1, 2]), fingerprint((1, 2)))
+        self.assertNotEqual(fingerprint(['ab', 'c']), fingerprint(['a', 'bc']))
+
+    def test_text_and_integers(self):
+        # Same digests for text and integers as loaded from JSON on Python 2
+        self.assertEqual(fingerprint([u'a', u'\xe9']),
+                         fingerprint([b'a', b'\xc3\xa9']))
+        self.assertEqual(fingerprint(3), fingerprint(np.int64(3).item()))
+        self.assertNotEqual(fingerprint(True), fingerprint(1))
+        self.assertEqual(
+            fingerprint({'states': ['a'], 'n': 2}),
+            '36dd7e0f2cb847c934d031c7d712cc6e'
+            '7d8666d03dabd2bde08d81e05c2757c7')
+
+    def test_dict_order(self):
+        self.assertEqual(fingerprint({'a': 1, 'b': 2}),
+                         fingerprint({'b': 2, 'a': 1}))
+
+    def test_non_contiguous(self):
+        a = np.random.random((4, 4))
+        self.assertEqual(fingerprint(a.T), fingerprint(a.T.copy()))
+
+    def test_unsupported(self):
+        with self.assertRaises(TypeError):
+            fingerprint(object())
+
+
+class TestFileCache(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.directory = os.path.join(self.tmp, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_creates_directory(self):
+        FileCache(self.directory)
+        self.assertTrue(os.path.isdir(self.directory))
+
+    def test_get_put(self):
+        cache = FileCache(self.directory)
+        self.assertIsNone(cache.get('a'))
+        cache.put('a', {'values': np.arange(3), 'x': np.float64(1.5)})
+        self.assertIn('a', cache)
+        self.assertEqual(cache.get('a'), {'values': [0, 1, 2], 'x': 1.5})
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(os.listdir(self.directory), ['a.json'])
+
+    def test_shared(self):
+        FileCache(self.directory).put('a', [1, 2])
+        self.assertEqual(FileCache(self.directory).get('a'), [1, 2])
+
+    def test_evicts_least_recently_used(self):
+        cache = FileCache(self.directory, max_bytes=None)
+        for i, k in enumerate('abc'):
+            cache.put(k, list(range(100)))
+            past = time.time() - 100 + i
+            os.utime(cache._path(k), (past, past))
+        cache.get('a')  # Now most recent
+        cache.max_bytes = 2 * os.path.getsize(cache._path('a'))
+        cache.put('d', list(range(100)))
+        self.assertIn('a', cache)
+        self.assertIn('d', cache)
+        self.assertNotIn('b', cache)
+        self.assertNotIn('c', cache)
+        self.assertLessEqual(cache.nbytes, cache.max_bytes)
+
+    def test_clear(self):
+        cache = FileCache(self.directory)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(len(cache), 2)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def test_corrupted_file_is_a_miss(self):
+        cache = FileCache(self.directory)
+        with open(cache._path('a'), 'w') as f:
+            f.write('{"trunc')
+        self.assertIsNone(cache.get('a'))
@@ -1,12 +1,16 @@
+import time
 from unittest import TestCase, skip
 
 import numpy as np
 
 from task_models.lib.pomdp import POMDP
+from task_models.lib.belief import SuccessorCache
 from task_models.lib.pomcp import (
     _SearchNode, _SearchObservationNode, _SearchActionNode, _SearchTree,
     ArrayBelief, ParticleBelief, POMCPPolicyRunner, NTransitionsHorizon,
-    Horizon, _ValueAverage)
+    Horizon, _ValueAverage, _ArraySearchTree, _NodeTable,
+    RootParallelPOMCPPolicyRunner, AsyncPOMCPPolicyRunner, _NODE_BYTES,
+    _ObservationLookupSearchTree)
 
 
 class TestSearchNode(TestCase):
@@ -134,6 +138,17 @@ class TestSearchObservationNode(TestCase):
         a = self.node.get_best_action()
         self.assertEqual(a, best)
 
+    def test_children_statistics_follow_updates(self):
+        c = self.node.safe_get_child(3)
+        c.update(2.)
+        c.update(4.)
+        stats = self.node._children_stats
+        self.assertEqual(stats.n_simulations[3], 2)
+        self.assertEqual(stats.n_simulations.sum(), 2)
+        self.assertAlmostEqual(stats.total_value[3] / 2, c.value)
+        self.assertIsInstance(c.n_simulations, int)
+        self.assertIsInstance(c.value, float)
+
     def test_str(self):
         self.node.safe_get_child(2).children[1] = _SearchNode()
         self.assertEqual(str(self.node), "[2: [1: []]]")
@@ -265,6 +280,66 @@ class TestSearchTree(TestCase):
         self.assertIsInstance(n, _SearchObservationNode)
         np.testing.assert_array_equal(n.belief.array, b)
 
+    def test_reroot(self):
+        self.model.successors = [self.start] * 3
+        node = self.tree.get_node([0, 5, 1, 6])
+        sibling = self.tree.get_node([0, 4])
+        self.tree.reroot([0, 5, 1, 6])
+        self.assertIs(self.tree.root, node)
+        self.assertIs(self.tree.get_node([0, 5, 1, 6]), node)
+        self.assertIs(self.tree.get_node([0, 5, 1, 6, 2]),
+                      node.safe_get_child(2))
+        with self.assertRaises(ValueError):
+            self.tree.get_node([0, 4])
+        self.assertIsNot(sibling, None)
+
+    def test_reroot_on_other_history_restarts(self):
+        self.model.successors = [self.start]
+        node = self.tree.get_node([0, 5])
+        node.update(1.)
+        self.tree.reroot([0, 5])
+        self.tree.reroot([])
+        self.assertIsNot(self.tree.root, node)
+        self.assertEqual(self.tree.root.n_simulations, 0)
+        np.testing.assert_array_equal(self.tree.root.belief.array, self.start)
+
+    def test_lazy_beliefs(self):
+        tree = _SearchTree(self.model, 3, 1., belief_cache_size=2)
+        b1 = np.zeros((10,))
+        b1[1] = 1.
+        b2 = np.zeros((10,))
+        b2[2] = 1.
+        n1 = tree.get_node([0, 5])
+        n2 = tree.get_node([1, 5])
+        n3 = tree.get_node([1, 5, 0, 5])
+        # Beliefs are computed on first access
+        self.assertIsNone(n1.stored_belief)
+        self.assertEqual(len(tree.belief_cache), 0)
+        self.assertEqual(len(self.model.successors_history), 0)
+        self.assertEqual(tree.nbytes, tree.root.belief.nbytes +
+                         4 * _NODE_BYTES)
+        self.model.successors = [b1]
+        np.testing.assert_array_equal(n1.belief.array, b1)
+        self.assertEqual(self.model.successors_history[-1][:2], (0, 5))
+        self.assertEqual(tree.belief_cache.misses, 1)
+        self.assertEqual(tree.nbytes, tree.root.belief.nbytes + b1.nbytes +
+                         4 * _NODE_BYTES)
+        np.testing.assert_array_equal(n1.belief.array, b1)
+        self.assertEqual(tree.belief_cache.hits, 1)
+        # n3 belief needs n2 belief, n1 belief is dropped from the cache
+        self.model.successors = [b2, b1]
+        np.testing.assert_array_equal(n3.belief.array, b1)
+        self.assertEqual(len(tree.belief_cache), 2)
+        tree.reroot([1, 5])
+        self.assertIs(tree.root, n2)
+        np.testing.assert_array_equal(n2.stored_belief.array, b2)
+        # Cached beliefs of the new subtree are kept
+        self.assertEqual(len(tree.belief_cache), 1)
+        hits = tree.belief_cache.hits
+        np.testing.assert_array_equal(n3.belief.array, b1)
+        self.assertEqual(tree.belief_cache.hits, hits + 1)
+        self.assertEqual(tree.nbytes, 2 * b1.nbytes + 2 * _NODE_BYTES)
+
     def test_rollout_from_node_with_horizon_0_is_0(self):
         h = NTransitionsHorizon(0)
         self.assertEqual(self.tree._one_rollout_from_node(1, h), 0)
@@ -286,6 +361,13 @@ class TestSearchTree(TestCase):
         self.assertEqual(self.model.transitions_history[0][1], 3)
         self.assertEqual(self.model.transitions_history[1][1], 1)
 
+    def test_batch_horizon(self):
+        h = NTransitionsHorizon(2).batch(3)
+        h.decrement(np.array([0, 2]), None, None, None, None)
+        np.testing.assert_array_equal(h.is_reached(), [False, False, False])
+        h.decrement(np.array([0]), None, None, None, None)
+        np.testing.assert_array_equal(h.is_reached(), [True, False, False])
+
     def test_simulate_from_node_with_horizon_0(self):
         self.tree.horizon_gen = NTransitionsHorizon.generator(self.model, n=0)
         self.tree.simulate_from_node(self.tree.root)
@@ -368,6 +450,150 @@ class TestSearchTree(TestCase):
         self.assertEqual(self.tree.root.n_simulations, 1)
 
 
+class TestObservationLookupSearchTree(TestCase):
+
+    def setUp(self):
+        self.start = np.zeros((10,))
+        self.start[-1] = 1.
+        self.model = _FakeModel(self.start, 3, 2)
+        self.b = np.zeros((10,))
+        self.b[1:3] = .5
+        self.close_b = self.b.copy()
+        self.close_b[1:3] += [1.e-12, -1.e-12]
+
+    def test_merges_identical_beliefs(self):
+        tree = _ObservationLookupSearchTree(self.model, 3, 1.)
+        self.model.successors = [self.b, self.b.copy(), self.close_b]
+        n = tree.get_node([0, 1])
+        self.assertIs(tree.get_node([1, 0]), n)
+        self.assertIsNot(tree.get_node([2, 0]), n)
+        self.assertEqual(tree.n_merges, 1)
+        self.assertEqual(tree.n_observation_nodes, 3)
+
+    def test_merges_close_beliefs(self):
+        tree = _ObservationLookupSearchTree(self.model, 3, 1.,
+                                            belief_tolerance=1.e-6)
+        self.model.successors = [self.b, self.close_b, self.start]
+        n = tree.get_node([0, 1])
+        self.assertIs(tree.get_node([2, 0]), n)
+        self.assertIs(tree.get_node([1, 0]), tree.root)
+        self.assertEqual(tree.n_observation_nodes, 2)
+        self.assertEqual(tree.merge_rate, .5)  # Also counts root creation
+
+    def test_reroot(self):
+        tree = _ObservationLookupSearchTree(self.model, 3, 1.,
+                                            belief_tolerance=1.e-6)
+        other_b = np.zeros((10,))
+        other_b[4] = 1.
+        self.model.successors = [self.b, other_b, self.start]
+        n = tree.get_node([0, 1])
+        tree.get_node([0, 1, 1, 0])
+        tree.get_node([1, 0])
+        tree.reroot([0, 1])
+        self.assertIs(tree.root, n)
+        self.assertEqual(tree.n_observation_nodes, 2)
+
+
+class TestArraySearchTree(TestCase):
+
+    def setUp(self):
+        self.start = np.zeros((10,))
+        self.start[-1] = 1.
+        self.model = _FakeModel(self.start, 3, 2)
+        self.tree = _ArraySearchTree(self.model, 3, 1.,
+                                     node_params={'alpha': 0.})
+
+    def test_get_node_creates_child(self):
+        n = self.tree.get_node([0])
+        self.assertIsInstance(n, _SearchActionNode)
+        b = np.zeros((10,))
+        b[1] = 1.
+        self.model.successors.append(b)
+        n = self.tree.get_node([0, 1])
+        self.assertIsInstance(n, _SearchObservationNode)
+        np.testing.assert_array_equal(n.belief.array, b)
+        self.assertEqual(self.tree.get_node([0, 1]), n)
+        self.assertEqual(str(self.tree.root), "[0: [1: []]]")
+
+    def test_simulate_from_node_with_horizon_3(self):
+        self.model.discount = 1.
+        belief = np.zeros((10))
+        belief[1] = 1.
+        self.tree.horizon_gen = NTransitionsHorizon.generator(self.model, n=3)
+        self.model.transitions = [(1, 1, 11.), (2, 0, 13.), (4, 0, 0.)]
+        self.model.successors = [belief]
+        self.tree.simulate_from_node(self.tree.root, action=1)
+        self.assertEqual(str(self.tree.root), "[1: [1: []]]")
+        self.assertEqual(self.tree.root.n_simulations, 1)
+        self.assertEqual(self.tree.root.value, 24.)
+        self.assertEqual(self.tree.get_node([1]).value, 24.)
+        self.assertEqual(self.tree.get_node([1, 1]).value, 13.)
+        self.model.reset()
+        self.model.transitions = [(1, 1, 3.), (2, 0, 1.), (4, 0, 5.)]
+        self.model.successors = [belief]
+        self.tree.simulate_from_node(self.tree.root, action=1)
+        self.assertEqual(self.tree.root.value, 16.5)
+        self.assertEqual(self.tree.get_node([1, 1]).n_simulations, 2)
+
+    def test_to_dict_and_map(self):
+        self.model.actions = ['a', 'b', 'c']
+        self.model.observations = ['x', 'y']
+        self.model.transitions = [(1, 1, 1.)] * 4
+        self.model.successors = [self.start] * 3
+        self.tree.horizon_gen = NTransitionsHorizon.generator(self.model, n=1)
+        for a in range(3):
+            self.tree.simulate_from_node(self.tree.root, action=a)
+        d = self.tree.to_dict()
+        self.assertEqual(d['visits'], 3)
+        self.assertEqual(len(d['children']), 3)
+        self.assertEqual(d['children'][0]['children'][0]['visits'], 0)
+        n_nodes = self.tree.map(lambda n: 1, lambda r, c: r + sum(c))
+        self.assertEqual(n_nodes, 7)
+        self.assertEqual(n_nodes, self.tree.n_nodes)
+
+    def test_get_node_invalid_history_raises_value_error(self):
+        for history in ([3], [0, 7], [-1]):
+            with self.assertRaises(ValueError):
+                self.tree.get_node(history)
+
+    def test_reroot_compacts(self):
+        self.model.transitions = [(1, 1, 1.)] * 6
+        self.model.successors = [self.start] * 6
+        self.tree.horizon_gen = NTransitionsHorizon.generator(self.model, n=2)
+        self.tree.simulate_from_node(self.tree.root, action=0)
+        self.tree.simulate_from_node(self.tree.root, action=1)
+        self.tree.simulate_from_node(self.tree.root, action=1)
+        self.assertEqual(self.tree.n_nodes, 7)
+        value = self.tree.get_node([1, 1]).value
+        self.tree.reroot([1, 1])
+        self.assertEqual(self.tree.n_nodes, 3)
+        self.assertEqual(self.tree.root.value, value)
+        self.assertEqual(self.tree.root.n_simulations, 2)
+        self.assertEqual(self.tree.get_node([1, 1]), self.tree.root)
+        self.assertEqual(str(self.tree.root), "[{}: [1: []]]".format(
+            self.tree.root._children_keys()[0]))
+
+
+class TestNodeTable(TestCase):
+
+    def test_grows(self):
+        table = _NodeTable(3, capacity=2)
+        ids = [table.add() for _ in range(5)]
+        self.assertEqual(ids, list(range(5)))
+        self.assertGreaterEqual(table.capacity, 5)
+        self.assertEqual(table.children.shape[1], 3)
+        self.assertTrue((table.children[:5] == -1).all())
+
+    def test_update_is_average(self):
+        table = _NodeTable(3, alpha=0.)
+        i = table.add()
+        self.assertEqual(table.value(i), 0.)
+        table.update(i, 1)
+        table.update(i, 2)
+        self.assertEqual(table.value(i), 1.5)
+        self.assertEqual(table.n_simulations[i], 2)
+
+
 class TestPOMCPPolicyRunner(TestCase):
 
     def setUp(self):
@@ -388,6 +614,16 @@ class TestPOMCPPolicyRunner(TestCase):
         a = self.policy.get_action()
         self.assertIn(a, self.pomdp.actions)
 
+    def test_batch_rollout(self):
+        tree = self.policy.tree
+        self.pomdp.R[...] = 1.
+        self.pomdp.discount = .5
+        horizon = NTransitionsHorizon(3).batch(4)
+        horizon.n[1] = 1
+        returns = tree._batch_rollout(np.arange(4), horizon)
+        np.testing.assert_allclose(returns, [1.75, 1., 1.75, 1.75])
+        self.assertTrue(horizon.is_reached().all())
+
     def test_step_updates_history(self):
         self.policy.get_action()
         self.policy.history = [0, 1]  # Note: Might fail if '1' unobserved
@@ -408,6 +644,187 @@ class TestPOMCPPolicyRunner(TestCase):
         self.assertIsInstance(h, NTransitionsHorizon)
         self.assertEqual(h.n, 13)
 
+    def test_get_action_reports_simulations(self):
+        self.policy.get_action()
+        self.assertEqual(self.policy.last_n_simulations, 20)
+
+    def test_get_action_with_deadline(self):
+        t = time.time()
+        self.policy.get_action(deadline_ms=50)
+        self.assertLess(time.time() - t, .5)
+        self.assertGreater(self.policy.last_n_simulations, 0)
+        self.policy.get_action(iterations=3, deadline_ms=1000)
+        self.assertLessEqual(self.policy.last_n_simulations, 4)
+
+    def test_deadline_stops_before_iterations(self):
+        t = time.time()
+        self.policy.get_action(iterations=10 ** 8, deadline_ms=50)
+        self.assertLess(time.time() - t, .5)
+        self.assertGreater(self.policy.last_n_simulations, 0)
+        self.assertLess(self.policy.last_n_simulations, 10 ** 8)
+
+    def test_deadline_from_constructor(self):
+        policy = POMCPPolicyRunner(self.pomdp, iterations=20, horizon=5,
+                                   deadline_ms=0)
+        policy.get_action()
+        self.assertEqual(policy.last_n_simulations, 0)
+
+    def test_prune(self):
+        for compact in (False, True):
+            policy = POMCPPolicyRunner(self.pomdp, iterations=20, horizon=5,
+                                       compact=compact, prune=True)
+            policy.get_action()
+            policy.step(True)
+            self.assertEqual(policy.tree.root_history, policy.history)
+            self.assertEqual(policy._node, policy.tree.root)
+            policy.get_action()
+            policy.reset()
+            self.assertEqual(policy.tree.root_history, [])
+            self.assertEqual(policy.tree.root.n_simulations, 0)
+
+    def test_sparse_belief(self):
+        policy = POMCPPolicyRunner(self.pomdp, iterations=20, horizon=5,
+                                   belief='sparse')
+        policy.get_action()
+        policy.step(True)
+        b = self.pomdp.belief_update(policy.history[0], 0, self.pomdp.start)
+        np.testing.assert_allclose(policy._node.belief.array, b)
+
+    def test_weighted_particle_belief(self):
+        policy = POMCPPolicyRunner(self.pomdp, iterations=20, horizon=5,
+                                   belief='weighted',
+                                   belief_params={'n_particles': 30})
+        policy.get_action()
+        policy.step(True)
+        self.assertEqual(len(policy._node.belief.states), 30)
+        self.assertIn(policy.get_action(), self.pomdp.actions)
+
+    def test_belief_cache_size(self):
+        policy = POMCPPolicyRunner(self.pomdp, iterations=20, horizon=5,
+                                   belief_cache_size=3, prune=True)
+        policy.get_action()
+        policy.step(True)
+        self.assertLessEqual(len(policy.tree.belief_cache), 3)
+        b = self.pomdp.belief_update(policy.history[0], 0, self.pomdp.start)
+        np.testing.assert_allclose(policy._node.belief.array, b)
+        with self.assertRaises(ValueError):
+            POMCPPolicyRunner(self.pomdp, compact=True, belief_cache_size=3)
+
+    def test_successor_cache(self):
+        cache = SuccessorCache()
+        policy = POMCPPolicyRunner(self.pomdp, iterations=20, horizon=5,
+                                   belief_params={'successor_cache': cache})
+        for _ in range(2):
+            policy.reset()
+            policy.get_action()
+            policy.step(True)
+        self.assertGreater(cache.hits, 0)
+        self.assertEqual(cache.misses, len(cache))
+
+    def test_max_nodes(self):
+        for compact in (False, True):
+            policy = POMCPPolicyRunner(self.pomdp, iterations=200, horizon=5,
+                                       compact=compact, max_nodes=30)
+            policy.get_action()
+            policy.step(True)
+            node = policy._node
+            policy.get_action()
+            tree = policy.tree
+            self.assertLessEqual(tree.n_observation_nodes, 30)
+            self.assertGreater(tree.n_evicted, 0)
+            self.assertEqual(tree.map(lambda n: isinstance(
+                n, _SearchObservationNode), lambda r, c: r + sum(c)),
+                tree.n_observation_nodes)
+            self.assertEqual(tree.get_node(policy.history), node)
+
+    def test_max_bytes(self):
+        policy = POMCPPolicyRunner(self.pomdp, iterations=200, horizon=5,
+                                   max_bytes=20000)
+        policy.get_action()
+        self.assertLessEqual(policy.tree.nbytes, 20000)
+        self.assertGreater(policy.tree.n_evicted, 0)
+
+    def test_max_bytes_compact_keeps_nodes(self):
+        policy = POMCPPolicyRunner(self.pomdp, iterations=1000, horizon=5,
+                                   compact=True, max_bytes=20000)
+        policy.get_action()
+        tree = policy.tree
+        self.assertGreater(tree.n_evicted, 0)
+        self.assertLessEqual(tree.nbytes, 20000)
+        # Evictions stop once under the budget, even if the capacity of the
+        # tables stays larger
+        self.assertGreater(tree.nbytes, 10000)
+        n_evicted = tree.n_evicted
+        for _ in range(10):
+            tree.simulate_from_node(tree.root)
+        self.assertLess(tree.n_evicted - n_evicted, tree.n_observation_nodes)
+
+    def test_compact_tree(self):
+        policy = POMCPPolicyRunner(self.pomdp, iterations=20, horizon=5,
+                                   compact=True)
+        self.assertIsInstance(policy.tree, _ArraySearchTree)
+        a = policy.get_action()
+        self.assertIn(a, self.pomdp.actions)
+        self.assertEqual(policy.tree.root.n_simulations, 20)
+        policy.step(True)
+        self.assertEqual(len(policy.history), 2)
+        with self.assertRaises(ValueError):
+            POMCPPolicyRunner(self.pomdp, compact=True, belief_values=True)
+
+
+class TestRootParallelPOMCPPolicyRunner(TestPOMCPPolicyRunner):
+
+    def setUp(self):
+        super(TestRootParallelPOMCPPolicyRunner, self).setUp()
+        self.policy = RootParallelPOMCPPolicyRunner(
+            self.pomdp, n_processes=2, iterations=20, horizon=5,
+            rollout_it=10)
+
+    def tearDown(self):
+        self.policy.stop()
+
+    def test_merges_worker_statistics(self):
+        self.policy.get_action()
+        root = self.policy.tree.root
+        self.assertEqual(root.n_simulations, 20)
+        self.assertEqual(sum([c.n_simulations for c in root.children]), 20)
+        self.policy.get_action(iterations=10)
+        self.assertEqual(root.n_simulations, 30)
+
+    def test_stop_terminates_workers(self):
+        workers = self.policy._workers
+        self.policy.stop()
+        self.assertFalse(any([w.is_alive() for w in workers]))
+
+
+class TestAsyncPOMCPPolicyRunner(TestPOMCPPolicyRunner):
+
+    def setUp(self):
+        super(TestAsyncPOMCPPolicyRunner, self).setUp()
+        self.policy = AsyncPOMCPPolicyRunner(self.pomdp, iterations=20,
+                                             horizon=5, rollout_it=10)
+
+    def tearDown(self):
+        self.policy.stop()
+
+    def test_explores_in_background(self):
+        self.policy.get_action()
+
+        def reset_count():
+            self.policy.thread.pop_n_simulations()
+            return self.policy.tree.root.n_simulations
+
+        n = self.policy.execute(reset_count)
+        time.sleep(.1)
+        self.policy.get_action()
+        self.assertGreater(self.policy.last_n_background_simulations, 0)
+        self.assertEqual(self.policy.tree.root.n_simulations,
+                         n + 20 + self.policy.last_n_background_simulations)
+
+    def test_stop_terminates_thread(self):
+        self.policy.stop()
+        self.assertFalse(self.policy.thread.is_alive())
+
 
 class Test_ValueAverage(TestCase):
 
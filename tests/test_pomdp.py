@@ -1,11 +1,24 @@
 import os
+import time
 from unittest import TestCase
 
 import numpy as np
 
+from task_models.lib.py23 import TemporaryDirectory
 from task_models.lib.pomdp import (
-    parse_value_function, parse_policy_graph, POMDP, GraphPolicy,
-    _dump_list, _dump_1d_array, _dump_2d_array, _dump_3d_array, _dump_4d_array)
+    parse_value_function, parse_policy_graph, load_value_function,
+    ValueFunctionParseError, Impossible, POMDP, GraphPolicy,
+    _dump_list, _dump_1d_array, _dump_2d_array, _dump_3d_array, _dump_4d_array,
+    _CumulativeTable, GraphPolicyRunner, GraphPolicyBeliefRunner)
+from task_models.lib.pbvi import (
+    solve_pbvi, collect_beliefs, policy_from_alphas)
+from task_models.lib.sparse import SparseArray, CompressedReward
+from task_models.lib.cache import FileCache
+from task_models.lib.bounds import (
+    mdp_q_values, mdp_values, qmdp_alphas, fib_alphas)
+from task_models.task_to_pomdp import HTMToPOMDP
+from task_models.stool_scenarios import (stool_task_sequential, T_WAIT, T_ASK,
+                                         T_TELL, C_INTR)
 
 
 TEST_VF = os.path.join(os.path.dirname(__file__), 'samples/example.alpha')
@@ -27,6 +40,36 @@ class TestParseValueFunction(TestCase):
             self.assertEqual(actions, correct_actions)
             np.testing.assert_array_equal(np.vstack(vectors), correct_vectors)
 
+    def test_load(self):
+        with open(TEST_VF, 'r') as f:
+            correct_actions, correct_vectors = parse_value_function(f)
+        actions, vectors = load_value_function(TEST_VF)
+        self.assertEqual(actions.tolist(), correct_actions)
+        np.testing.assert_array_equal(vectors, correct_vectors)
+
+    def test_load_mmap(self):
+        with TemporaryDirectory() as d:
+            npy_path = os.path.join(d, 'vf.npy')
+            actions, vectors = load_value_function(TEST_VF)
+            a, v = load_value_function(TEST_VF, npy_path=npy_path)
+            self.assertIsInstance(v, np.memmap)
+            np.testing.assert_array_equal(a, actions)
+            np.testing.assert_array_equal(v, vectors)
+            del v
+            # Input directory is left unchanged
+            self.assertFalse(os.path.exists(TEST_VF + '.npy'))
+
+    def test_incomplete_raises(self):
+        with TemporaryDirectory() as d:
+            path = os.path.join(d, 'vf.alpha')
+            with open(TEST_VF, 'r') as f, open(path, 'w') as g:
+                g.write(f.read() + '\n1\n')
+            with self.assertRaises(ValueFunctionParseError):
+                load_value_function(path)
+            with open(path, 'r') as f:
+                with self.assertRaises(ValueFunctionParseError):
+                    parse_value_function(f)
+
 
 class TestParsePolicyGraph(TestCase):
 
@@ -100,6 +143,47 @@ class TestDumpArrays(TestCase):
                             '34.00000 35.00000 36.00000')
 
 
+class TestCumulativeTable(TestCase):
+
+    def setUp(self):
+        self.p = np.array([[[0., 1., 0.], [.5, 0., .5]],
+                           [[0., 0., 1.], [1., 0., 0.]]])
+        self.table = _CumulativeTable(self.p)
+
+    def test_sample(self):
+        for _ in range(10):
+            self.assertEqual(self.table.sample(0, 0), 1)
+            self.assertEqual(self.table.sample(1, 0), 2)
+            self.assertEqual(self.table.sample(1, 1), 0)
+            self.assertIn(self.table.sample(0, 1), [0, 2])
+
+    def test_sample_batch(self):
+        i = np.array([0, 1, 1, 0, 0])
+        j = np.array([0, 0, 1, 1, 0])
+        samples = self.table.sample_batch(i, j)
+        np.testing.assert_array_equal(samples[[0, 1, 2, 4]], [1, 2, 0, 1])
+        self.assertIn(samples[3], [0, 2])
+
+    def test_sample_batch_frequencies(self):
+        n = 10000
+        samples = self.table.sample_batch(np.zeros(n, dtype=int),
+                                          np.ones(n, dtype=int))
+        self.assertAlmostEqual((samples == 0).mean(), .5, delta=.05)
+        self.assertEqual((samples == 1).sum(), 0)
+
+    def test_rows_must_be_normalized(self):
+        self.p[1, 1] = 0.
+        with self.assertRaises(ValueError):
+            _CumulativeTable(self.p)
+
+    def test_many_rows(self):
+        p = np.zeros((2 ** 20, 3))
+        p[np.arange(p.shape[0]), np.arange(p.shape[0]) % 3] = 1.
+        table = _CumulativeTable(p)
+        r = np.random.randint(p.shape[0], size=10000)
+        np.testing.assert_array_equal(table.sample_batch(r), r % 3)
+
+
 class TestPOMDP(TestCase):
 
     def setUp(self):
@@ -225,6 +309,35 @@ class TestPOMDP(TestCase):
             correct = f.read().rstrip('\n')  # Remove ending newline
         self.assertEqual(s, correct)
 
+    def test_dump_pomdp_sparse_entries(self):
+        T = np.zeros((2, 5, 5))
+        T[:, np.arange(5), np.arange(5)] = 1.
+        T[1, 0] = [0., .3333333, 0., .3333333, .3333334]
+        O = np.ones((2, 5, 2)) / 2.
+        R = np.zeros((2, 5, 5, 2))
+        R[1] = 2.
+        R[0, 1, 3, :] = -1.
+        p = POMDP(T, O, R, np.ones((5,)) / 5., 1.,
+                  actions=['a', 'b'], observations=['o', 'p'])
+        s = p.dump()
+        self.assertIn('\nT: a : 0 : 0 1.00000\n', s)
+        self.assertIn('\nT: b : 0 : 1 0.33334\n', s)  # Sums to 1
+        self.assertIn('\nT: b : 0 : 4 0.33333\n', s)
+        self.assertEqual(s.count('\nT: '), 12)
+        self.assertIn('\nO : a\n', s)  # O is dense
+        self.assertIn('\nR: b : 0 : * : * 2.00000\n', s)
+        self.assertTrue(s.endswith('\nR: a : 1 : 3 : * -1.00000'))
+        self.assertEqual(s.count('\nR: '), 6)
+        dense = p.dump(sparse=False)
+        self.assertNotIn('T: ', dense)
+        self.assertIn('\nR : a : 0\n', dense)
+
+    def test_dump_to(self):
+        p = POMDP(self.T, self.O, self.R, self.start, .8)
+        with TemporaryDirectory() as d:
+            with open(p.dump_to(d, 'test')) as f:
+                self.assertEqual(f.read(), p.dump() + '\n')
+
     def test_solver_runs(self):
         p = POMDP(self.T, self.O, self.R, self.start, .8)
         p.solve(n_iterations=100, timeout=1)
@@ -264,6 +377,67 @@ class TestPOMDP(TestCase):
         c = p.belief_update(a, o, b)
         np.testing.assert_allclose(c, self.T[a, s, :])
 
+    def test_sample_transition_batch_deterministic(self):
+        T = np.zeros((4, 3, 3))
+        T[:, :, 2] = 1.
+        O = np.zeros((4, 3, 2))
+        O[:, :, 1] = 1.
+        p = POMDP(T, O, self.R, self.start, .8)
+        a = np.array([0, 3, 1])
+        s = np.array([1, 0, 2])
+        new_s, o, r = p.sample_transition_batch(a, s)
+        np.testing.assert_array_equal(new_s, [2, 2, 2])
+        np.testing.assert_array_equal(o, [1, 1, 1])
+        np.testing.assert_allclose(r, self.R[a, s, 2, 1])
+
+    def test_sample_transition_batch_only_from_non_zeros(self):
+        p = POMDP(self.T, self.O, self.R, self.start, .8)
+        p.T[:, :, 1] = 0.
+        p.T /= p.T.sum(axis=-1, keepdims=True)
+        new_s, _, _ = p.sample_transition_batch(np.zeros(100, dtype=int),
+                                                np.ones(100, dtype=int))
+        self.assertNotIn(1, new_s)
+
+    def test_randomize_resets_sampling_tables(self):
+        T = np.zeros((4, 3, 3))
+        T[:, :, 2] = 1.
+        p = POMDP(T, self.O, self.R, self.start, .8)
+        self.assertEqual(p.sample_transition(0, 0)[0], 2)
+        p.randomize(p_unexpected=1000.)
+        new_s, _, _ = p.sample_transition_batch(np.zeros(100, dtype=int),
+                                                np.zeros(100, dtype=int))
+        self.assertTrue((new_s != 2).any())
+
+    def test_sparse_belief_update(self):
+        p = POMDP(self.T, self.O, self.R, self.start, .8)
+        b = np.array([.4, 0., .6])
+        states, probabilities = p.sparse_belief_update(
+            2, 1, np.array([0, 2]), np.array([.4, .6]))
+        new_b = np.zeros((3,))
+        new_b[states] = probabilities
+        np.testing.assert_allclose(new_b, p.belief_update(2, 1, b))
+
+    def test_precomputed_belief_update(self):
+        p = POMDP(self.T, self.O, self.R, self.start, .8)
+        b = np.array([.4, 0., .6])
+        new_b = p.belief_update(2, 1, b)
+        sparse_new_b = p.sparse_belief_update(2, 1, np.array([0, 2]),
+                                              np.array([.4, .6]))
+        p.precompute_belief_operators()
+        np.testing.assert_allclose(p.belief_update(2, 1, b), new_b)
+        for x, y in zip(p.sparse_belief_update(2, 1, np.array([0, 2]),
+                                               np.array([.4, .6])),
+                        sparse_new_b):
+            np.testing.assert_allclose(x, y)
+
+    def test_belief_update_many(self):
+        p = POMDP(self.T, self.O, self.R, self.start, .8)
+        B = np.random.dirichlet(np.ones((3,)), 4)
+        expected = np.vstack([p.belief_update(1, 0, b) for b in B])
+        np.testing.assert_allclose(p.belief_update_many(1, 0, B), expected)
+        p.precompute_belief_operators()
+        np.testing.assert_allclose(p.belief_update_many(1, 0, B), expected)
+
     def test_save_load(self):
         p = POMDP(self.T, self.O, self.R, self.start, .8)
         dump = p.as_json()
@@ -277,6 +451,388 @@ class TestPOMDP(TestCase):
         self.assertEqual(p.actions, pp.actions)
         self.assertEqual(p.observations, pp.observations)
 
+    def test_save_load_binary(self):
+        p = POMDP(self.T, self.O, self.R, self.start, .8)
+        with TemporaryDirectory() as d:
+            path = os.path.join(d, 'model')
+            p.save(path)
+            for mmap_mode in (None, 'r'):
+                pp = POMDP.load(path, mmap_mode=mmap_mode)
+                np.testing.assert_array_equal(p.T, pp.T)
+                np.testing.assert_array_equal(p.O, pp.O)
+                np.testing.assert_array_equal(p.R, pp.R)
+                np.testing.assert_array_equal(p.start, pp.start)
+                self.assertEqual(p.discount, pp.discount)
+                self.assertEqual(p.states, pp.states)
+                self.assertEqual(p.actions, pp.actions)
+                self.assertEqual(p.observations, pp.observations)
+            self.assertIsInstance(pp.R.base, np.memmap)  # Not copied
+            del pp
+
+
+class TestSparsePOMDP(TestCase):
+
+    def setUp(self):
+        s, a, o = 5, 3, 2
+        self.T = np.random.dirichlet(np.ones((s,)) * .3, (a, s))
+        self.T[self.T < .1] = 0.
+        self.T /= self.T.sum(-1)[..., None]
+        self.O = np.random.dirichlet(np.ones((o,)), (a, s))
+        self.R = np.random.randint(2, size=(a, s, s, o)).astype(float)
+        self.start = np.random.dirichlet(np.ones((s,)))
+        self.dense = POMDP(self.T, self.O, self.R, self.start, .9)
+        self.sparse = POMDP(SparseArray.from_dense(self.T),
+                            SparseArray.from_dense(self.O),
+                            CompressedReward.from_dense(self.R),
+                            self.start, .9)
+
+    def test_keeps_compact_form(self):
+        self.assertIsInstance(self.sparse.T, SparseArray)
+        self.assertIsInstance(self.sparse.O, SparseArray)
+        self.assertIsInstance(self.sparse.R, CompressedReward)
+
+    def test_cost(self):
+        p = POMDP(SparseArray.from_dense(self.T), self.O,
+                  CompressedReward.from_dense(self.R), self.start, .9,
+                  values='cost')
+        np.testing.assert_array_equal(np.asarray(p.R), -self.R)
+
+    def test_belief_update(self):
+        b = np.random.dirichlet(np.ones((5,)))
+        for a in range(3):
+            for o in range(2):
+                np.testing.assert_allclose(
+                    self.sparse.belief_update(a, o, b),
+                    self.dense.belief_update(a, o, b))
+
+    def test_sparse_belief_update(self):
+        states, p = np.array([1, 3]), np.array([.4, .6])
+        for x, y in zip(self.sparse.sparse_belief_update(2, 1, states, p),
+                        self.dense.sparse_belief_update(2, 1, states, p)):
+            np.testing.assert_allclose(x, y)
+
+    def test_sample_transition(self):
+        for _ in range(100):
+            a, s = np.random.randint(3), np.random.randint(5)
+            new_s, o, r = self.sparse.sample_transition(a, s)
+            self.assertGreater(self.T[a, s, new_s], 0.)
+            self.assertEqual(r, self.R[a, s, new_s, o])
+
+    def test_sample_transition_batch_frequencies(self):
+        n = 10000
+        new_s, o, r = self.sparse.sample_transition_batch(
+            np.full((n,), 1), np.full((n,), 2))
+        np.testing.assert_allclose(np.bincount(new_s, minlength=5) / n,
+                                   self.T[1, 2], atol=.03)
+        np.testing.assert_array_equal(r, self.R[1, 2, new_s, o])
+
+    def test_expected_rewards(self):
+        np.testing.assert_allclose(self.sparse.expected_rewards(),
+                                   self.dense.expected_rewards(), atol=1e-12)
+
+    def test_json(self):
+        p = POMDP.from_json(self.sparse.as_json())
+        self.assertIsInstance(p.T, SparseArray)
+        self.assertIsInstance(p.R, CompressedReward)
+        np.testing.assert_allclose(np.asarray(p.T), self.T)
+        np.testing.assert_allclose(np.asarray(p.R), self.R)
+
+    def test_belief_update_operators(self):
+        B = np.random.dirichlet(np.ones((5,)), 4)
+        B[0, 1:3] = 0.
+        B[0] /= B[0].sum()
+        for a in range(3):
+            for o in range(2):
+                try:
+                    expected = self.dense.belief_update_many(a, o, B)
+                except Impossible:
+                    continue
+                np.testing.assert_allclose(
+                    self.sparse.belief_update_many(a, o, B), expected)
+                self.sparse.precompute_belief_operators()
+                np.testing.assert_allclose(
+                    self.sparse.belief_update_many(a, o, B), expected)
+                np.testing.assert_allclose(
+                    self.sparse.belief_update(a, o, B[0]), expected[0])
+                states, probabilities = self.sparse.sparse_belief_update(
+                    a, o, np.flatnonzero(B[0]), B[0][B[0] > 0])
+                np.testing.assert_allclose(probabilities,
+                                           expected[0][states])
+                self.sparse._belief_operators = None
+
+    def test_save_load_binary(self):
+        with TemporaryDirectory() as d:
+            self.sparse.save(d)
+            p = POMDP.load(d, mmap_mode='r')
+            self.assertIsInstance(p.T, SparseArray)
+            self.assertIsInstance(p.R, CompressedReward)
+            np.testing.assert_array_equal(np.asarray(p.T), self.T)
+            np.testing.assert_array_equal(np.asarray(p.R), self.R)
+            self.assertEqual(p.fingerprint(), self.sparse.fingerprint())
+            # Not copied
+            self.assertIsInstance(p.T.data, np.memmap)
+            self.assertIsInstance(p.T.indptr, np.memmap)
+            self.assertIsInstance(p.R.base, np.memmap)
+            self.assertIsInstance(p.R.values, np.memmap)
+            del p
+
+    def test_dump(self):
+        dump = self.sparse.dump(sparse=True)
+        n_t = (self.T > 0).sum()
+        self.assertEqual(dump.count('\nT: '), n_t)
+        self.assertEqual(dump.count('\nR: '),
+                         (self.sparse.R.base != 0).sum() +
+                         self.sparse.R.n_overrides)
+
+    def test_dump_dense(self):
+        self.assertEqual(self.sparse.dump(sparse=False),
+                         self.dense.dump(sparse=False))
+
+    def test_fingerprint(self):
+        self.assertEqual(self.sparse.fingerprint(),
+                         POMDP.from_json(self.sparse.as_json()).fingerprint())
+        self.assertEqual(self.sparse.fingerprint(), self.dense.fingerprint())
+        # Same rewards with another base
+        R = CompressedReward.from_dense(self.R)
+        R = CompressedReward(R.base + 1., R.shape[-1],
+                             index=np.nonzero(np.ones(R.shape)),
+                             values=self.R.ravel(),
+                             observation_dependent=True)
+        np.testing.assert_array_equal(np.asarray(R), self.R)
+        self.assertEqual(
+            POMDP(self.T, self.O, R, self.start, .9).fingerprint(),
+            self.dense.fingerprint())
+        R = self.R.copy()
+        R[0, 0, 0, 0] += 1.
+        self.assertNotEqual(
+            self.dense.fingerprint(),
+            POMDP(self.T, self.O, R, self.start, .9).fingerprint())
+
+    def test_randomize_rejects_sparse(self):
+        with self.assertRaises(ValueError):
+            self.sparse.randomize()
+        self.sparse.T = np.asarray(self.sparse.T)
+        self.sparse.O = np.asarray(self.sparse.O)
+        self.sparse.randomize()
+        self.assertTrue((self.sparse.T > 0).all())
+
+
+def _tiger():
+    T = np.zeros((3, 2, 2))
+    T[0] = np.eye(2)   # listen
+    T[1:] = .5         # open left or right: reset
+    O = np.full((3, 2, 2), .5)
+    O[0] = [[.85, .15], [.15, .85]]
+    R = np.zeros((3, 2, 2, 2))
+    R[0] = -1.
+    R[1, 0] = -100.  # open left with tiger left
+    R[1, 1] = 10.
+    R[2, 0] = 10.
+    R[2, 1] = -100.
+    return POMDP(T, O, R, np.array([.5, .5]), .95,
+                 states=['tiger-left', 'tiger-right'],
+                 actions=['listen', 'open-left', 'open-right'],
+                 observations=['hear-left', 'hear-right'])
+
+
+class TestPBVI(TestCase):
+
+    def setUp(self):
+        self.tiger = _tiger()
+
+    def test_collect_beliefs(self):
+        b = collect_beliefs(self.tiger, n_beliefs=20,
+                            random_state=np.random.RandomState(1))
+        self.assertLessEqual(b.shape[0], 20)
+        self.assertGreater(b.shape[0], 5)
+        np.testing.assert_allclose(b.sum(-1), 1.)
+        np.testing.assert_allclose(b[0], self.tiger.start)
+
+    def test_tiger_policy(self):
+        pol = self.tiger.solve(method='pbvi', n_iterations=200, seed=1)
+        self.assertIsInstance(pol, GraphPolicy)
+        self.assertEqual(pol.get_action(pol.init), 'listen')
+        self.assertEqual(
+            pol.actions[pol.get_node_from_belief(np.array([.01, .99]))],
+            'open-left')
+        self.assertEqual(
+            pol.actions[pol.get_node_from_belief(np.array([.99, .01]))],
+            'open-right')
+
+    def test_runners(self):
+        pol = solve_pbvi(self.tiger, seed=2)
+        runner = GraphPolicyRunner(pol)
+        self.assertEqual(runner.get_action(), 'listen')
+        runner.step('hear-left')
+        runner.step('hear-left')
+        self.assertEqual(runner.get_action(), 'open-right')
+        runner = GraphPolicyBeliefRunner(pol, self.tiger)
+        runner.step('hear-right')
+        runner.step('hear-right')
+        self.assertEqual(runner.get_action(), 'open-left')
+
+    def test_runners_step_index(self):
+        pol = solve_pbvi(self.tiger, seed=2)
+        o = self.tiger.observations.index('hear-left')
+        for runner in (GraphPolicyRunner(pol),
+                       GraphPolicyBeliefRunner(pol, self.tiger)):
+            runner.step_index(o)
+            runner.step_index(o)
+            self.assertEqual(runner.get_action(), 'open-right')
+
+    def test_given_beliefs(self):
+        beliefs = np.array([[.5, .5], [.9, .1], [.1, .9], [.99, .01]])
+        pol = solve_pbvi(self.tiger, beliefs=beliefs)
+        self.assertLessEqual(pol.n_nodes, beliefs.shape[0])
+        self.assertEqual(pol.values.shape[1], 2)
+
+    def test_warm_start(self):
+        beliefs = collect_beliefs(self.tiger,
+                                  random_state=np.random.RandomState(3))
+        pol = solve_pbvi(self.tiger, beliefs=beliefs, n_iterations=200)
+        warm = solve_pbvi(self.tiger, beliefs=beliefs, n_iterations=1,
+                          values=pol.values)
+        np.testing.assert_allclose(beliefs.dot(warm.values.T).max(-1),
+                                   beliefs.dot(pol.values.T).max(-1),
+                                   atol=.5)
+
+    def test_iteration_limit_is_finite_horizon(self):
+        # Undiscounted one step problem: best is to listen (-1), from the
+        # initial lower bound of -100 (smallest reward for one step)
+        self.tiger.discount = 1.
+        pol = solve_pbvi(self.tiger, beliefs=self.tiger.start[None, :],
+                         n_iterations=1)
+        self.assertEqual(pol.actions, ['listen'])
+        np.testing.assert_allclose(pol.values, [[-101., -101.]])
+
+    def test_undiscounted_cost_model(self):
+        self.tiger.discount = 1.
+        self.tiger.R -= 110.  # Only costs
+        pol = solve_pbvi(self.tiger, n_iterations=5, seed=1)
+        self.assertEqual(set(pol.actions), set(self.tiger.actions))
+        # Values are lower bounds
+        self.assertLessEqual(
+            pol.values.dot(self.tiger.start).max(),
+            qmdp_alphas(self.tiger, n_iterations=5).dot(
+                self.tiger.start).max())
+
+    def test_undiscounted_positive_rewards(self):
+        self.tiger.discount = 1.
+        self.tiger.R += 110.  # Only rewards
+        pol = solve_pbvi(self.tiger, n_iterations=5, seed=1)
+        self.assertLessEqual(
+            pol.values.dot(self.tiger.start).max(),
+            qmdp_alphas(self.tiger, n_iterations=5).dot(
+                self.tiger.start).max() + 1.e-6)
+
+    def test_sparse_model(self):
+        pol = solve_pbvi(self.tiger, seed=1)
+        tiger = POMDP(SparseArray.from_dense(self.tiger.T),
+                      SparseArray.from_dense(self.tiger.O), self.tiger.R,
+                      self.tiger.start, self.tiger.discount,
+                      actions=self.tiger.actions)
+        sparse_pol = solve_pbvi(tiger, seed=1)
+        self.assertEqual(pol.actions, sparse_pol.actions)
+        np.testing.assert_allclose(pol.values, sparse_pol.values)
+
+    def test_timeout(self):
+        pol = solve_pbvi(self.tiger, n_iterations=10 ** 6, timeout=0.,
+                         tolerance=0.)
+        self.assertIsInstance(pol, GraphPolicy)
+
+    def test_solve_with_cache(self):
+        with TemporaryDirectory() as d:
+            cache = FileCache(d)
+            pol = self.tiger.solve(method='pbvi', seed=1, cache=cache)
+            self.assertEqual(len(cache), 1)
+            cached = self.tiger.solve(method='pbvi', seed=1, cache=cache)
+            self.assertEqual(cache.hits, 1)
+            self.assertEqual(cached.actions, pol.actions)
+            self.assertEqual(cached.init, pol.init)
+            np.testing.assert_allclose(cached.values, pol.values)
+            self.assertEqual(cached.transitions.tolist(),
+                             pol.transitions.tolist())
+            # Other parameters or model are solved again
+            self.tiger.solve(method='pbvi', seed=2, cache=cache)
+            self.tiger.discount = .9
+            self.tiger.solve(method='pbvi', seed=1, cache=cache)
+            self.assertEqual(len(cache), 3)
+            self.assertEqual(cache.hits, 1)
+
+    def test_solve_rejects_pbvi_params_for_other_methods(self):
+        with self.assertRaises(TypeError):
+            self.tiger.solve(method='grid', n_beliefs=10)
+        for method in ('qmdp', 'fib'):
+            for params in ({'n_beliefs': 10}, {'tolerance': 1.},
+                           {'values': np.zeros((1, 2))}, {'timeout': 1.},
+                           {'job_timeout': 1.}):
+                with self.assertRaises(TypeError) as cm:
+                    self.tiger.solve(method=method, **params)
+                self.assertIn('Unexpected parameters', str(cm.exception))
+
+
+class TestBounds(TestCase):
+
+    def setUp(self):
+        self.tiger = _tiger()
+
+    def test_mdp_values(self):
+        # Knowing the state, always open the right door
+        np.testing.assert_allclose(mdp_values(self.tiger),
+                                   10. / (1 - .95), rtol=1.e-4)
+        q = mdp_q_values(self.tiger)
+        self.assertEqual(q.shape, (3, 2))
+        np.testing.assert_allclose(q.max(0), mdp_values(self.tiger))
+
+    def test_finite_horizon(self):
+        self.tiger.discount = 1.
+        np.testing.assert_allclose(mdp_values(self.tiger, n_iterations=3),
+                                   30.)
+
+    def test_bounds_are_ordered(self):
+        beliefs = collect_beliefs(self.tiger,
+                                  random_state=np.random.RandomState(0))
+        qmdp = beliefs.dot(qmdp_alphas(self.tiger).T).max(-1)
+        fib = beliefs.dot(fib_alphas(self.tiger).T).max(-1)
+        pbvi = beliefs.dot(solve_pbvi(self.tiger, beliefs=beliefs,
+                                      n_iterations=300).values.T).max(-1)
+        self.assertTrue((fib <= qmdp + 1.e-6).all())
+        self.assertTrue((pbvi <= fib + 1.e-6).all())
+        # FIB knows it needs to listen at uniform belief, QMDP does not
+        self.assertLess(fib[0], qmdp[0])
+
+    def test_fib_on_htm_model(self):
+        p = HTMToPOMDP(T_WAIT, T_ASK, T_TELL, C_INTR, end_reward=.1
+                       ).task_to_pomdp(stool_task_sequential)
+        self.assertIsInstance(p.T, SparseArray)
+        t = time.time()
+        fib = fib_alphas(p, n_iterations=100)
+        self.assertLess(time.time() - t, 2.)
+        # Same as the dense backup
+        M = np.einsum('asz,azo->aosz', np.asarray(p.T), np.asarray(p.O))
+        r = p.expected_rewards()
+        q = np.zeros_like(r)
+        for _ in range(100):
+            q = r + np.einsum('aosz,bz->aosb', M, q).max(-1).sum(1)
+        np.testing.assert_allclose(fib, q)
+        qmdp = qmdp_alphas(p, n_iterations=100)
+        self.assertLessEqual(fib.dot(p.start).max(),
+                             qmdp.dot(p.start).max() + 1.e-6)
+
+    def test_policy_from_alphas(self):
+        pol = policy_from_alphas(self.tiger, fib_alphas(self.tiger), seed=0)
+        self.assertEqual(pol.get_action(pol.init), 'listen')
+        runner = GraphPolicyBeliefRunner(pol, self.tiger)
+        runner.step('hear-left')
+        runner.step('hear-left')
+        self.assertEqual(runner.get_action(), 'open-right')
+
+    def test_solve(self):
+        pol = self.tiger.solve(method='qmdp', seed=0)
+        self.assertIsInstance(pol, GraphPolicy)
+        pol = self.tiger.solve(method='fib', n_iterations=50, seed=0)
+        self.assertEqual(pol.get_action(pol.init), 'listen')
+
 
 class TestPolicy(TestCase):
 
@@ -310,3 +866,30 @@ class TestPolicy(TestCase):
         np.testing.assert_allclose(pol.transitions, p.transitions)
         np.testing.assert_allclose(pol.values, p.values)
         self.assertEqual(self.i, p.init)
+
+    def test_save_load_binary(self):
+        self.t[1][0] = None
+        pol = GraphPolicy(self.a, self.o, self.t, self.v, init=self.i)
+        with TemporaryDirectory() as d:
+            pol.save(d)
+            p = GraphPolicy.load(d, mmap_mode='r')
+            self.assertEqual(self.a, p.actions)
+            self.assertEqual(self.o, p.observations)
+            self.assertEqual(p.transitions.tolist(), self.t)
+            np.testing.assert_array_equal(pol.values, p.values)
+            self.assertEqual(self.i, p.init)
+            del p
+
+    def test_get_nodes_from_beliefs(self):
+        p = GraphPolicy(self.a, self.o, self.t, self.v, init=self.i)
+        beliefs = np.random.dirichlet(np.ones((12,)), 10)
+        np.testing.assert_array_equal(
+            p.get_nodes_from_beliefs(beliefs),
+            [p.get_node_from_belief(b) for b in beliefs])
+
+    def test_next_node(self):
+        p = GraphPolicy(self.a, self.o, self.t, self.v, init=self.i)
+        self.assertEqual(p.next_node(3, 1), p.next(3, 'e'))
+        self.assertEqual(p.observation_index('e'), 1)
+        np.testing.assert_array_equal(
+            p.next_node(np.array([0, 1, 3]), np.array([1, 0, 1])), [1, 2, 2])
@@ -0,0 +1,81 @@
+import os
+import stat
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from task_models.lib.py23 import subprocess
+from task_models.lib.pomdp import GraphPolicy, POMDP
+from task_models.lib.solver_pool import SolverPool, solve_many
+
+from .test_pomdp import _tiger
+
+
+def _tigers():
+    tigers = []
+    for r_listen in [-.5, -1., -5.]:
+        t = _tiger()
+        t.R[0] = r_listen
+        tigers.append(t)
+    return tigers
+
+
+class TestSolverPool(TestCase):
+
+    def setUp(self):
+        self.tigers = _tigers()
+
+    def assertSamePolicy(self, p1, p2):
+        self.assertEqual(p1.actions, p2.actions)
+        np.testing.assert_allclose(p1.values, p2.values)
+
+    def test_solve_async(self):
+        with SolverPool(n_workers=2) as pool:
+            future = pool.solve_async(self.tigers[0], method='pbvi', seed=1)
+            self.assertIsInstance(future.result(), GraphPolicy)
+
+    def test_solve_many_same_as_solve(self):
+        policies = solve_many(self.tigers, n_workers=2, method='pbvi', seed=1)
+        self.assertEqual(len(policies), 3)
+        for t, p in zip(self.tigers, policies):
+            self.assertSamePolicy(p, t.solve(method='pbvi', seed=1))
+
+    def test_processes(self):
+        policies = solve_many(self.tigers, n_workers=2, processes=True,
+                              method='fib', seed=0)
+        for t, p in zip(self.tigers, policies):
+            self.assertSamePolicy(p, t.solve(method='fib', seed=0))
+
+    def test_errors_are_raised(self):
+        with SolverPool(n_workers=2) as pool:
+            with self.assertRaises(TypeError):
+                pool.solve_many(self.tigers, method='grid', n_beliefs=3)
+
+
+class TestJobTimeout(TestCase):
+
+    def setUp(self):
+        # Fake solver that records its working directory and hangs
+        self.tmp = tempfile.mkdtemp()
+        self.record = os.path.join(self.tmp, 'cwd')
+        solver = os.path.join(self.tmp, 'pomdp-solve')
+        with open(solver, 'w') as f:
+            f.write('#!/bin/sh\npwd > {}\nsleep 10\n'.format(self.record))
+        os.chmod(solver, os.stat(solver).st_mode | stat.S_IEXEC)
+        t = _tiger()
+        self.pomdp = POMDP(t.T, t.O, t.R, t.start, t.discount,
+                           solver_path=self.tmp)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_solver_is_killed_and_files_removed(self):
+        with SolverPool(n_workers=1) as pool:
+            future = pool.solve_async(self.pomdp, job_timeout=.5)
+            with self.assertRaises(subprocess.TimeoutExpired):
+                future.result(timeout=5)
+        with open(self.record) as f:
+            workdir = f.read().strip()
+        self.assertFalse(os.path.exists(workdir))
@@ -0,0 +1,147 @@
+from unittest import TestCase
+
+import numpy as np
+
+from task_models.lib.sparse import SparseArray, CompressedReward
+
+
+class TestSparseArray(TestCase):
+
+    def setUp(self):
+        self.a = np.zeros((2, 3, 4))
+        self.a[0, 0, 1] = .5
+        self.a[0, 0, 3] = .5
+        self.a[0, 2, 0] = 1.
+        self.a[1, 1, 2] = 1.
+        self.s = SparseArray.from_dense(self.a)
+
+    def test_toarray(self):
+        np.testing.assert_array_equal(self.s.toarray(), self.a)
+        np.testing.assert_array_equal(np.asarray(self.s), self.a)
+        self.assertEqual(self.s.nnz, 4)
+
+    def test_duplicates_are_summed(self):
+        s = SparseArray((2, 2), ([0, 0, 1], [1, 1, 0]), [.25, .75, 1.])
+        np.testing.assert_array_equal(s.toarray(), [[0., 1.], [1., 0.]])
+
+    def test_integer_lookup(self):
+        self.assertEqual(self.s[0, 0, 3], .5)
+        self.assertEqual(self.s[0, 0, 2], 0.)
+        np.testing.assert_array_equal(
+            self.s[np.array([0, 1, 1]), np.array([2, 1, 0]), 2], [0., 1., 0.])
+
+    def test_other_indices_on_dense(self):
+        np.testing.assert_array_equal(self.s[0, :, 1], self.a[0, :, 1])
+
+    def test_sum(self):
+        np.testing.assert_array_equal(self.s.sum(-1), self.a.sum(-1))
+        with self.assertRaises(ValueError):
+            self.s.sum(0)
+
+    def test_dot_rows(self):
+        w = np.array([.2, .3, .5])
+        np.testing.assert_allclose(
+            self.s.dot_rows(self.s.rows(0, np.arange(3)), w),
+            w.dot(self.a[0]))
+        np.testing.assert_allclose(
+            self.s.dot_rows(self.s.rows(1, np.array([1, 2])), w[1:]),
+            w[1:].dot(self.a[1, 1:]))
+
+    def test_left_dot(self):
+        s = SparseArray.from_dense(self.a[0])
+        b = np.random.random((5, 3))
+        np.testing.assert_allclose(s.left_dot(b), b.dot(self.a[0]))
+        np.testing.assert_allclose(s.left_dot(b[0]), b[0].dot(self.a[0]))
+        with self.assertRaises(ValueError):
+            self.s.left_dot(b)
+
+    def test_right_dot(self):
+        x = np.random.random((4, 2))
+        a = self.a.reshape((-1, 4))
+        np.testing.assert_allclose(self.s.right_dot(x), a.dot(x))
+        np.testing.assert_allclose(self.s.right_dot(x, start=3, stop=6),
+                                   self.a[1].dot(x))
+        np.testing.assert_allclose(self.s.right_dot(x[:, 0]),
+                                   a.dot(x[:, 0]))
+
+    def test_dict(self):
+        s = SparseArray.from_dict(self.s.to_dict())
+        np.testing.assert_array_equal(s.toarray(), self.a)
+
+
+class TestCompressedReward(TestCase):
+
+    def setUp(self):
+        self.R = np.zeros((2, 3, 3, 2))
+        self.R[0] = 1.
+        self.R[1, 1] = 2.
+        self.R[1, 1, 0] = 5.
+        self.R[0, 2, 2] = 3.
+
+    def test_from_dense(self):
+        r = CompressedReward.from_dense(self.R)
+        self.assertFalse(r.observation_dependent)
+        self.assertEqual(r.n_overrides, 2)
+        np.testing.assert_array_equal(r.base, [[1, 1, 1], [0, 2, 0]])
+        np.testing.assert_array_equal(r.toarray(), self.R)
+        np.testing.assert_array_equal(np.asarray(r), self.R)
+
+    def test_from_observation_independent(self):
+        r = CompressedReward.from_dense(self.R[..., :1], n_observations=2)
+        self.assertEqual(r.shape, self.R.shape)
+        np.testing.assert_array_equal(r.toarray(), self.R)
+
+    def test_observation_dependent(self):
+        self.R[1, 0, 2, 1] = -1.
+        r = CompressedReward.from_dense(self.R)
+        self.assertTrue(r.observation_dependent)
+        np.testing.assert_array_equal(r.toarray(), self.R)
+
+    def test_lookup(self):
+        self.R[1, 0, 2, 1] = -1.
+        for R in (self.R, self.R[..., :1].repeat(2, axis=-1)):
+            r = CompressedReward.from_dense(R)
+            index = tuple(np.random.randint(n, size=20) for n in R.shape)
+            np.testing.assert_array_equal(r[index], R[index])
+            self.assertEqual(r[1, 1, 0, 1], 5.)
+            self.assertEqual(r[0, 2, 2, 0], 3.)
+            np.testing.assert_array_equal(r[1, 1, :, :], R[1, 1])
+
+    def test_neg(self):
+        r = -CompressedReward.from_dense(self.R)
+        np.testing.assert_array_equal(r.toarray(), -self.R)
+
+    def test_expected(self):
+        T = np.random.dirichlet(np.ones(3), (2, 3))
+        O = np.random.dirichlet(np.ones(2), (2, 3))
+        self.R[1, 0, 2, 1] = -1.
+        r = CompressedReward.from_dense(self.R)
+        np.testing.assert_allclose(
+            r.expected(T, O), np.einsum('asz,azo,aszo->as', T, O, self.R))
+        np.testing.assert_allclose(
+            r.expected(SparseArray.from_dense(T), SparseArray.from_dense(O)),
+            np.einsum('asz,azo,aszo->as', T, O, self.R))
+
+    def test_canonical(self):
+        # Every entry overridden, with a useless observation dependence
+        r = CompressedReward(np.full((2, 3), 7.), 2,
+                             index=np.nonzero(np.ones(self.R.shape)),
+                             values=self.R.ravel(),
+                             observation_dependent=True)
+        c = r.canonical()
+        d = CompressedReward.from_dense(self.R)
+        self.assertFalse(c.observation_dependent)
+        np.testing.assert_array_equal(c.base, d.base)
+        np.testing.assert_array_equal(c.override_index(), d.override_index())
+        np.testing.assert_array_equal(c.values, d.values)
+
+    def test_canonical_without_overrides(self):
+        r = CompressedReward(np.ones((2, 3)), 2).canonical()
+        self.assertEqual(r.n_overrides, 0)
+        np.testing.assert_array_equal(r.base, np.ones((2, 3)))
+
+    def test_dict(self):
+        self.R[1, 0, 2, 1] = -1.
+        r = CompressedReward.from_dict(
+            CompressedReward.from_dense(self.R).to_dict())
+        np.testing.assert_array_equal(r.toarray(), self.R)
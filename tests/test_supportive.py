@@ -205,6 +205,22 @@ class TestSupportivePOMDPState(TestCase):
         np.testing.assert_array_almost_equal(_s.belief_preferences(b),
                                              np.array([.3, .6]))
 
+    def test_sparse_belief_quotient_and_preferences(self):
+        array = np.random.dirichlet(np.ones((self._s.n_states,)))
+        array[np.random.random(array.shape) < .5] = 0.
+        array /= array.sum()
+        states = np.flatnonzero(array)
+        np.testing.assert_allclose(
+            self._s.sparse_belief_quotient(states, array[states]),
+            self._s.belief_quotient(array))
+        prefs = np.zeros((self._s.n_preferences,))
+        for s in states:
+            _s = _SupportivePOMDPState(5, 3, 2, 4, s=s)
+            for i in range(self._s.n_preferences):
+                prefs[i] += array[s] * _s.has_preference(i)
+        np.testing.assert_allclose(
+            self._s.sparse_belief_preferences(states, array[states]), prefs)
+
     def test_random_object_changes(self):
         self._s.htm = 2
         self._s.set_object(1, 1)
@@ -472,6 +488,55 @@ class TestSupportivePOMDP(TestCase):
         self.assertEqual(r, 10. - p.cost_hold + 10.)
 
 
+    def test_sample_transition_batch_matches_sample_transition(self):
+        htm = SequentialCombination([self.alt, self.af, self.atj])
+        p = SupportivePOMDP(htm)
+        p.reward_independent_preference = True
+        states = np.arange(p.n_states)
+        for a in range(p.n_actions):
+            actions = np.full(states.shape, a)
+            new_s, o, r = p.sample_transition_batch(actions, states,
+                                                    random=False)
+            for i, s in enumerate(states):
+                self.assertEqual((new_s[i], o[i], r[i]),
+                                 p.sample_transition(a, s, random=False))
+
+    def test_observation_probability(self):
+        htm = SequentialCombination([self.alt, self.af])
+        p = SupportivePOMDP(htm)
+        p.p_changed_by_human = 0.
+        p.p_fail = .5
+        for s in range(p.n_states):
+            for a in range(p.n_actions):
+                new_s, o, _ = p.sample_transition(a, s)
+                probabilities = [
+                    p.observation_probability(a, np.array([s]),
+                                              np.array([new_s]), x)[0]
+                    for x in range(p.n_observations)]
+                self.assertGreater(probabilities[o], 0.)
+                self.assertAlmostEqual(sum(probabilities), 1.)
+
+    def test_observation_probability_with_human_changes(self):
+        htm = SequentialCombination([self.alt, self.af])
+        p = SupportivePOMDP(htm)
+        p.p_changed_by_human = .3
+        for s in range(p.n_states):
+            for a in range(p.n_actions):
+                for _ in range(5):
+                    new_s, o, _ = p.sample_transition(a, s)
+                    probabilities = [
+                        p.observation_probability(a, np.array([s]),
+                                                  np.array([new_s]), x)[0]
+                        for x in range(p.n_observations)]
+                    self.assertGreater(probabilities[o], 0.)
+                    self.assertAlmostEqual(sum(probabilities), 1.)
+
+    def test_sample_transition_batch_counts_calls(self):
+        self.p.sample_transition_batch(np.zeros(5, dtype=int),
+                                       np.zeros(5, dtype=int))
+        self.assertEqual(self.p.n_simulator_calls, 5)
+
+
 class TestNHTMHorizon(TestCase):
 
     def setUp(self):
@@ -505,3 +570,21 @@ class TestNHTMHorizon(TestCase):
         s = _s.to_int()
         self.h.decrement(1, s, s, 0)
         self.assertTrue(self.h.is_reached())
+
+    def test_batch(self):
+        h = NHTMHorizon(self.model, 2).batch(3)
+        self.assertFalse(h.is_reached().any())
+        _s = self.model._int_to_state()
+        _moved = self.model._int_to_state()
+        _moved.htm = 1
+        _final = self.model._int_to_state()
+        _final.htm = self.model.htm_final
+        lanes = np.array([0, 1, 2])
+        s = np.full((3,), _s.to_int())
+        h.decrement(lanes, None, s,
+                    np.array([_s.to_int(), _moved.to_int(), _final.to_int()]),
+                    None)
+        np.testing.assert_array_equal(h.is_reached(), [False, False, True])
+        h.decrement(lanes[:2], None, s[:2], np.full((2,), _moved.to_int()),
+                    None)
+        np.testing.assert_array_equal(h.is_reached(), [False, True, True])
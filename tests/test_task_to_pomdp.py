@@ -6,6 +6,7 @@ from task_models.task import (HierarchicalTask, LeafCombination, SequentialCombi
                               AlternativeCombination)
 from task_models.task_to_pomdp import (HTMToPOMDP, CollaborativeAction, _name_radix,
                                        _NodeToPOMDP)
+from task_models.lib.sparse import SparseArray, CompressedReward
 
 
 class TestNameRadix(TestCase):
@@ -630,6 +631,28 @@ class TestHTM2POMDP(TestCase):
                              (9, 7, 7, 4))
         np.testing.assert_array_equal(R, p.R)
 
+    def test_compressed_reward(self):
+        h2p = HTMToPOMDP(1., 2., 1., 1., end_reward=13.)
+        task = HierarchicalTask(root=SequentialCombination([
+            LeafCombination(CollaborativeAction('Do a', (3., 2., 5.))),
+            LeafCombination(CollaborativeAction('Do b', (2., 3., 4.))),
+            ], name='Do all'))
+        p = h2p.task_to_pomdp(task)
+        self.assertIsInstance(p.R, CompressedReward)
+        self.assertFalse(p.R.observation_dependent)
+        self.assertLess(p.R.nbytes, np.asarray(p.R).nbytes)
+
+    def test_sparse_transitions(self):
+        h2p = HTMToPOMDP(1., 2., 1., 1., end_reward=13.)
+        task = HierarchicalTask(root=SequentialCombination([
+            LeafCombination(CollaborativeAction('Do a', (3., 2., 5.))),
+            LeafCombination(CollaborativeAction('Do b', (2., 3., 4.))),
+            ], name='Do all'))
+        p = h2p.task_to_pomdp(task)
+        self.assertIsInstance(p.T, SparseArray)
+        self.assertLess(p.T.nbytes, np.asarray(p.T).nbytes)
+        np.testing.assert_allclose(np.asarray(p.T).sum(-1), 1.)
+
     def test_end_reward(self):
         h2p = HTMToPOMDP(1., 2., 1., 1., end_reward=13.)
         task = HierarchicalTask(root=LeafCombination(